@@ -0,0 +1,188 @@
+"""
+Cost model to balance the work of the parallel engines
+
+The time of the intersection of a pair of polygons grows with the vertices
+of both, and a few properties and alerts have most of the vertices, so
+partitions with the same number of rows can take very different times and
+the slowest one sets the wall time of the run. The cost of a candidate pair
+is estimated as the sum of the vertices of its geometries, so the cost of a
+feature is its vertices times its candidate pairs plus the vertices of the
+candidates.
+
+The work is grouped in units (the pairs of a CAR feature, or the tiles), the
+units that cost more than a partition should are split, and the units are
+assigned with the LPT (longest processing time first) rule: sorted by
+decreasing cost, each one goes to the partition with the lowest cost so far.
+"""
+
+import heapq
+
+import numpy as np
+import shapely
+
+from loaders import iter_arrow
+from utils import info
+
+# Depth limit of the split of the tiles (each level divides a tile in 4)
+MAX_DEPTH = 4
+
+
+def pair_costs(left: np.ndarray = None, right: np.ndarray = None,
+               idx_left: np.ndarray = None,
+               idx_right: np.ndarray = None) -> np.ndarray:
+    """Estimated cost of each candidate pair, the sum of the vertices of its
+    geometries"""
+    vertices_left = shapely.get_num_coordinates(left)
+    vertices_right = shapely.get_num_coordinates(right)
+
+    return (vertices_left[idx_left] + vertices_right[idx_right]).astype(float)
+
+
+def lpt(costs: np.ndarray = None, n: int = 1) -> np.ndarray:
+    """Assign the units to n partitions with the LPT rule
+
+    Returns:
+        Partition of each unit
+    """
+    heap = [(0.0, i) for i in range(n)]
+    assignment = np.empty(len(costs), dtype=int)
+    for unit in np.argsort(costs, kind='stable')[::-1]:
+        load, part = heapq.heappop(heap)
+        assignment[unit] = part
+        heapq.heappush(heap, (load + costs[unit], part))
+
+    return assignment
+
+
+def imbalance(costs: np.ndarray = None, assignment: np.ndarray = None,
+              n: int = 1) -> float:
+    """Cost of the largest partition relative to the mean (1 is perfect)"""
+    loads = np.bincount(assignment, weights=costs, minlength=n)
+    mean = loads.sum() / n
+
+    return float(loads.max() / mean) if mean else 1.0
+
+
+def balance_pairs(idx_left: np.ndarray = None, costs: np.ndarray = None,
+                  n: int = 1) -> list:
+    """Partitions of the candidate pairs with about the same cost
+
+    The pairs of a CAR feature stay together, so the feature is read once
+    by one partition, unless they cost more than the mean cost of a
+    partition: then they are split in chunks of at most that cost.
+
+    Args:
+        idx_left: CAR feature of each pair
+        costs: Estimated cost of each pair (see `pair_costs`)
+        n: Number of partitions
+
+    Returns:
+        List with the indices of the pairs of each partition
+    """
+    if not len(idx_left):
+        return [np.empty(0, dtype=int) for _ in range(n)]
+
+    limit = costs.sum() / n
+    if not limit > 0:
+        # Without costs every feature would be an outlier, so the features
+        # are dealt to the partitions in turn
+        _, features = np.unique(idx_left, return_inverse=True)
+        part = features.ravel() % n
+        return [np.flatnonzero(part == i) for i in range(n)]
+
+    order = np.argsort(idx_left, kind='stable')
+    keys = idx_left[order]
+    cumulative = np.cumsum(costs[order])
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    offset = np.repeat(cumulative[starts] - costs[order][starts],
+                       np.diff(np.r_[starts, len(keys)]))
+    # Chunk of each pair in its feature, 0 unless the feature is an outlier
+    chunk = ((cumulative - costs[order] - offset) // limit).astype(int)
+
+    _, units = np.unique(np.column_stack([keys, chunk]), axis=0,
+                         return_inverse=True)
+    units = units.ravel()
+    unit_costs = np.bincount(units, weights=costs[order])
+    assignment = lpt(unit_costs, n)
+
+    split = int((np.bincount(keys, weights=chunk > 0) > 0).sum())
+    info(f'{len(unit_costs)} work units in {n} partitions, {split} '
+         f'features split, estimated imbalance '
+         f'{imbalance(unit_costs, assignment, n):.2f}')
+
+    part = assignment[units]
+    return [order[part == i] for i in range(n)]
+
+
+def feature_costs(file_path: str = '') -> tuple:
+    """Bounds, center of the bounds and number of vertices of each feature
+    of the layer
+
+    The geometries are decoded batch by batch and not kept.
+    """
+    bounds, vertices = [np.empty((0, 4))], [np.empty(0)]
+    for _, geom_col, batch in iter_arrow(file_path):
+        geoms = shapely.from_wkb(batch[geom_col].to_numpy(
+            zero_copy_only=False))
+        bounds.append(shapely.bounds(geoms))
+        vertices.append(shapely.get_num_coordinates(geoms))
+
+    bounds, vertices = np.concatenate(bounds), np.concatenate(vertices)
+    valid = ~np.isnan(bounds).any(axis=1)
+    bounds, vertices = bounds[valid], vertices[valid]
+    centers = np.column_stack([(bounds[:, 0] + bounds[:, 2]) / 2,
+                               (bounds[:, 1] + bounds[:, 3]) / 2])
+
+    return bounds, centers, vertices.astype(float)
+
+
+def _tile_cost(tile: tuple = None, centers: np.ndarray = None,
+               costs: np.ndarray = None) -> float:
+    inside = (centers[:, 0] >= tile[0]) & (centers[:, 0] < tile[2]) & \
+        (centers[:, 1] >= tile[1]) & (centers[:, 1] < tile[3])
+    return float(costs[inside].sum())
+
+
+def balance_tiles(tiles: list = None, centers: np.ndarray = None,
+                  costs: np.ndarray = None, workers: int = 1,
+                  max_depth: int = MAX_DEPTH) -> list:
+    """Split the costly tiles and sort the tiles by decreasing cost
+
+    A tile that costs more than half of the mean cost of a worker is split
+    in 4, so no tile can hold a worker much longer than the others. The
+    pool takes the tiles in order, which is the LPT rule.
+
+    Args:
+        tiles: Tiles (xmin, ymin, xmax, ymax)
+        centers: Points (x, y) where the cost is located
+        costs: Cost of each point (Ex.: vertices of the alerts)
+        workers: Number of workers
+        max_depth: Maximum number of splits of a tile
+
+    Returns:
+        List of tiles, from the most to the least costly
+    """
+    if not len(tiles):
+        return []
+
+    limit = costs.sum() / workers / 2
+    todo = [(tuple(tile), 0) for tile in tiles]
+    result = []
+    while todo:
+        tile, depth = todo.pop()
+        cost = _tile_cost(tile, centers, costs)
+        if cost <= limit or depth >= max_depth:
+            result.append((cost, tile))
+            continue
+        xmid, ymid = (tile[0] + tile[2]) / 2, (tile[1] + tile[3]) / 2
+        todo += [((tile[0], tile[1], xmid, ymid), depth + 1),
+                 ((xmid, tile[1], tile[2], ymid), depth + 1),
+                 ((tile[0], ymid, xmid, tile[3]), depth + 1),
+                 ((xmid, ymid, tile[2], tile[3]), depth + 1)]
+
+    result.sort(key=lambda r: r[0], reverse=True)
+    info(f'{len(result)} tiles ({len(result) - len(tiles):+d} from the '
+         f'split), the most costly with '
+         f'{result[0][0] / (costs.sum() or 1):.1%} of the cost')
+
+    return [tile for _, tile in result]
@@ -0,0 +1,779 @@
+"""
+Script to run the benchmark of the engines
+
+Executes each engine script against the same inputs N times, with warmup
+runs and cold/warm file cache modes, and saves the results of every run and
+the aggregated statistics to JSON and CSV files. The results of each engine
+are compared with the reference results (see verify.py), and the timings of
+an engine whose results differ are marked as invalid. With -memory, the
+memory of the process tree of each run is sampled (see memprofile.py) and
+the timeline and the peak memory of each stage are saved. With -grid, each
+engine also runs with each grid size, and the speedup and the area error of
+the fixed precision are reported. With -subdivide, the engines that support
+it also run with each threshold of vertices of the subdivision, and the
+thresholds from which it pays off are reported.
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from pyproj import CRS
+
+import memprofile
+from loaders import layer_crs
+from utils import info, input_files, STAGES_FILE_ENV
+from verify import compare, log_report, read_results
+from writers import FORMATS
+
+# Engine name -> script executed by the runner
+ENGINES = {
+    'geopandas': 'process_geopandas.py',
+    'dask-geopandas': 'process_dask-geopandas.py',
+    'duckdb_01': 'process_duckdb_01.py',
+    'duckdb_02': 'process_duckdb_02.py',
+    'tiled': 'process_tiled.py',
+    'streaming': 'process_streaming.py',
+}
+
+# Engine name -> name of its results file (without extension)
+RESULTS_NAMES = {
+    'geopandas': 'results_geopandas',
+    'dask-geopandas': 'results_dask-geopandas',
+    'duckdb_01': 'results_duckdb',
+    'duckdb_02': 'results_duckdb_02',
+    'tiled': 'results_tiled',
+    'streaming': 'results_streaming',
+}
+
+CACHE_MODES = ['warm', 'cold']
+
+# Engines with the subdivision of the geometries (option -subdivide)
+SUBDIVIDE_ENGINES = ['geopandas', 'duckdb_01', 'duckdb_02']
+
+# Length of a degree at the equator, to convert a grid size in degrees to
+# meters (an upper bound)
+METERS_PER_DEGREE = 111320
+
+
+def _drop_file_cache(files: list = None) -> bool:
+    """Evict the input files from the OS page cache
+
+    Tries to drop the whole page cache (Linux, requires root) and falls back
+    to posix_fadvise(DONTNEED) on each file.
+
+    Returns:
+        True if the cache was evicted
+    """
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+        return True
+    except (OSError, AttributeError):
+        pass
+
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+
+    for file in files:
+        fd = os.open(file, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+    return True
+
+
+def _percentile(values: list = None, pct: float = 95) -> float:
+    """Percentile with linear interpolation between the closest ranks"""
+    values = sorted(values)
+    if len(values) == 1:
+        return values[0]
+
+    rank = (len(values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def aggregate(values: list = None) -> dict:
+    """Summary statistics of the wall times of the measured runs"""
+    if not values:
+        return {'n': 0}
+
+    return {
+        'n': len(values),
+        'mean': statistics.fmean(values),
+        'median': statistics.median(values),
+        'p95': _percentile(values, 95),
+        'stddev': statistics.stdev(values) if len(values) > 1 else 0.0,
+        'min': min(values),
+        'max': max(values),
+    }
+
+
+def run_engine(engine: str = '', car_file_path: str = '',
+               mp_file_path: str = '', path_results: str = '',
+               cache_mode: str = 'warm', variant: str = '',
+               args: list = None, memory_interval: float = None,
+               uss: bool = True) -> dict:
+    """Run the engine script once in a new process
+
+    Args:
+        variant: Label of the extra arguments, saved in the record
+        args: Extra arguments of the engine script
+        memory_interval: Interval in seconds to sample the memory of the
+            process tree. Default: no sampling
+        uss: Sample the USS besides the RSS
+
+    Returns:
+        Record of the run
+    """
+    script = Path(__file__).parent / ENGINES[engine]
+    cmd = [sys.executable, script.__str__(), f'-car={car_file_path}',
+           f'-mp={mp_file_path}', f'-r={path_results}', *(args or [])]
+
+    cache_dropped = False
+    if cache_mode == 'cold':
+        files = input_files(car_file_path) + input_files(mp_file_path)
+        cache_dropped = _drop_file_cache(files)
+
+    # The engine appends the records of its stages to this file
+    fd, stages_file = tempfile.mkstemp(prefix='stages_', suffix='.jsonl')
+    os.close(fd)
+    env = dict(os.environ, **{STAGES_FILE_ENV: stages_file})
+
+    started = time.time()
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, text=True, env=env)
+    sampler = memprofile.MemorySampler(proc.pid, memory_interval, uss) \
+        .start() if memory_interval else None
+    _, stderr = proc.communicate()
+    wall = time.perf_counter() - start
+    samples = sampler.stop() if sampler else None
+
+    with open(stages_file) as f:
+        stages = [json.loads(line) for line in f if line.strip()]
+    os.remove(stages_file)
+
+    if proc.returncode != 0:
+        info(f'Engine {engine} failed with code {proc.returncode}')
+        print(stderr[-2000:], flush=True)
+
+    record = {
+        'engine': engine,
+        'cache_mode': cache_mode,
+        'variant': variant,
+        'cache_dropped': cache_dropped,
+        'started': started,
+        'wall_s': wall,
+        'returncode': proc.returncode,
+        'stages': stages,
+    }
+    if samples is not None:
+        record.update(memprofile.summarize(samples, stages))
+        if record['peak_rss_mb'] is not None:
+            uss_mb = record['peak_uss_mb']
+            info(f'Peak memory: RSS {record["peak_rss_mb"]:.1f} MB'
+                 f'{f", USS {uss_mb:.1f} MB" if uss_mb is not None else ""}')
+
+    return record
+
+
+def results_file(path_results: str = '', engine: str = '',
+                 since: float = 0) -> str | None:
+    """Results file of the engine written after the time since"""
+    extensions = [ext for ext, _ in FORMATS.values()]
+    files = [p for p in Path(path_results).glob(f'{RESULTS_NAMES[engine]}.*')
+             if p.suffix in extensions and p.stat().st_mtime >= since]
+    if not files:
+        return None
+
+    return max(files, key=lambda p: p.stat().st_mtime).__str__()
+
+
+def _measured(runs: list = None, engine: str = '', cache_mode: str = '',
+              variant: str = '') -> list:
+    """Successful runs of the engine, excluding the warmups"""
+    return [r for r in runs
+            if r['engine'] == engine and r['cache_mode'] == cache_mode and
+            r['variant'] == variant and not r['warmup'] and
+            r['returncode'] == 0]
+
+
+def _memory_summary(runs: list = None, engine: str = '',
+                    cache_mode: str = '', variant: str = '') -> list:
+    """Peak memory of the whole run and of each stage, the highest of the
+    runs of the engine
+
+    The failed runs are included, as a run killed when the memory ran out
+    shows the memory it needed up to that point.
+    """
+    sampled = [r for r in runs
+               if r['engine'] == engine and r['cache_mode'] == cache_mode and
+               r['variant'] == variant and not r['warmup'] and
+               'timeline' in r]
+    if not sampled:
+        return []
+
+    def _max(values):
+        values = [v for v in values if v is not None]
+        return max(values) if values else None
+
+    failed = sum(r['returncode'] != 0 for r in sampled)
+    rows = [{'engine': engine, 'cache_mode': cache_mode, 'variant': variant,
+             'stage': 'total',
+             'peak_rss_mb_max': _max([r['peak_rss_mb'] for r in sampled]),
+             'peak_uss_mb_max': _max([r['peak_uss_mb'] for r in sampled]),
+             'runs': len(sampled), 'failed': failed}]
+
+    names = []
+    for r in sampled:
+        names += [s['stage'] for s in r['memory_stages']
+                  if s['stage'] not in names]
+    for name in names:
+        peaks = [s for r in sampled for s in r['memory_stages']
+                 if s['stage'] == name]
+        rows.append({'engine': engine, 'cache_mode': cache_mode,
+                     'variant': variant, 'stage': name,
+                     'peak_rss_mb_max': _max([s['peak_rss_mb']
+                                              for s in peaks]),
+                     'peak_uss_mb_max': _max([s['peak_uss_mb']
+                                              for s in peaks]),
+                     'runs': len(sampled), 'failed': failed})
+
+    return rows
+
+
+def format_variants(formats: list = None) -> list:
+    """Variants (label, arguments) to run the engines with each output
+    format"""
+    return [(f'format={f}', ['-format', f]) for f in formats or []]
+
+
+def _sweep_variants(variants: list = None, option: str = '',
+                    name: str = '', values: list = None) -> list:
+    """Variants without the option and with each value of it
+
+    The integers are formatted in full (1e+06 would not parse as int).
+    """
+    variants = variants or [('', [])]
+    texts = [str(v) if isinstance(v, int) else f'{v:g}'
+             for v in values or []]
+
+    return variants + [
+        (', '.join(filter(None, [label, f'{name}={text}'])),
+         [*args, option, text])
+        for label, args in variants for text in texts]
+
+
+def grid_variants(grids: list = None, variants: list = None) -> list:
+    """Variants to run the engines with full precision and with each grid
+    size"""
+    return _sweep_variants(variants, '-grid', 'grid', grids)
+
+
+def subdivide_variants(thresholds: list = None,
+                       variants: list = None) -> list:
+    """Variants to run the engines without subdivision and with each
+    threshold of vertices"""
+    return _sweep_variants(variants, '-subdivide', 'subdivide', thresholds)
+
+
+def _grid_tolerance(grid: str = None, car_file_path: str = '') -> float:
+    """Half a cell of the grid in meters (units of the results)
+
+    The engines snap different pieces to the grid (Ex.: with the
+    subdivision), so the same vertex can be rounded to a neighbour cell.
+    """
+    if not grid:
+        return 0
+    crs = CRS.from_user_input(layer_crs(car_file_path) or 'EPSG:4674')
+    size = float(grid) * (METERS_PER_DEGREE if crs.is_geographic else 1)
+
+    return size / 2
+
+
+def _option(args: list = None, option: str = '') -> str | None:
+    """Value of the option in the arguments, or None"""
+    return args[args.index(option) + 1] if option in args else None
+
+
+def _sweep_rows(combinations: list = None, summary: list = None,
+                verifications: list = None, option: str = '') -> list:
+    """Combinations run with the option, with the median and the
+    verification report of the same variant without it
+
+    Returns:
+        List of tuples (engine, cache_mode, variant, value, median,
+        base_median, report, base_report)
+    """
+    medians = {(s['engine'], s['cache_mode'], s['variant']): s.get('median')
+               for s in summary}
+    reports = {(v['engine'], v['cache_mode'], v['variant']): v
+               for v in verifications}
+    labels = {(engine, cache_mode, tuple(args)): variant
+              for engine, cache_mode, variant, args in combinations}
+
+    rows = []
+    for engine, cache_mode, variant, args in combinations:
+        if option not in args:
+            continue
+        i = args.index(option)
+        base = labels.get((engine, cache_mode, tuple(args[:i] + args[i + 2:])))
+        rows.append((engine, cache_mode, variant, float(args[i + 1]),
+                     medians.get((engine, cache_mode, variant)),
+                     medians.get((engine, cache_mode, base)),
+                     reports.get((engine, cache_mode, variant), {}),
+                     reports.get((engine, cache_mode, base), {})))
+
+    return rows
+
+
+def precision_summary(combinations: list = None, summary: list = None,
+                      verifications: list = None) -> list:
+    """Speedup of each grid size over the same variant with full precision,
+    and the error of the results against the full precision reference"""
+    rows = []
+    for engine, cache_mode, variant, grid_size, median, base_median, \
+            report, base_report in _sweep_rows(combinations, summary,
+                                               verifications, '-grid'):
+        report = {k[len('precision_'):]: v for k, v in report.items()
+                  if k.startswith('precision_')}
+        vertices = report.get('vertices_actual')
+        vertices_expected = report.get('vertices_expected')
+        rows.append({
+            'engine': engine, 'cache_mode': cache_mode, 'variant': variant,
+            'grid_size': grid_size,
+            'median': median, 'base_median': base_median,
+            'speedup': base_median / median
+            if median and base_median else None,
+            'area_max_delta': report.get('area_max_delta'),
+            'area_rel_error': report.get('area_rel_error'),
+            'geom_max_symdiff': report.get('geom_max_symdiff'),
+            'vertices': vertices,
+            'vertex_change': vertices / vertices_expected - 1
+            if vertices_expected else None,
+            'invalid': report.get('invalid_actual'),
+            'invalid_base': base_report.get('invalid_actual'),
+        })
+
+    return rows
+
+
+def subdivision_summary(combinations: list = None, summary: list = None,
+                        verifications: list = None) -> list:
+    """Speedup of each threshold of vertices of the subdivision over the
+    same variant without subdivision"""
+    rows = []
+    for engine, cache_mode, variant, threshold, median, base_median, \
+            report, _ in _sweep_rows(combinations, summary, verifications,
+                                     '-subdivide'):
+        rows.append({
+            'engine': engine, 'cache_mode': cache_mode, 'variant': variant,
+            'max_vertices': int(threshold),
+            'median': median, 'base_median': base_median,
+            'speedup': base_median / median
+            if median and base_median else None,
+            'geom_max_symdiff': report.get('geom_max_symdiff'),
+            'ok': report.get('ok'),
+        })
+
+    return rows
+
+
+def _log_precision(rows: list = None) -> None:
+    for row in rows:
+        if row['speedup'] is None:
+            info(f'{row["engine"]} [{row["variant"]}] '
+                 f'({row["cache_mode"]}): no timings to compare')
+            continue
+        msg = (f'{row["engine"]} [{row["variant"]}] ({row["cache_mode"]}): '
+               f'speedup {row["speedup"]:.2f}')
+        if row['area_rel_error'] is not None:
+            msg += (f', area error {row["area_rel_error"]:.3g} '
+                    f'(max {row["area_max_delta"]:.3g} ha), '
+                    f'vertices {row["vertex_change"]:+.1%}, '
+                    f'{row["invalid"]} invalid geometries')
+        info(msg)
+
+
+def _log_subdivision(rows: list = None) -> None:
+    """Log the speedup of each threshold and the thresholds from which the
+    subdivision pays off for each engine"""
+    groups = {}
+    for row in rows:
+        if row['speedup'] is None:
+            info(f'{row["engine"]} [{row["variant"]}] '
+                 f'({row["cache_mode"]}): no timings to compare')
+            continue
+        info(f'{row["engine"]} [{row["variant"]}] ({row["cache_mode"]}): '
+             f'speedup {row["speedup"]:.2f}'
+             f'{"" if row["ok"] in (True, None) else " - results differ"}')
+        groups.setdefault((row['engine'], row['cache_mode']), []).append(row)
+
+    for (engine, cache_mode), group in groups.items():
+        pays = sorted({r['max_vertices'] for r in group
+                       if r['speedup'] > 1 and r['ok'] in (True, None)})
+        if not pays:
+            info(f'{engine} ({cache_mode}): the subdivision does not pay '
+                 f'off with any threshold')
+            continue
+        best = max(group, key=lambda r: r['speedup'])
+        info(f'{engine} ({cache_mode}): the subdivision pays off with '
+             f'{", ".join(map(str, pays))} vertices, best '
+             f'{best["max_vertices"]} (speedup {best["speedup"]:.2f})')
+
+
+def run(engines: list = None, car_file_path: str = '',
+        mp_file_path: str = '', path_results: str = '',
+        repetitions: int = 5, warmups: int = 1,
+        cache_modes: list = None, path_output: str = '',
+        variants: list = None, verify: bool = True,
+        reference_file_path: str = '', memory_interval: float = None,
+        uss: bool = True) -> dict:
+    """Run the engines and save the results
+
+    Args:
+        variants: List of tuples (label, extra arguments), each engine is
+            run with each variant, or dict engine -> list of variants of the
+            engine. Default: only the default arguments
+        verify: Compare the results of the last run of each engine with the
+            reference results, and mark the runs as invalid when they differ
+        reference_file_path: File path of the reference results. Default:
+            the results of the first engine
+        memory_interval: Interval in seconds to sample the memory of the
+            runs. Default: no sampling
+        uss: Sample the USS besides the RSS
+    """
+    cache_modes = cache_modes or ['warm']
+    variants = variants or [('', [])]
+    if not isinstance(variants, dict):
+        variants = {engine: variants for engine in engines}
+    combinations = [(engine, cache_mode, variant, args)
+                    for engine in engines for cache_mode in cache_modes
+                    for variant, args in variants.get(engine) or [('', [])]]
+    runs = []
+    verifications = []
+    # The results with a grid size are checked against the first results
+    # with the same grid size, and against the full precision reference
+    # (key None) only for the precision summary
+    references = {None: read_results(reference_file_path)
+                  if verify and reference_file_path else None}
+
+    for engine, cache_mode, variant, args in combinations:
+        label = f'{engine} [{variant}]' if variant else engine
+        records = []
+        for i in range(warmups + repetitions):
+            warmup = i < warmups
+            info(f'Running {label} ({cache_mode} cache, '
+                 f'{"warmup" if warmup else "run"} '
+                 f'{i + 1 - (0 if warmup else warmups)})...')
+            record = run_engine(engine=engine,
+                                car_file_path=car_file_path,
+                                mp_file_path=mp_file_path,
+                                path_results=path_results,
+                                cache_mode=cache_mode, variant=variant,
+                                args=args, memory_interval=memory_interval,
+                                uss=uss)
+            record['warmup'] = warmup
+            record['repetition'] = i - warmups
+            records.append(record)
+        runs += records
+
+        if not verify:
+            continue
+
+        # The results file is rewritten by each run, so the last one is
+        # checked
+        file_results = results_file(path_results, engine,
+                                    records[-1]['started'])
+        report = {'engine': engine, 'cache_mode': cache_mode,
+                  'variant': variant, 'file': file_results}
+        if records[-1]['returncode'] != 0 or file_results is None:
+            info(f'No results of {label} to verify')
+            report['ok'] = False
+        else:
+            grid = _option(args, '-grid')
+            actual = read_results(file_results)
+            if references.get(grid) is None:
+                info(f'Using the results of {label} as reference'
+                     f'{f" for grid {grid}" if grid else ""}')
+                references[grid] = actual
+                report['ok'] = True
+            else:
+                info(f'Verifying the results of {label}...')
+                report.update(compare(
+                    references[grid], actual,
+                    length_tol=_grid_tolerance(grid, car_file_path)))
+                log_report(report)
+            if grid and references[None] is not None:
+                report.update({f'precision_{k}': v for k, v in
+                               compare(references[None], actual).items()})
+        verifications.append(report)
+
+        for record in records:
+            record['valid'] = report['ok']
+
+    summary = []
+    for engine, cache_mode, variant, _ in combinations:
+        values = [r['wall_s']
+                  for r in _measured(runs, engine, cache_mode, variant)]
+        stats = aggregate(values)
+        valid = all(r.get('valid', True)
+                    for r in _measured(runs, engine, cache_mode, variant))
+        summary.append({'engine': engine, 'cache_mode': cache_mode,
+                        'variant': variant, 'valid': valid, **stats})
+        if stats['n']:
+            label = f'{engine} [{variant}]' if variant else engine
+            info(f'{label} ({cache_mode}): '
+                 f'median {stats["median"]:.3f} s, '
+                 f'p95 {stats["p95"]:.3f} s, '
+                 f'stddev {stats["stddev"]:.3f} s'
+                 f'{"" if valid else " - INVALID, results differ"}')
+
+    stage_summary = []
+    for engine, cache_mode, variant, _ in combinations:
+        measured = _measured(runs, engine, cache_mode, variant)
+        names = []
+        for r in measured:
+            names += [s['stage'] for s in r['stages']
+                      if s['stage'] not in names]
+        for name in names:
+            records = [s for r in measured for s in r['stages']
+                       if s['stage'] == name]
+            rss = [s['peak_rss_mb'] for s in records
+                   if s['peak_rss_mb'] is not None]
+            stage_summary.append({
+                'engine': engine, 'cache_mode': cache_mode,
+                'variant': variant, 'stage': name,
+                'wall_median': statistics.median(
+                    [s['wall_s'] for s in records]),
+                'cpu_median': statistics.median(
+                    [s['cpu_s'] for s in records]),
+                'peak_rss_mb_max': max(rss) if rss else None,
+                'features': records[-1]['features'],
+                'vertices': records[-1]['vertices'],
+            })
+
+    memory_summary = []
+    if memory_interval:
+        for engine, cache_mode, variant, _ in combinations:
+            memory_summary += _memory_summary(runs, engine, cache_mode,
+                                              variant)
+
+    precision = precision_summary(combinations, summary, verifications)
+    _log_precision(precision)
+    subdivision = subdivision_summary(combinations, summary, verifications)
+    _log_subdivision(subdivision)
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+        },
+        'inputs': {'car': car_file_path, 'mp': mp_file_path},
+        'repetitions': repetitions,
+        'warmups': warmups,
+        'runs': runs,
+        'summary': summary,
+        'stage_summary': stage_summary,
+        'memory_summary': memory_summary,
+        'precision': precision,
+        'subdivision': subdivision,
+        'verification': verifications,
+    }
+    save_results(results, path_output)
+
+    return results
+
+
+def _write_csv(file_path: Path = None, rows: list = None) -> None:
+    fields = []
+    for row in rows:
+        fields += [k for k in row if k not in fields]
+
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def save_results(results: dict = None, path_output: str = '') -> None:
+    """Save the benchmark results to JSON and the runs, stages and summaries
+    to CSV"""
+    name = f'benchmark_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+
+    file_json = Path(path_output, f'{name}.json')
+    with open(file_json, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    runs = [{k: v for k, v in r.items()
+             if k not in ('stages', 'memory_stages', 'timeline')}
+            for r in results['runs']]
+    stages = [{'engine': r['engine'], 'cache_mode': r['cache_mode'],
+               'variant': r['variant'], 'warmup': r['warmup'],
+               'repetition': r['repetition'], **s}
+              for r in results['runs'] for s in r['stages']]
+    _write_csv(Path(path_output, f'{name}_runs.csv'), runs)
+    _write_csv(Path(path_output, f'{name}_stages.csv'), stages)
+    _write_csv(Path(path_output, f'{name}_stage_summary.csv'),
+               results['stage_summary'])
+    _write_csv(Path(path_output, f'{name}_summary.csv'), results['summary'])
+    if results['memory_summary']:
+        timeline = [{'engine': r['engine'], 'cache_mode': r['cache_mode'],
+                     'variant': r['variant'], 'warmup': r['warmup'],
+                     'repetition': r['repetition'],
+                     'elapsed_s': s['t'] - r['started'], **s}
+                    for r in results['runs'] for s in r.get('timeline', [])]
+        _write_csv(Path(path_output, f'{name}_memory.csv'), timeline)
+        _write_csv(Path(path_output, f'{name}_memory_summary.csv'),
+                   results['memory_summary'])
+    if results['precision']:
+        _write_csv(Path(path_output, f'{name}_precision.csv'),
+                   results['precision'])
+    if results['subdivision']:
+        _write_csv(Path(path_output, f'{name}_subdivision.csv'),
+                   results['subdivision'])
+    if results['verification']:
+        _write_csv(Path(path_output, f'{name}_verification.csv'),
+                   results['verification'])
+
+    info(f'Benchmark results saved to {file_json}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-car', type=str, required=True, dest='car',
+        help='File path (Shapefile with extension .shp) from CAR'
+    )
+    parser.add_argument(
+        '-mp', type=str, required=True, dest='mp',
+        help='File path (Shapefile with extension .shp) from MapBiomas Alerta'
+    )
+
+    parser.add_argument(
+        '-r', type=str, required=True, dest='r',
+        help='Path to save the results'
+    )
+    parser.add_argument(
+        '-e', type=str, nargs='+', dest='engines',
+        choices=list(ENGINES), default=['geopandas', 'duckdb_01'],
+        help='Engines to run'
+    )
+    parser.add_argument(
+        '-n', type=int, default=5, dest='n',
+        help='Number of measured runs of each engine'
+    )
+    parser.add_argument(
+        '-w', type=int, default=1, dest='w',
+        help='Number of warmup runs (not measured) of each engine'
+    )
+    parser.add_argument(
+        '-cache', type=str, nargs='+', default=['warm'], dest='cache',
+        choices=CACHE_MODES,
+        help='File cache mode: "cold" evicts the inputs from the OS cache '
+             'before each run'
+    )
+    parser.add_argument(
+        '-o', type=str, default=None, dest='o',
+        help='Path to save the benchmark results (default: same as -r)'
+    )
+    parser.add_argument(
+        '-format', type=str, nargs='+', default=None, dest='format',
+        choices=list(FORMATS),
+        help='Formats of the results, each engine is run with each format '
+             '(default: the default format of the engine)'
+    )
+    parser.add_argument(
+        '-reference', type=str, default='', dest='reference',
+        help='File path of the reference results (default: the results of '
+             'the first engine)'
+    )
+    parser.add_argument(
+        '-no_verify', action='store_true', dest='no_verify',
+        help='Do not compare the results of the engines'
+    )
+    parser.add_argument(
+        '-grid', type=float, nargs='+', default=None, dest='grid',
+        help='Grid sizes of the fixed precision, each engine is also run '
+             'with each grid size (Ex.: -grid 1e-7 1e-6)'
+    )
+    parser.add_argument(
+        '-subdivide', type=int, nargs='+', default=None, dest='subdivide',
+        help='Thresholds of vertices of the subdivision, the engines that '
+             'support it (geopandas, duckdb_01, duckdb_02) are also run '
+             'with each threshold (Ex.: -subdivide 64 256 1024)'
+    )
+    parser.add_argument(
+        '-memory', type=float, nargs='?', const=memprofile.INTERVAL,
+        default=None, dest='memory',
+        help=f'Sample the memory of the process tree of each run every '
+             f'MEMORY seconds (default: {memprofile.INTERVAL})'
+    )
+    parser.add_argument(
+        '-no_uss', action='store_true', dest='no_uss',
+        help='Sample only the RSS, which is faster to read than the USS'
+    )
+
+    args = parser.parse_args()
+
+    car: str = args.car
+    mp: str = args.mp
+    path_results: str = args.r
+    path_output: str = args.o or path_results
+
+    if not Path(car).exists():
+        print(f'File {car} not found.')
+        return
+    if not Path(mp).exists():
+        print(f'File {mp} not found.')
+        return
+    if not Path(path_results).exists():
+        print(f'Path {path_results} not found.')
+        return
+    if not Path(path_output).exists():
+        print(f'Path {path_output} not found.')
+        return
+    if args.reference and not Path(args.reference).exists():
+        print(f'File {args.reference} not found.')
+        return
+    if args.memory and memprofile.psutil is None:
+        print('The memory profiler requires psutil.')
+        return
+
+    variants = grid_variants(args.grid, format_variants(args.format))
+    if args.subdivide:
+        variants = {engine: subdivide_variants(args.subdivide, variants)
+                    if engine in SUBDIVIDE_ENGINES else variants
+                    for engine in args.engines}
+
+    run(engines=args.engines, car_file_path=car, mp_file_path=mp,
+        path_results=path_results, repetitions=args.n, warmups=args.w,
+        cache_modes=args.cache, path_output=path_output,
+        variants=variants,
+        verify=not args.no_verify,
+        reference_file_path=args.reference, memory_interval=args.memory,
+        uss=not args.no_uss)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Cache of the input layers in GeoParquet
+
+On the first use, each input is converted to GeoParquet keeping only the
+needed columns, sorted along a Hilbert curve and with a bbox covering column,
+so the next runs read a small file where the nearby features are in the same
+row groups. The cached file is identified by the path, size and modification
+time of the input and its sidecar files (.dbf, .shx...), so it is rebuilt
+when any of them changes.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import shapely
+
+from loaders import read_layer
+from utils import info, input_files, stage
+
+# Environment variable with the folder of the cache. Default: folder
+# .geo_cache next to the input
+CACHE_DIR_ENV = 'GEO_CACHE_DIR'
+
+# Target size of the row groups (WKB of the geometries)
+ROW_GROUP_BYTES = 16 * 1024 ** 2
+
+# Columns of the inputs used by the engines
+CAR_COLUMNS = ['cod_imovel', 'des_condic']
+MP_COLUMNS = []
+
+
+def cache_key(file_path: str = '', columns: list = None) -> str:
+    """Key of the cached file from the path, size, modification time and
+    columns of the input
+
+    The size and modification time of the sidecar files of a Shapefile are
+    also used, as the attributes are in the .dbf.
+    """
+    path = Path(file_path).resolve()
+    files = []
+    for file in input_files(path):
+        stat = file.stat()
+        files.append(f'{file.name}|{stat.st_size}|{stat.st_mtime_ns}')
+    key = f'{path}|{"|".join(files)}|{",".join(columns)}'
+
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def cached_path(file_path: str = '', columns: list = None,
+                cache_dir: str = None) -> str:
+    """File path of the cached GeoParquet of the input"""
+    columns = list(columns or [])
+    cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV) or \
+        Path(file_path).parent / '.geo_cache'
+    file_name = f'{Path(file_path).stem}_{cache_key(file_path, columns)}'
+
+    return Path(cache_dir, f'{file_name}.parquet').__str__()
+
+
+def cached_layer(file_path: str = '', columns: list = None,
+                 cache_dir: str = None) -> str:
+    """Convert the input to GeoParquet, if it is not in the cache
+
+    Args:
+        file_path: File path with extension (.shp or .parquet)
+        columns: Attribute columns to keep (without the geometry)
+        cache_dir: Folder of the cache. Default: environment variable
+            GEO_CACHE_DIR or folder .geo_cache next to the input
+
+    Returns:
+        File path of the cached GeoParquet
+    """
+    file_cache = cached_path(file_path, columns, cache_dir)
+    if Path(file_cache).exists():
+        info(f'Using cache {file_cache}')
+        return file_cache
+
+    info(f'Caching {file_path} in {file_cache}')
+    gdf = read_layer(file_path, columns=columns)
+    if gdf.crs is None and Path(file_path).suffix.lower() == '.parquet':
+        gdf.set_crs(epsg=4674, inplace=True)
+
+    if len(gdf):
+        gdf = gdf.iloc[np.argsort(gdf.geometry.hilbert_distance(),
+                                  kind='stable')]
+        wkb_bytes = shapely.get_num_coordinates(gdf.geometry.values).mean() \
+            * 16
+        row_group_size = max(1024, int(ROW_GROUP_BYTES / max(wkb_bytes, 1)))
+    else:
+        row_group_size = None
+
+    # Written to a temporary file, so a failed run does not leave an
+    # incomplete file in the cache
+    Path(file_cache).parent.mkdir(parents=True, exist_ok=True)
+    file_tmp = f'{file_cache}.{os.getpid()}.tmp'
+    gdf.reset_index(drop=True).to_parquet(
+        file_tmp, write_covering_bbox=True, row_group_size=row_group_size)
+    os.replace(file_tmp, file_cache)
+
+    return file_cache
+
+
+def cache_inputs(car_file_path: str = '', mp_file_path: str = '',
+                 cache_dir: str = None) -> tuple:
+    """Cached GeoParquet files of the CAR and MapBiomas Alerta layers
+
+    Returns:
+        Tuple with the file paths of CAR and MapBiomas Alerta
+    """
+    with stage('Caching inputs'):
+        return (cached_layer(car_file_path, CAR_COLUMNS, cache_dir),
+                cached_layer(mp_file_path, MP_COLUMNS, cache_dir))
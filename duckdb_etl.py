@@ -0,0 +1,511 @@
+"""
+Base ETL with the DuckDB spatial extension
+
+Shared by process_duckdb_01.py (Shapefile input) and process_duckdb_02.py
+(GeoParquet input), which implement the loading and saving of the layers.
+"""
+
+from abc import ABC, abstractmethod
+import os
+import shutil
+import tempfile
+import time
+import duckdb as dkb
+from duckdb import DuckDBPyConnection
+import numpy as np
+import pyarrow as pa
+from cache import cache_inputs
+from loaders import bbox_column
+from overlay import SUBDIVIDE_DEPTH
+from prefilter import intersects_boxes, mask_boxes
+from reproject import SOURCE_CRS, TARGET_CRS
+from writers import ROW_GROUP_SIZE, LayerWriter, results_path
+from utils import info, info_finished, stage, Stage, total_memory
+
+# Fraction of the RAM used by DuckDB by default. The rest is left for the
+# geometries allocated by GEOS, which are not tracked by the memory limit
+MEMORY_FRACTION = 0.6
+
+
+def default_memory_limit() -> str | None:
+    """Memory limit of DuckDB from the RAM of the machine (Ex.: '2457MB')"""
+    memory = total_memory()
+    if not memory:
+        return None
+
+    return f'{int(memory * MEMORY_FRACTION / 1024 ** 2)}MB'
+
+
+class DuckDBETL(ABC):
+    # Name of the geometry column
+    geom = 'geom'
+    # Name of the results file (without extension) and of its layer
+    results_name = 'results_duckdb'
+    layer_name = 'resultados_duckdb'
+
+    def __init__(self, explain: bool = False, debug: bool = False,
+                 threads: int = None, memory_limit: str = None,
+                 temp_directory: str = None, database: str = None,
+                 cache: bool = False, fmt: str = 'gpkg',
+                 compression: str = 'zstd',
+                 row_group_size: int = ROW_GROUP_SIZE,
+                 source_crs: str = SOURCE_CRS, prefilter: bool = False,
+                 grid_size: float = None, max_vertices: int = None,
+                 prepared: bool = False):
+        """
+        Args:
+            explain: Run the statements with EXPLAIN ANALYZE and print the
+                plans in the stage logs
+            debug: Materialize each step of the pipeline in a temporary
+                table, to measure the stages. By default, the steps run as a
+                single query streamed to the output file
+            threads: Number of threads. Default: number of cores. The
+                memory is bounded by memory_limit, with the data beyond it
+                spilled to temp_directory
+            memory_limit: Memory limit of DuckDB (Ex.: '2GB'). Default:
+                `default_memory_limit()`
+            temp_directory: Folder where DuckDB spills the data that does
+                not fit in the memory limit. Default: a new folder
+                duckdb_tmp_* in the results path, removed at the end of
+                the run
+            database: File path of the database. Default: in memory
+            cache: Read the inputs from the GeoParquet cache
+            fmt: Format of the results (one of writers.FORMATS)
+            compression: Compression of the GeoParquet output
+            row_group_size: Number of rows of each row group of the
+                GeoParquet output
+            source_crs: CRS of the inputs, used to reproject the results to
+                UTM
+            prefilter: Load only the CAR features whose bounding box
+                intersects the boxes of the alerts (see
+                `prefilter.mask_boxes`)
+            grid_size: Grid size to snap the vertices of the inputs and of
+                the union (ST_ReducePrecision). Default: full precision
+            max_vertices: Subdivide the geometries with more vertices
+                before the intersection. Default: no subdivision
+            prepared: Return the geometry of the pairs where one covers
+                the other without computing the intersection
+        """
+        self.explain = explain
+        self.source_crs = source_crs or SOURCE_CRS
+        self.debug = debug
+        self.threads = threads or os.cpu_count() or 1
+        self.memory_limit = memory_limit or default_memory_limit()
+        self.temp_directory = temp_directory
+        self.database = database
+        self.cache = cache
+        self.prefilter = prefilter
+        self.grid_size = grid_size
+        self.max_vertices = max_vertices
+        self.prepared = prepared
+        self.fmt = fmt
+        self.compression = compression
+        self.row_group_size = row_group_size
+
+    @property
+    def temporary(self) -> str:
+        """Kind of the tables: temporary in memory, or saved in the database
+        file"""
+        return '' if self.database else 'TEMPORARY'
+
+    def _create_db(self, temp_directory: str = '') -> DuckDBPyConnection:
+        con = dkb.connect(self.database or ':memory:')
+        con.install_extension("spatial")
+        con.load_extension("spatial")
+
+        con.execute(f"SET temp_directory = '{temp_directory}'")
+        con.execute(f'SET threads = {self.threads}')
+        if self.memory_limit:
+            con.execute(f"SET memory_limit = '{self.memory_limit}'")
+        # The order of the rows is not needed, and keeping it prevents
+        # some operators from spilling to disk
+        con.execute('SET preserve_insertion_order = false')
+
+        info(f'DuckDB with {self.threads} threads, memory limit '
+             f'{self.memory_limit}, temp directory {temp_directory}')
+
+        return con
+
+    @abstractmethod
+    def _create_tables(self, con: DuckDBPyConnection = None,
+                       file_path: str = '',
+                       table_name: str = '',
+                       cols: list = None, bbox: tuple = None) -> None:
+        """Create the table from the file, with only the features whose
+        bounding box intersects the bbox (xmin, ymin, xmax, ymax)"""
+
+    def _create_tables_parquet(self, con: DuckDBPyConnection = None,
+                               file_path: str = '',
+                               table_name: str = '',
+                               cols: list = None,
+                               bbox: tuple = None) -> None:
+        """Create the table from a GeoParquet file (WKB column geometry)
+
+        The bbox is compared with the bbox covering column when the file
+        has one, before decoding the geometries, which lets DuckDB skip the
+        row groups outside it.
+        """
+        cols_str = ', '.join(
+            f'ST_GeomFromWKB(geometry) AS {c}' if c == self.geom else c
+            for c in cols)
+        where = ''
+        if bbox is not None:
+            covering = bbox_column(file_path)
+            bounds = [f'{covering}.{f}' for f in
+                      ('xmin', 'ymin', 'xmax', 'ymax')] if covering else \
+                [f'{f}(ST_GeomFromWKB(geometry))' for f in
+                 ('ST_XMin', 'ST_YMin', 'ST_XMax', 'ST_YMax')]
+            where = """
+            WHERE
+                {0} <= {6} AND {2} >= {4} AND
+                {1} <= {7} AND {3} >= {5}
+            """.format(*bounds, *bbox)
+        sql = """
+        CREATE OR REPLACE {3} TABLE {0} AS
+        SELECT
+            {1}
+        FROM read_parquet('{2}')
+        {4}
+        """.format(table_name, cols_str, file_path, self.temporary, where)
+        con.execute(sql)
+
+    def _bounds(self, con: DuckDBPyConnection = None,
+                table_name: str = '', row_id: bool = False) -> np.ndarray:
+        """Bounds (xmin, ymin, xmax, ymax) of the geometries of the table,
+        with the rowid in the first column if row_id"""
+        sql = """
+        SELECT
+            {2}
+            ST_XMin({0}), ST_YMin({0}), ST_XMax({0}), ST_YMax({0})
+        FROM {1}
+        WHERE {0} IS NOT NULL
+        """.format(self.geom, table_name, 'rowid,' if row_id else '')
+        columns = con.execute(sql).fetchnumpy()
+
+        return np.column_stack([np.asarray(v, dtype=float)
+                                for v in columns.values()])
+
+    def _filter_boxes(self, con: DuckDBPyConnection = None,
+                      table_name: str = '', boxes: np.ndarray = None) -> None:
+        """Delete the features whose bounding box does not intersect one of
+        the boxes
+
+        The test is the same of the other engines (an STRtree of the boxes,
+        see `prefilter.intersects_boxes`). A join with the boxes in SQL
+        compares every feature with every box, which is much slower.
+        """
+        bounds = self._bounds(con, table_name, row_id=True)
+        keep = intersects_boxes(bounds[:, 1:], boxes)
+        con.register('prefilter_rows', pa.table(
+            {'row_id': bounds[keep, 0].astype(np.int64)}))
+        try:
+            con.execute("""
+            DELETE FROM {0}
+            WHERE rowid NOT IN (SELECT row_id FROM prefilter_rows)
+            """.format(table_name))
+        finally:
+            con.unregister('prefilter_rows')
+        info(f'Prefilter kept {int(keep.sum())} of {len(keep)} CAR features '
+             f'in the extent of the boxes')
+
+    def _save_results(self, con: DuckDBPyConnection = None,
+                      path_results: str = '', query: str = '',
+                      st: Stage = None) -> None:
+        """Save the results of the query
+
+        The results are streamed as Arrow batches (WKB) to the writer of the
+        output format.
+        """
+        file_results = results_path(path_results, self.results_name,
+                                    self.fmt)
+
+        sql = """
+        SELECT
+            cod_imovel,
+            area_ha,
+            ST_AsWKB({0})::BLOB AS geometry,
+            {{'xmin': ST_XMin({0}), 'ymin': ST_YMin({0}),
+              'xmax': ST_XMax({0}), 'ymax': ST_YMax({0})}} AS bbox
+        FROM ({1})
+        """.format(self.geom, query)
+        if self.fmt != 'parquet':
+            sql = 'SELECT * EXCLUDE bbox FROM ({0})'.format(sql)
+
+        if self.explain:
+            # EXPLAIN ANALYZE runs the query once more, only for the plan
+            self._execute(con, sql, st)
+
+        # The union can return polygons and multipolygons
+        reader = con.execute(sql).fetch_record_batch(self.row_group_size)
+        with LayerWriter(file_results, layer=self.layer_name,
+                         crs=TARGET_CRS, fmt=self.fmt,
+                         geometry_type='Unknown',
+                         compression=self.compression,
+                         row_group_size=self.row_group_size) as writer:
+            writer.write(reader)
+        st.features = writer.rows
+
+    def _execute(self, con: DuckDBPyConnection = None, sql: str = '',
+                 st: Stage = None) -> None:
+        """Execute the statement, with EXPLAIN ANALYZE if enabled"""
+        if not self.explain:
+            con.execute(sql)
+            return
+
+        plan = con.execute('EXPLAIN ANALYZE ' + sql).fetchall()[0][1]
+        info(f'Plan:\n{plan}')
+        if st is not None:
+            st.details['plan'] = plan
+
+    def _count(self, st: Stage = None, con: DuckDBPyConnection = None,
+               table_name: str = '') -> None:
+        """Set the number of features and vertices of the table in the stage
+        """
+        sql = """
+        SELECT count(*), sum(ST_NPoints({1})) FROM {0}
+        """.format(table_name, self.geom)
+        st.features, st.vertices = con.execute(sql).fetchone()
+
+    def _snap(self, expr: str = '') -> str:
+        """Expression of the geometry snapped to the grid, if any"""
+        if not self.grid_size:
+            return expr
+
+        return 'ST_ReducePrecision({0}, {1})'.format(expr, self.grid_size)
+
+    def _subdivide(self, select: str = '', cols: list = None) -> str:
+        """SELECT statement of the pieces of the geometries of the select,
+        with their bounding boxes
+
+        Like overlay.subdivide, each geometry with more than max_vertices is
+        cut in two halves across the longer side of its bounding box, until
+        all the pieces are below the threshold (or SUBDIVIDE_DEPTH cuts).
+        The cuts are a recursive CTE, as the extension has no ST_Subdivide.
+        """
+        cols_str = ''.join(f'{c}, ' for c in cols or [])
+        return """
+            WITH RECURSIVE PIECES AS (
+                SELECT {0}{1}, 0 AS depth FROM ({2})
+                UNION ALL
+                SELECT
+                    {0}ST_CollectionExtract(ST_Intersection(
+                        p.{1}, CASE WHEN h.half = 0 THEN ST_MakeEnvelope(
+                            p.x0, p.y0,
+                            CASE WHEN p.wide THEN (p.x0 + p.x1) / 2
+                                 ELSE p.x1 END,
+                            CASE WHEN p.wide THEN p.y1
+                                 ELSE (p.y0 + p.y1) / 2 END)
+                        ELSE ST_MakeEnvelope(
+                            CASE WHEN p.wide THEN (p.x0 + p.x1) / 2
+                                 ELSE p.x0 END,
+                            CASE WHEN p.wide THEN p.y0
+                                 ELSE (p.y0 + p.y1) / 2 END,
+                            p.x1, p.y1) END), 3) AS {1},
+                    p.depth + 1 AS depth
+                FROM (
+                    SELECT
+                        *,
+                        ST_XMin({1}) AS x0, ST_YMin({1}) AS y0,
+                        ST_XMax({1}) AS x1, ST_YMax({1}) AS y1,
+                        ST_XMax({1}) - ST_XMin({1}) >=
+                            ST_YMax({1}) - ST_YMin({1}) AS wide
+                    FROM PIECES
+                    WHERE ST_NPoints({1}) > {3} AND depth < {4}
+                ) p
+                CROSS JOIN (VALUES (0), (1)) h(half)
+            )
+            SELECT
+                {0}{1},
+                ST_XMin({1}) AS xmin, ST_YMin({1}) AS ymin,
+                ST_XMax({1}) AS xmax, ST_YMax({1}) AS ymax
+            FROM PIECES
+            WHERE
+                (ST_NPoints({1}) <= {3} OR depth >= {4}) AND
+                NOT ST_IsEmpty({1})
+            """.format(cols_str, self.geom, select, self.max_vertices,
+                       SUBDIVIDE_DEPTH)
+
+    def _steps(self, car_table_name: str = '',
+               map_biomas_table_name: str = '') -> list:
+        """Steps of the pipeline, as tuples (stage, table, SELECT statement)
+
+        Each statement reads the tables of the previous steps, so the steps
+        can be materialized one by one or combined in a single query.
+        """
+        # With a grid, the inputs are snapped before the intersection, so
+        # the pieces are on the grid, and the union is snapped again. The
+        # bounding boxes are of the original geometries, which move at most
+        # half a cell
+        filtering = """
+            SELECT
+                c.cod_imovel, {2} AS {1},
+                ST_XMin(c.{1}) AS xmin, ST_YMin(c.{1}) AS ymin,
+                ST_XMax(c.{1}) AS xmax, ST_YMax(c.{1}) AS ymax
+            FROM {0} c
+            WHERE
+                c.des_condic LIKE '%analise%'
+            """.format(car_table_name, self.geom,
+                       self._snap(f'c.{self.geom}'))
+
+        bbox_mp = """
+            SELECT
+                {2} AS {1},
+                ST_XMin(m.{1}) AS xmin, ST_YMin(m.{1}) AS ymin,
+                ST_XMax(m.{1}) AS xmax, ST_YMax(m.{1}) AS ymax
+            FROM {0} m
+            """.format(map_biomas_table_name, self.geom,
+                       self._snap(f'm.{self.geom}'))
+
+        if self.max_vertices:
+            # The bounding boxes are of the pieces, so the join compares
+            # only the pieces that are close
+            filtering = self._subdivide(filtering, ['cod_imovel'])
+            bbox_mp = self._subdivide(bbox_mp)
+
+        # The bounding boxes are stored in columns, so the join can use a
+        # cheap range prefilter (IEJoin) before the exact ST_Intersects
+        overlay = 'ST_Intersection(c.{0}, m.{0})'.format(self.geom)
+        if self.prepared:
+            # The extension does not expose prepared geometries, so only the
+            # covered shortcut is taken: the containment is tested when the
+            # bounding box of one covers the other, and the geometry inside
+            # is the intersection
+            overlay = """
+                CASE
+                    WHEN m.xmin <= c.xmin AND m.xmax >= c.xmax AND
+                         m.ymin <= c.ymin AND m.ymax >= c.ymax AND
+                         ST_ContainsProperly(m.{0}, c.{0}) THEN c.{0}
+                    WHEN c.xmin <= m.xmin AND c.xmax >= m.xmax AND
+                         c.ymin <= m.ymin AND c.ymax >= m.ymax AND
+                         ST_ContainsProperly(c.{0}, m.{0}) THEN m.{0}
+                    ELSE {1}
+                END""".format(self.geom, overlay)
+        intersection = """
+            SELECT
+                c.cod_imovel,
+                {1} AS {0}
+            FROM
+                CAR_FILTERED c
+            JOIN MP_BBOX m ON
+                c.xmin <= m.xmax AND c.xmax >= m.xmin AND
+                c.ymin <= m.ymax AND c.ymax >= m.ymin AND
+                ST_Intersects(c.{0}, m.{0})
+            """.format(self.geom, overlay)
+
+        # With the subdivision, the pieces are reassembled by the union. The
+        # vertices of the cuts are kept on the edges, since the extension
+        # has no way to remove only them (see overlay.merge_cuts)
+        union = self._snap(f'ST_Union_Agg(c.{self.geom})')
+        dissolve = """
+            SELECT
+                c.cod_imovel,
+                {1} AS {0}
+            FROM
+                CAR_INTERSECTION c
+            GROUP BY
+                c.cod_imovel
+            """.format(self.geom, union)
+
+        transform = """
+            SELECT
+                * EXCLUDE {0},
+                ST_Transform({0}, '{1}', '{2}', true) AS {0},
+            FROM
+                CAR_DISSOLVED
+            """.format(self.geom, self.source_crs, TARGET_CRS)
+
+        area = """
+            SELECT
+                cod_imovel,
+                ST_Area({0}) / 10000 AS area_ha,
+                {0}
+            FROM
+                CAR_UTM
+            """.format(self.geom)
+
+        return [
+            ('Filtering CAR only contains "Analise"', 'CAR_FILTERED',
+             filtering),
+            ('Calculating bounding boxes of MapBiomas', 'MP_BBOX', bbox_mp),
+            ('Intersection layers', 'CAR_INTERSECTION', intersection),
+            ('Dissolving', 'CAR_DISSOLVED', dissolve),
+            ('Transforming to UTM', 'CAR_UTM', transform),
+            ('Calculating area', 'RESULTS', area),
+        ]
+
+    def run(self, car_file_path: str = '', mp: str = '',
+            path_results: str = ''):
+        start = time.perf_counter()
+
+        if self.cache:
+            car_file_path, mp = cache_inputs(car_file_path, mp)
+
+        # The default spill folder is new for each run and removed at the
+        # end, so no spill files are left next to the results
+        temp_directory = self.temp_directory or \
+            tempfile.mkdtemp(prefix='duckdb_tmp_', dir=path_results)
+        con = self._create_db(temp_directory)
+        try:
+            self._process(con, car_file_path, mp, path_results)
+        finally:
+            con.close()
+            if not self.temp_directory:
+                shutil.rmtree(temp_directory, ignore_errors=True)
+
+        info_finished(start_time=start)
+
+    def _process(self, con: DuckDBPyConnection = None,
+                 car_file_path: str = '', mp: str = '',
+                 path_results: str = '') -> None:
+        """Load the layers, run the steps and save the results"""
+        car_table_name = 'CAR'
+        cols_car = ['cod_imovel', 'des_condic', self.geom]
+        map_biomas_table_name = 'MP'
+        cols_mp = [self.geom]
+
+        with stage('Loading layers') as st:
+            self._create_tables(con=con, file_path=mp,
+                                table_name=map_biomas_table_name,
+                                cols=cols_mp)
+
+            # The extent of the boxes is compared in the scan, which skips
+            # the row groups of GeoParquet (or reads only this extent with
+            # GDAL), and the boxes are applied to the features loaded
+            boxes, bbox = None, None
+            if self.prefilter:
+                boxes = mask_boxes(self._bounds(con, map_biomas_table_name))
+                if len(boxes):
+                    bbox = (*boxes[:, :2].min(axis=0),
+                            *boxes[:, 2:].max(axis=0))
+                    bbox = tuple(float(v) for v in bbox)
+
+            self._create_tables(con=con, file_path=car_file_path,
+                                table_name=car_table_name,
+                                cols=cols_car, bbox=bbox)
+            if boxes is not None:
+                self._filter_boxes(con, car_table_name, boxes)
+            self._count(st, con, car_table_name)
+
+        steps = self._steps(car_table_name, map_biomas_table_name)
+
+        if self.debug:
+            # Materialize each step in a table, to measure the stages
+            for name, table_name, select in steps:
+                with stage(name) as st:
+                    sql = """
+                    CREATE OR REPLACE {0} TABLE {1} AS {2};
+                    """.format(self.temporary, table_name, select)
+                    self._execute(con, sql, st)
+                    self._count(st, con, table_name)
+
+            query = 'SELECT * FROM RESULTS'
+        else:
+            # All the steps in a single query, streamed to the writer
+            query = 'WITH {0} {1}'.format(
+                ', '.join('{0} AS ({1})'.format(table_name, select)
+                          for _, table_name, select in steps[:-1]),
+                steps[-1][2])
+
+        with stage('Saving results' if self.debug else
+                   'Processing and saving results') as st:
+            self._save_results(con, path_results, query, st)
@@ -0,0 +1,220 @@
+"""
+Script to generate synthetic CAR and MapBiomas Alerta datasets
+
+The CAR properties and the alerts are random star-shaped polygons with
+lognormal distributions of size and number of vertices, like the real data.
+A fraction of the alerts is placed over the properties, so the overlap
+between the layers can be configured. The same seed always generates the
+same dataset.
+
+The scale factor multiplies the number of features and the extent of the
+study area (the density is constant), starting from the extent of Paraná.
+"""
+
+import argparse
+import geopandas as gpd
+import numpy as np
+from pathlib import Path
+import shapely
+import time
+from utils import info, info_finished
+
+# Extent of Paraná (EPSG:4674)
+XMIN, YMIN, XMAX, YMAX = -54.62, -26.72, -48.02, -22.52
+
+# Number of features with scale 1
+N_CAR = 10000
+N_MP = 2000
+
+DES_CONDIC_ANALISE = ['aguardando analise', 'em analise',
+                      'aguardando analise, apto a anexar']
+DES_CONDIC_OTHERS = ['analisado', 'cancelado', 'ativo',
+                     'analisado com pendencias']
+
+METERS_PER_DEGREE = 111320
+
+
+def _random_polygons(rng: np.random.Generator = None,
+                     centers: np.ndarray = None,
+                     median_area_ha: float = 1,
+                     sigma_area: float = 1,
+                     median_vertices: int = 20,
+                     sigma_vertices: float = 1,
+                     max_vertices: int = 4000) -> np.ndarray:
+    """Star-shaped polygons around the centers
+
+    Returns:
+        Array of shapely polygons
+    """
+    n = len(centers)
+    area_m2 = rng.lognormal(np.log(median_area_ha * 10000), sigma_area, n)
+    radius = np.sqrt(area_m2 / np.pi) / METERS_PER_DEGREE
+
+    n_vertices = rng.lognormal(np.log(median_vertices), sigma_vertices, n)
+    n_vertices = np.clip(n_vertices.astype(int), 4, max_vertices)
+
+    # One jittered angle for each slice of the circle, so the vertices are
+    # sorted by angle and the ring is simple
+    ring_index = np.repeat(np.arange(n), n_vertices)
+    first = np.concatenate([[0], np.cumsum(n_vertices)[:-1]])
+    slot = np.arange(len(ring_index)) - first[ring_index]
+    angles = 2 * np.pi * (slot + rng.uniform(0.1, 0.9, len(ring_index))) \
+        / n_vertices[ring_index]
+    radii = radius[ring_index] * rng.uniform(0.6, 1.4, len(ring_index))
+
+    lat = centers[ring_index, 1]
+    x = centers[ring_index, 0] + \
+        radii * np.cos(angles) / np.cos(np.radians(lat))
+    y = lat + radii * np.sin(angles)
+
+    # Close the rings repeating the first vertex
+    coords = np.column_stack([x, y])
+    coords = np.insert(coords, np.cumsum(n_vertices), coords[first], axis=0)
+    ring_index = np.repeat(np.arange(n), n_vertices + 1)
+
+    rings = shapely.linearrings(coords, indices=ring_index)
+    polygons = shapely.polygons(rings)
+
+    # Rounding can still make a few rings invalid
+    invalid = ~shapely.is_valid(polygons)
+    polygons[invalid] = shapely.convex_hull(polygons[invalid])
+
+    return polygons
+
+
+def generate(scale: float = 1, seed: int = 0, n_car: int = N_CAR,
+             n_mp: int = N_MP, analise_fraction: float = 0.6,
+             overlap: float = 0.8) -> tuple:
+    """Generate the CAR and MapBiomas Alerta layers
+
+    Args:
+        scale: Scale factor of the number of features and the study area
+        seed: Seed of the random generator
+        n_car: Number of CAR properties with scale 1
+        n_mp: Number of alerts with scale 1
+        analise_fraction: Fraction of CAR with "analise" in des_condic
+        overlap: Fraction of the alerts placed over a CAR property
+
+    Returns:
+        GeoDataFrames of CAR and MapBiomas Alerta
+    """
+    rng = np.random.default_rng(seed)
+
+    factor = np.sqrt(scale)
+    xmax = XMIN + (XMAX - XMIN) * factor
+    ymax = YMIN + (YMAX - YMIN) * factor
+    n_car = int(n_car * scale)
+    n_mp = int(n_mp * scale)
+
+    centers = rng.uniform([XMIN, YMIN], [xmax, ymax], (n_car, 2))
+    geom_car = _random_polygons(rng, centers, median_area_ha=30,
+                                sigma_area=1.2, median_vertices=40,
+                                sigma_vertices=0.9)
+
+    is_analise = rng.random(n_car) < analise_fraction
+    des_condic = np.where(is_analise,
+                          rng.choice(DES_CONDIC_ANALISE, n_car),
+                          rng.choice(DES_CONDIC_OTHERS, n_car))
+    cod_imovel = [f'PR-{4100000 + rng.integers(0, 99999):07d}-'
+                  f'{rng.bytes(16).hex().upper()}' for _ in range(n_car)]
+
+    gdf_car = gpd.GeoDataFrame({'cod_imovel': cod_imovel,
+                                'des_condic': des_condic},
+                               geometry=geom_car, crs='EPSG:4674')
+
+    # Alerts over a random property or anywhere in the study area
+    over_car = rng.random(n_mp) < overlap
+    centers = rng.uniform([XMIN, YMIN], [xmax, ymax], (n_mp, 2))
+    car_centers = shapely.get_coordinates(
+        shapely.centroid(geom_car[rng.integers(0, n_car, n_mp)]))
+    centers[over_car] = car_centers[over_car]
+    geom_mp = _random_polygons(rng, centers, median_area_ha=5,
+                               sigma_area=1.5, median_vertices=30,
+                               sigma_vertices=0.8)
+
+    gdf_mp = gpd.GeoDataFrame({'cod_alerta': np.arange(1, n_mp + 1)},
+                              geometry=geom_mp, crs='EPSG:4674')
+
+    return gdf_car, gdf_mp
+
+
+def run(path_results: str = '', scales: list = None, seed: int = 0,
+        n_car: int = N_CAR, n_mp: int = N_MP, analise_fraction: float = 0.6,
+        overlap: float = 0.8, formats: list = None):
+    start = time.perf_counter()
+
+    for scale in scales:
+        info(f'Generating layers with scale {scale:g}x...')
+        gdf_car, gdf_mp = generate(scale=scale, seed=seed, n_car=n_car,
+                                   n_mp=n_mp,
+                                   analise_fraction=analise_fraction,
+                                   overlap=overlap)
+        info(f'{len(gdf_car)} CAR properties and {len(gdf_mp)} alerts')
+
+        for name, gdf in (('car', gdf_car), ('mp', gdf_mp)):
+            file_name = f'{name}_x{scale:g}'
+            if 'shp' in formats:
+                file_path = Path(path_results, f'{file_name}.shp').__str__()
+                info(f'Saving {file_path}...')
+                gdf.to_file(file_path)
+            if 'parquet' in formats:
+                file_path = Path(path_results,
+                                 f'{file_name}.parquet').__str__()
+                info(f'Saving {file_path}...')
+                gdf.to_parquet(file_path)
+
+    info_finished(start_time=start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-r', type=str, required=True, dest='r',
+        help='Path to save the generated files'
+    )
+    parser.add_argument(
+        '-scale', type=float, nargs='+', default=[1], dest='scale',
+        help='Scale factors of the dataset (Ex.: 1 10 100)'
+    )
+    parser.add_argument(
+        '-seed', type=int, default=0, dest='seed',
+        help='Seed of the random generator'
+    )
+    parser.add_argument(
+        '-n_car', type=int, default=N_CAR, dest='n_car',
+        help='Number of CAR properties with scale 1'
+    )
+    parser.add_argument(
+        '-n_mp', type=int, default=N_MP, dest='n_mp',
+        help='Number of alerts with scale 1'
+    )
+    parser.add_argument(
+        '-analise', type=float, default=0.6, dest='analise',
+        help='Fraction of the CAR properties with "analise" in des_condic'
+    )
+    parser.add_argument(
+        '-overlap', type=float, default=0.8, dest='overlap',
+        help='Fraction of the alerts placed over a CAR property'
+    )
+    parser.add_argument(
+        '-f', type=str, nargs='+', default=['shp', 'parquet'], dest='f',
+        choices=['shp', 'parquet'],
+        help='Output formats'
+    )
+
+    args = parser.parse_args()
+
+    path_results: str = args.r
+
+    if not Path(path_results).exists():
+        print(f'Path {path_results} not found.')
+        return
+
+    run(path_results=path_results, scales=args.scale, seed=args.seed,
+        n_car=args.n_car, n_mp=args.n_mp, analise_fraction=args.analise,
+        overlap=args.overlap, formats=args.f)
+
+
+if __name__ == '__main__':
+    main()
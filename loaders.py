@@ -0,0 +1,331 @@
+"""
+Functions to load the layers using Arrow
+
+The features are read in Arrow batches and the attribute filters are applied
+in columnar form, so only the geometries (WKB) of the rows that pass the
+filters are converted to shapely objects. With a bbox or boxes, the
+GeoParquet row groups outside them are skipped using the statistics of the
+bbox covering column.
+"""
+
+import json
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+
+BATCH_SIZE = 65536
+
+
+def _parquet_geometry(file_path: str = '') -> tuple:
+    """Geometry column, CRS and bbox covering column from the GeoParquet
+    metadata"""
+    metadata = pq.read_schema(file_path).metadata or {}
+    if b'geo' not in metadata:
+        return 'geometry', None, None
+
+    geo = json.loads(metadata[b'geo'])
+    column = geo['primary_column']
+    crs = geo['columns'][column].get('crs')
+    covering = geo['columns'][column].get('covering', {}).get('bbox')
+    bbox_col = covering['xmin'][0] if covering else None
+
+    return column, crs, bbox_col
+
+
+def _row_groups(parquet: pq.ParquetFile = None, bbox_col: str = None,
+                bbox: tuple = None, tree: shapely.STRtree = None) -> list:
+    """Row groups whose bbox covering column statistics intersect the bbox
+    and one of the boxes of the tree
+
+    The row groups without statistics are kept.
+    """
+    metadata = parquet.metadata
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        stats = {}
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if column.path_in_schema.startswith(f'{bbox_col}.') and \
+                    column.statistics is not None and \
+                    column.statistics.has_min_max:
+                stats[column.path_in_schema.split('.')[-1]] = \
+                    column.statistics
+        if len(stats) == 4:
+            bounds = (stats['xmin'].min, stats['ymin'].min,
+                      stats['xmax'].max, stats['ymax'].max)
+            if bounds[0] > bbox[2] or bounds[2] < bbox[0] or \
+                    bounds[1] > bbox[3] or bounds[3] < bbox[1]:
+                continue
+            if tree is not None and not len(tree.query(
+                    shapely.box(*bounds), predicate='intersects')):
+                continue
+        row_groups.append(i)
+
+    return row_groups
+
+
+def _filter(batch: pa.RecordBatch = None, contains: dict = None,
+            bbox: tuple = None, geom_col: str = 'geometry',
+            bbox_col: str = None, drop: list = None,
+            tree: shapely.STRtree = None) -> pa.RecordBatch:
+    """Keep the rows whose columns contain the substrings and whose bounding
+    box intersects the bbox and one of the boxes of the tree, and drop the
+    columns used only by the filters
+    """
+    keep = None
+    for column, pattern in (contains or {}).items():
+        match = pc.fill_null(pc.match_substring(batch[column], pattern),
+                             False)
+        keep = match if keep is None else pc.and_(keep, match)
+
+    # The bounds are computed only for the rows that pass the attributes
+    if keep is not None:
+        batch = batch.filter(keep)
+
+    if bbox is not None:
+        if bbox_col:
+            bounds = batch[bbox_col]
+            xmin, ymin, xmax, ymax = (
+                bounds.field(f).to_numpy(zero_copy_only=False)
+                for f in ('xmin', 'ymin', 'xmax', 'ymax'))
+        else:
+            wkb = batch[geom_col].to_numpy(zero_copy_only=False)
+            xmin, ymin, xmax, ymax = shapely.bounds(shapely.from_wkb(wkb)).T
+        match = (xmin <= bbox[2]) & (xmax >= bbox[0]) & \
+            (ymin <= bbox[3]) & (ymax >= bbox[1])
+        if tree is not None:
+            idx = np.flatnonzero(match)
+            hits = tree.query(shapely.box(xmin[idx], ymin[idx], xmax[idx],
+                                          ymax[idx]),
+                              predicate='intersects')[0]
+            match[:] = False
+            match[idx[hits]] = True
+        batch = batch.filter(pa.array(match))
+
+    return batch.drop_columns(drop) if drop else batch
+
+
+def bbox_column(file_path: str = '') -> str | None:
+    """Name of the bbox covering column of the GeoParquet file"""
+    return _parquet_geometry(file_path)[2]
+
+
+def layer_crs(file_path: str = ''):
+    """CRS of the layer"""
+    if Path(file_path).suffix.lower() == '.parquet':
+        return _parquet_geometry(file_path)[1]
+
+    return pyogrio.read_info(file_path)['crs']
+
+
+def layer_bounds(file_path: str = '') -> tuple:
+    """Bounds (xmin, ymin, xmax, ymax) of the layer"""
+    if Path(file_path).suffix.lower() != '.parquet':
+        return tuple(pyogrio.read_info(file_path)['total_bounds'])
+
+    metadata = pq.read_schema(file_path).metadata or {}
+    if b'geo' in metadata:
+        geo = json.loads(metadata[b'geo'])
+        bbox = geo['columns'][geo['primary_column']].get('bbox')
+        if bbox:
+            return tuple(bbox)
+
+    return tuple(read_layer(file_path).total_bounds)
+
+
+def count_features(file_path: str = '') -> int:
+    """Number of features of the layer"""
+    if Path(file_path).suffix.lower() == '.parquet':
+        return pq.ParquetFile(file_path).metadata.num_rows
+
+    return pyogrio.read_info(file_path, force_feature_count=True)['features']
+
+
+def iter_arrow(file_path: str = '', columns: list = None,
+               contains: dict = None, batch_size: int = BATCH_SIZE,
+               part: tuple = None, bbox: tuple = None,
+               boxes: np.ndarray = None, read_geometry: bool = True):
+    """Read the layer in Arrow batches, filtering the rows in each batch
+
+    Args:
+        file_path: File path with extension (.shp or .parquet)
+        columns: Attribute columns to read (without the geometry)
+        contains: Column -> substring the column must contain
+        batch_size: Number of rows of each batch
+        part: Tuple (index, count) to read only one of count partitions
+            of the layer (row groups for Parquet, ranges of features for
+            Shapefile)
+        bbox: Tuple (xmin, ymin, xmax, ymax) to read only the features
+            whose bounding box intersects it
+        boxes: Array of rectangles (xmin, ymin, xmax, ymax) to read only
+            the features whose bounding box intersects one of them
+        read_geometry: Read the geometry column. If False, the geometries
+            are read only when the bbox or boxes filter needs them, and
+            dropped after it
+
+    Yields:
+        Tuple with the CRS, the name of the geometry column (WKB) and the
+        filtered Arrow batch
+    """
+    columns = list(columns or [])
+    drop = [c for c in (contains or {}) if c not in columns]
+
+    tree = None
+    if boxes is not None:
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        if bbox is not None:
+            boxes = boxes[(boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0]) &
+                          (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1])]
+        if not len(boxes):
+            return
+        tree = shapely.STRtree(shapely.box(*boxes.T))
+        extent = (*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0))
+        bbox = extent if bbox is None else (
+            max(bbox[0], extent[0]), max(bbox[1], extent[1]),
+            min(bbox[2], extent[2]), min(bbox[3], extent[3]))
+
+    if Path(file_path).suffix.lower() == '.parquet':
+        geom_col, crs, bbox_col = _parquet_geometry(file_path)
+        if bbox is not None and bbox_col:
+            drop.append(bbox_col)
+        else:
+            bbox_col = None
+        read_columns = columns + drop
+        # Without the bbox covering column, the bbox filter uses the bounds
+        # of the geometries
+        if read_geometry or (bbox is not None and not bbox_col):
+            read_columns.append(geom_col)
+            if not read_geometry:
+                drop.append(geom_col)
+
+        parquet = pq.ParquetFile(file_path)
+        sizes = [parquet.metadata.row_group(i).num_rows
+                 for i in range(parquet.num_row_groups)]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+        start, stop = 0, int(offsets[-1])
+        if part:
+            # Rows of the partition
+            bounds = np.linspace(0, parquet.metadata.num_rows, part[1] + 1)
+            start, stop = int(bounds[part[0]]), int(bounds[part[0] + 1])
+        row_groups = [i for i in range(parquet.num_row_groups)
+                      if offsets[i] < stop and offsets[i + 1] > start]
+        if bbox_col:
+            row_groups = [i for i in _row_groups(parquet, bbox_col, bbox,
+                                                 tree)
+                          if i in row_groups]
+
+        for i in row_groups:
+            # Range of rows of the partition in the row group
+            skip = max(start - offsets[i], 0)
+            length = min(stop, offsets[i + 1]) - offsets[i] - skip
+            for batch in parquet.iter_batches(batch_size=batch_size,
+                                              row_groups=[i],
+                                              columns=read_columns):
+                num_rows = batch.num_rows
+                batch = batch.slice(min(skip, num_rows), length)
+                skip = max(skip - num_rows, 0)
+                length -= batch.num_rows
+                yield crs, geom_col, _filter(batch, contains=contains,
+                                             bbox=bbox, geom_col=geom_col,
+                                             bbox_col=bbox_col, drop=drop,
+                                             tree=tree)
+                if length == 0:
+                    break
+        return
+
+    # max_features is not supported by GDAL with Arrow, so the reading
+    # stops after the rows of the partition
+    skip_features, max_features = 0, None
+    if part:
+        bounds = np.linspace(0, count_features(file_path), part[1] + 1)
+        bounds = bounds.astype(int)
+        skip_features = int(bounds[part[0]])
+        max_features = int(bounds[part[0] + 1]) - skip_features
+        if not max_features:
+            return
+        batch_size = min(batch_size, max_features)
+
+    # The bbox filter is applied by GDAL, and the boxes to the bounds of the
+    # geometries of each batch. GDAL needs the geometries for the bbox filter
+    geometry = read_geometry or bbox is not None
+    with pyogrio.open_arrow(file_path, columns=columns + drop,
+                            skip_features=skip_features,
+                            batch_size=batch_size, bbox=bbox,
+                            read_geometry=geometry,
+                            use_pyarrow=True) as (meta, reader):
+        geom_col = meta['geometry_name'] or 'wkb_geometry'
+        if geometry and not read_geometry:
+            drop.append(geom_col)
+        for batch in reader:
+            if max_features is not None:
+                batch = batch.slice(0, max_features)
+                max_features -= batch.num_rows
+            yield meta['crs'], geom_col, _filter(
+                batch, contains=contains,
+                bbox=bbox if tree is not None else None, geom_col=geom_col,
+                drop=drop, tree=tree)
+            if max_features == 0:
+                break
+
+
+def to_geodataframe(table: pa.Table | pa.RecordBatch = None,
+                    geom_col: str = 'geometry',
+                    crs=None) -> gpd.GeoDataFrame:
+    """Convert the Arrow table to GeoDataFrame decoding the WKB geometries"""
+    wkb = table.column(geom_col)
+    if isinstance(wkb, pa.ChunkedArray):
+        wkb = wkb.combine_chunks()
+    geometry = shapely.from_wkb(wkb.to_numpy(zero_copy_only=False))
+
+    df = table.drop_columns([geom_col]).to_pandas()
+
+    return gpd.GeoDataFrame(df, geometry=geometry, crs=crs)
+
+
+def iter_layer(file_path: str = '', columns: list = None,
+               contains: dict = None, batch_size: int = BATCH_SIZE,
+               part: tuple = None, bbox: tuple = None,
+               boxes: np.ndarray = None):
+    """Read the layer in GeoDataFrames with at most batch_size rows
+
+    See `iter_arrow` for the arguments.
+    """
+    for crs, geom_col, batch in iter_arrow(file_path, columns=columns,
+                                           contains=contains,
+                                           batch_size=batch_size,
+                                           part=part, bbox=bbox,
+                                           boxes=boxes):
+        if batch.num_rows:
+            yield to_geodataframe(batch, geom_col, crs)
+
+
+def read_layer(file_path: str = '', columns: list = None,
+               contains: dict = None, batch_size: int = BATCH_SIZE,
+               part: tuple = None, bbox: tuple = None,
+               boxes: np.ndarray = None) -> gpd.GeoDataFrame:
+    """Read the layer keeping only the rows that pass the filters
+
+    See `iter_arrow` for the arguments.
+    """
+    crs, geom_col, batches = None, 'geometry', []
+    for crs, geom_col, batch in iter_arrow(file_path, columns=columns,
+                                           contains=contains,
+                                           batch_size=batch_size,
+                                           part=part, bbox=bbox,
+                                           boxes=boxes):
+        batches.append(batch)
+
+    if batches:
+        table = pa.Table.from_batches(batches)
+    else:
+        table = pa.table({c: pa.array([], pa.string()) for c in
+                          list(columns or []) + [geom_col]})
+
+    return to_geodataframe(table, geom_col, crs)
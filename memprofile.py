@@ -0,0 +1,163 @@
+"""
+Memory profiler of the engine processes
+
+A background thread samples the memory of the engine process and of all its
+descendants (Dask workers, processes of the tiled engine) at a fixed
+interval. Two measures are summed over the process tree:
+
+- RSS: resident memory, including the native allocations of GEOS, GDAL and
+  DuckDB. The shared pages (libraries) are counted once per process.
+- USS: memory unique to each process, freed when it exits. It is the best
+  estimate of the memory the engine needs, but it is slower to read (the
+  pages of each process are scanned), so it can be disabled.
+
+The samples are tagged with the stage running at their time, using the
+start time and wall time of the stage records (see utils.stage), which gives
+the timeline and the peak memory of each stage.
+"""
+
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Interval between the samples in seconds
+INTERVAL = 0.1
+
+# Stage of the samples taken outside the stages (imports, startup, exit)
+NO_STAGE = '(no stage)'
+
+
+class MemorySampler:
+    """Sample the memory of a process tree in a background thread
+
+    Example:
+        sampler = MemorySampler(proc.pid).start()
+        proc.wait()
+        samples = sampler.stop()
+    """
+
+    def __init__(self, pid: int = None, interval: float = INTERVAL,
+                 uss: bool = True):
+        if psutil is None:
+            raise RuntimeError('The memory profiler requires psutil')
+
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.uss = uss
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self) -> dict | None:
+        """Memory of the process and its descendants in MB"""
+        try:
+            processes = [self.process] + \
+                self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return None
+
+        rss, count = 0, 0
+        uss = 0 if self.uss else None
+        for p in processes:
+            try:
+                try:
+                    memory = p.memory_full_info() if uss is not None \
+                        else p.memory_info()
+                except psutil.AccessDenied:
+                    # USS is not readable, so the sum is not complete
+                    uss = None
+                    memory = p.memory_info()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                # Finished between the listing and the reading
+                continue
+            if uss is not None:
+                uss += memory.uss
+            rss += memory.rss
+            count += 1
+
+        if not count:
+            return None
+
+        return {'t': time.time(), 'rss_mb': rss / 1024 ** 2,
+                'uss_mb': uss / 1024 ** 2 if uss is not None else None,
+                'processes': count}
+
+    def _run(self) -> None:
+        while True:
+            sample = self._sample()
+            if sample is not None:
+                self.samples.append(sample)
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self) -> 'MemorySampler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> list:
+        """Stop the sampling and return the samples"""
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+
+def tag_stages(samples: list = None, stages: list = None) -> list:
+    """Set the stage of each sample
+
+    The stages of the worker processes can overlap the stages of the main
+    process, so the sample is tagged with the last started stage running
+    at its time.
+    """
+    spans = sorted((s['started'], s['started'] + s['wall_s'], s['stage'])
+                   for s in stages or [])
+    for sample in samples:
+        sample['stage'] = NO_STAGE
+        for start, end, name in spans:
+            if start > sample['t']:
+                break
+            if sample['t'] <= end:
+                sample['stage'] = name
+
+    return samples
+
+
+def _peak(values: list = None) -> float | None:
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def stage_peaks(samples: list = None) -> list:
+    """Peak RSS and USS of the samples of each stage, in the order the
+    stages were sampled"""
+    names = []
+    for sample in samples:
+        if sample['stage'] not in names:
+            names.append(sample['stage'])
+
+    peaks = []
+    for name in names:
+        tagged = [s for s in samples if s['stage'] == name]
+        peaks.append({
+            'stage': name,
+            'peak_rss_mb': _peak([s['rss_mb'] for s in tagged]),
+            'peak_uss_mb': _peak([s['uss_mb'] for s in tagged]),
+            'samples': len(tagged),
+        })
+
+    return peaks
+
+
+def summarize(samples: list = None, stages: list = None) -> dict:
+    """Tagged timeline, peaks of the whole run and of each stage"""
+    samples = tag_stages(samples, stages)
+
+    return {
+        'peak_rss_mb': _peak([s['rss_mb'] for s in samples]),
+        'peak_uss_mb': _peak([s['uss_mb'] for s in samples]),
+        'memory_stages': stage_peaks(samples),
+        'timeline': samples,
+    }
@@ -0,0 +1,473 @@
+"""
+Overlay functions for the GeoPandas engines
+
+The intersection is computed only for the candidate pairs returned by a
+bulk STRtree query, instead of the whole layers like `gpd.overlay`.
+
+With a grid size, the intersection and the union are computed by GEOS with a
+fixed precision: the vertices are snapped to a grid with that cell size
+(units of the CRS), which keeps the outputs valid and removes the vertices
+of the slivers smaller than the cell.
+
+The geometries with many vertices can be subdivided before the intersection,
+like `ST_Subdivide` of PostGIS, so each intersection is computed between
+small pieces, and the dissolve by cod_imovel reassembles them.
+"""
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+POLYGON = shapely.GeometryType.POLYGON
+MULTIPOLYGON = shapely.GeometryType.MULTIPOLYGON
+GEOMETRYCOLLECTION = shapely.GeometryType.GEOMETRYCOLLECTION
+
+# Maximum number of times a geometry is cut in half by `subdivide`
+SUBDIVIDE_DEPTH = 16
+
+# Distance (units of the CRS) to the line of their neighbours of the
+# vertices of the cuts removed by `merge_cuts`
+CUT_TOLERANCE = 1e-10
+
+
+def keep_polygons(geoms: np.ndarray = None) -> np.ndarray:
+    """Keep only the polygonal part of the geometries
+
+    The intersection of two polygons can also return points and lines
+    (touching borders) inside a GeometryCollection. Geometries without any
+    polygon are returned as None.
+    """
+    geoms = geoms.copy()
+    types = shapely.get_type_id(geoms)
+
+    geoms[~np.isin(types, [POLYGON, MULTIPOLYGON, GEOMETRYCOLLECTION])] = \
+        None
+
+    collections = np.flatnonzero(types == GEOMETRYCOLLECTION)
+    if len(collections):
+        parts, index = shapely.get_parts(geoms[collections],
+                                         return_index=True)
+        # get_parts splits one level, so the multipolygons and the nested
+        # collections (Ex.: from make_valid) are split again
+        while True:
+            nested = np.isin(shapely.get_type_id(parts),
+                             [MULTIPOLYGON, GEOMETRYCOLLECTION])
+            if not nested.any():
+                break
+            sub_parts, sub_index = shapely.get_parts(parts[nested],
+                                                     return_index=True)
+            parts = np.concatenate([parts[~nested], sub_parts])
+            index = np.concatenate([index[~nested],
+                                    index[nested][sub_index]])
+        is_polygon = shapely.get_type_id(parts) == POLYGON
+        parts, index = parts[is_polygon], index[is_polygon]
+        order = np.argsort(index, kind='stable')
+        parts, index = parts[order], index[order]
+
+        geoms[collections] = None
+        if len(parts):
+            unique, index = np.unique(index, return_inverse=True)
+            geoms[collections[unique]] = shapely.multipolygons(
+                parts, indices=index)
+
+    return geoms
+
+
+def _clip(geoms: np.ndarray = None, rects: np.ndarray = None) -> np.ndarray:
+    """Clip each geometry by its rectangle (xmin, ymin, xmax, ymax)
+
+    clip_by_rect is much faster than the intersection with a box. Its
+    wrapper accepts only one rectangle, but the ufunc broadcasts the arrays
+    of rectangles, so each level of the subdivision is clipped in one call.
+    """
+    pieces = shapely.lib.clip_by_rect(geoms, *np.asarray(rects).T)
+
+    return keep_polygons(pieces)
+
+
+def _point_keys(coords: np.ndarray = None) -> np.ndarray:
+    """Points (x, y) as complex numbers, to compare them with np.isin"""
+    return coords[:, 0] + 1j * coords[:, 1]
+
+
+def _snap(values: np.ndarray = None, grid_size: float = None) -> np.ndarray:
+    """Values snapped to the grid, rounded by GEOS like the coordinates of
+    the overlays with grid_size (np.round can differ in the last bit)"""
+    if not grid_size or not len(values):
+        return values
+
+    return shapely.get_x(shapely.set_precision(shapely.points(values, 0),
+                                               grid_size))
+
+
+def subdivide(geoms: np.ndarray = None, max_vertices: int = 256,
+              grid_size: float = None) -> tuple:
+    """Cut the geometries with more than max_vertices in pieces
+
+    Each geometry above the threshold is cut in two halves across the
+    longer side of its bounding box, and the halves are cut again until all
+    the pieces are below the threshold (or SUBDIVIDE_DEPTH cuts). The
+    output of clip_by_rect can be invalid, so the pieces that were cut are
+    validated once at the end. With a grid size, the lines of the cuts are
+    snapped to the grid, so the overlays with the same grid keep the
+    vertices of the cuts on them.
+
+    Returns:
+        Tuple with the pieces, the index of the geometry of each piece and
+        the lines of the cuts (x of the vertical cuts, y of the horizontal
+        cuts), used by `cut_vertices`
+    """
+    pieces, index = geoms, np.arange(len(geoms))
+    done_pieces, done_index, done_cut = [], [], []
+    cuts_x, cuts_y = [], []
+    for depth in range(SUBDIVIDE_DEPTH + 1):
+        big = shapely.get_num_coordinates(pieces) > max_vertices
+        if depth == SUBDIVIDE_DEPTH:
+            big[:] = False
+        done_pieces.append(pieces[~big])
+        done_index.append(index[~big])
+        done_cut.append(np.full((~big).sum(), depth > 0))
+        if not big.any():
+            break
+
+        pieces, index = pieces[big], index[big]
+        xmin, ymin, xmax, ymax = shapely.bounds(pieces).T
+        wide = xmax - xmin >= ymax - ymin
+        xmid = _snap((xmin + xmax) / 2, grid_size)
+        ymid = _snap((ymin + ymax) / 2, grid_size)
+        cuts_x.append(xmid[wide])
+        cuts_y.append(ymid[~wide])
+        # clip_by_rect drops the vertices on the sides of the rectangle, so
+        # only the side of the cut touches the piece
+        pad = xmax - xmin + ymax - ymin + 1
+        xmin, ymin, xmax, ymax = xmin - pad, ymin - pad, xmax + pad, \
+            ymax + pad
+        first = np.column_stack([xmin, ymin, np.where(wide, xmid, xmax),
+                                 np.where(wide, ymax, ymid)])
+        second = np.column_stack([np.where(wide, xmid, xmin),
+                                  np.where(wide, ymin, ymid), xmax, ymax])
+
+        halves = _clip(np.concatenate([pieces, pieces]),
+                       np.concatenate([first, second]))
+        index = np.concatenate([index, index])
+        valid = ~shapely.is_missing(halves)
+        valid[valid] = ~shapely.is_empty(halves[valid])
+        pieces, index = halves[valid], index[valid]
+
+    pieces, index = np.concatenate(done_pieces), np.concatenate(done_index)
+    cut = np.concatenate(done_cut)
+    invalid = cut.copy()
+    invalid[cut] = ~shapely.is_valid(pieces[cut])
+    if invalid.any():
+        pieces[invalid] = keep_polygons(shapely.make_valid(pieces[invalid]))
+        valid = ~shapely.is_missing(pieces)
+        pieces, index = pieces[valid], index[valid]
+
+    order = np.argsort(index, kind='stable')
+    cuts = (np.unique(np.concatenate(cuts_x or [np.empty(0)])),
+            np.unique(np.concatenate(cuts_y or [np.empty(0)])))
+
+    return pieces[order], index[order], cuts
+
+
+def cut_vertices(geoms: np.ndarray = None, cuts: tuple = None,
+                 inputs: np.ndarray = None,
+                 grid_size: float = None) -> np.ndarray:
+    """Vertices added by the cuts of `subdivide`
+
+    The vertices of the geometries (the pieces, or their intersections) on
+    the lines of the cuts that are not vertices of the inputs (snapped to
+    the grid, if any).
+
+    Returns:
+        Array of x, y
+    """
+    vertices = shapely.get_coordinates(geoms)
+    on_cut = np.isin(vertices[:, 0], cuts[0]) | \
+        np.isin(vertices[:, 1], cuts[1])
+    vertices = vertices[on_cut]
+    coords = shapely.get_coordinates(inputs)
+    if grid_size:
+        coords = np.column_stack([_snap(coords[:, 0], grid_size),
+                                  _snap(coords[:, 1], grid_size)])
+    new = ~np.isin(_point_keys(vertices), _point_keys(coords))
+
+    return np.unique(vertices[new], axis=0)
+
+
+def merge_cuts(geoms: np.ndarray = None, cuts: tuple = None,
+               tolerance: float = CUT_TOLERANCE,
+               grid_size: float = None) -> np.ndarray:
+    """Remove the vertices left on the edges by the cuts of `subdivide`
+
+    After the dissolve, the cuts leave vertices on the straight edges of the
+    geometries. Reprojected, the edges bend at these vertices (the
+    projection is not linear), which changes the area. Only the vertices
+    added by the cuts that are on the line between their neighbours (closer
+    than the tolerance) are removed, so the vertices of the inputs are kept.
+
+    Args:
+        geoms: Polygons and multipolygons (other types are not changed)
+        cuts: Vertices added by the cuts (see `cut_vertices`)
+        tolerance: Distance to the line of the neighbours, in units of the
+            CRS
+        grid_size: Grid size of the overlays. A vertex of a cut and its
+            neighbours are snapped to the grid, each one up to half the
+            diagonal of a cell, so the tolerance is at least the diagonal
+    """
+    if grid_size:
+        tolerance = max(tolerance, grid_size * np.sqrt(2))
+    result = np.array(geoms, dtype=object)
+    types = shapely.get_type_id(result)
+    todo = np.flatnonzero(np.isin(types, [POLYGON, MULTIPOLYGON]) &
+                          ~shapely.is_empty(result))
+    if cuts is None or not len(todo):
+        return result
+
+    geom_type, coords, offsets = shapely.to_ragged_array(result[todo])
+    if geom_type == POLYGON:
+        # Only polygons, each one is a multipolygon of one part
+        offsets = (*offsets, np.arange(len(todo) + 1))
+    rings, polygons, multi = offsets
+    cut_keys = _point_keys(cuts)
+
+    # Each vertex is tested against the line of its neighbours, so two
+    # neighbours are not removed in the same round: a run of vertices of
+    # the cuts is removed one vertex per round
+    merged = False
+    while True:
+        starts, ends = rings[:-1], rings[1:]
+        ring = np.repeat(np.arange(len(starts)), ends - starts)
+        closing = np.zeros(len(coords), dtype=bool)
+        closing[ends - 1] = True
+
+        # Neighbours in the ring, without the closing vertex
+        idx = np.arange(len(coords))
+        prev, nxt = idx - 1, idx + 1
+        prev[starts] = ends - 2
+        nxt[ends - 2] = nxt[ends - 1] = starts
+
+        on_cut = np.isin(_point_keys(coords), cut_keys)
+        line = coords[nxt] - coords[prev]
+        offset = coords - coords[prev]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = np.abs(line[:, 0] * offset[:, 1] -
+                              line[:, 1] * offset[:, 0]) / np.hypot(*line.T)
+        drop = on_cut & ~closing & (distance <= tolerance)
+        drop &= ~drop[prev]
+
+        # The rings keep at least 3 vertices
+        removed = np.bincount(ring, weights=drop, minlength=len(starts))
+        drop &= (ends - starts - 1 - removed >= 3)[ring]
+        if not drop.any():
+            break
+
+        # The closing vertex repeats the first vertex kept
+        keep = ~drop
+        first = np.minimum.reduceat(
+            np.where(keep & ~closing, idx, len(idx)), starts)
+        coords = coords.copy()
+        coords[ends - 1] = coords[first]
+        coords = coords[keep]
+        rings = np.r_[0, np.cumsum(np.bincount(
+            ring, weights=keep, minlength=len(starts)))].astype(int)
+        merged = True
+
+    if not merged:
+        return result
+
+    merged = shapely.from_ragged_array(
+        shapely.GeometryType.MULTIPOLYGON, coords, (rings, polygons, multi))
+
+    # to_ragged_array returns the polygons as multipolygons of one part
+    polygon = types[todo] == POLYGON
+    merged[polygon] = shapely.get_geometry(merged[polygon], 0)
+    result[todo] = merged
+
+    return result
+
+
+def candidate_pairs(left: np.ndarray = None, right: np.ndarray = None,
+                    tree: shapely.STRtree = None) -> tuple:
+    """Index pairs (left, right) whose bounding boxes overlap
+
+    Uses a bulk query of a STRtree built with the right geometries, or of
+    the given tree when it is reused across many left arrays.
+    """
+    if tree is None:
+        tree = shapely.STRtree(right)
+    idx_left, idx_right = tree.query(left)
+
+    return idx_left, idx_right
+
+
+def _prepared_side(idx_left: np.ndarray = None,
+                   idx_right: np.ndarray = None) -> int:
+    """Side of the pairs to prepare (0 left, 1 right): the one whose
+    geometries are tested against more partners"""
+    if not len(idx_left):
+        return 0
+    reuse_left = len(idx_left) / len(np.unique(idx_left))
+    reuse_right = len(idx_right) / len(np.unique(idx_right))
+
+    return 0 if reuse_left >= reuse_right else 1
+
+
+def intersection_pairs(left: np.ndarray = None, right: np.ndarray = None,
+                       idx_left: np.ndarray = None,
+                       idx_right: np.ndarray = None,
+                       grid_size: float = None,
+                       prepared: bool = False) -> np.ndarray:
+    """Intersection of the pairs of geometries
+
+    When one geometry of the pair contains the other, the smaller one is the
+    intersection and it is returned without computing the overlay (snapped
+    to the grid, if any). The containment test is done only for the pairs
+    where the bounding box of one geometry covers the other.
+
+    With prepared, the geometries of the side tested against more partners
+    are prepared (an index of their edges, built once and reused by each
+    predicate), the pairs that do not intersect are dropped before the
+    overlay, and the containment by a prepared geometry is tested with
+    contains_properly, the fastest prepared predicate.
+
+    Returns:
+        Array with the intersection of each pair (None when it is empty)
+    """
+    geom_left = left[idx_left]
+    geom_right = right[idx_right]
+    result = np.empty(len(idx_left), dtype=object)
+    todo = np.ones(len(idx_left), dtype=bool)
+
+    side = None
+    if prepared:
+        side = _prepared_side(idx_left, idx_right)
+        geoms = (left, right)[side][np.unique((idx_left, idx_right)[side])]
+        shapely.prepare(geoms)
+        todo = shapely.intersects(*((geom_left, geom_right) if side == 0
+                                    else (geom_right, geom_left)))
+
+    bounds_left = shapely.bounds(geom_left)
+    bounds_right = shapely.bounds(geom_right)
+
+    for i, (big, small, big_bounds, small_bounds) in enumerate((
+            (geom_left, geom_right, bounds_left, bounds_right),
+            (geom_right, geom_left, bounds_right, bounds_left))):
+        candidates = todo & \
+            np.all(big_bounds[:, :2] <= small_bounds[:, :2], axis=1) & \
+            np.all(big_bounds[:, 2:] >= small_bounds[:, 2:], axis=1)
+        contains = shapely.contains_properly if i == side \
+            else shapely.contains
+        candidates[candidates] = contains(big[candidates], small[candidates])
+        result[candidates] = small[candidates]
+        todo &= ~candidates
+
+    if grid_size:
+        contained = ~todo & ~shapely.is_missing(result)
+        result[contained] = shapely.set_precision(result[contained],
+                                                  grid_size)
+    result[todo] = shapely.intersection(geom_left[todo], geom_right[todo],
+                                        grid_size=grid_size)
+    if prepared:
+        # The geometries are shared with the layer, so the prepared
+        # structures are freed
+        shapely.destroy_prepared(geoms)
+
+    result = keep_polygons(result)
+    result[shapely.is_empty(result)] = None
+
+    return result
+
+
+def intersection(gdf_left: gpd.GeoDataFrame = None,
+                 gdf_right: gpd.GeoDataFrame = None,
+                 grid_size: float = None,
+                 max_vertices: int = None,
+                 prepared: bool = False) -> gpd.GeoDataFrame:
+    """Intersection of two polygon layers, like `gpd.overlay(how=
+    'intersection')`
+
+    Args:
+        grid_size: Grid size of the fixed precision. Default: full precision
+        max_vertices: Subdivide the geometries with more vertices before
+            the intersection (see `subdivide`). Default: no subdivision
+        prepared: Test the pairs with prepared geometries (see
+            `intersection_pairs`)
+
+    Returns:
+        GeoDataFrame with the attributes of both layers and one row for each
+        pair of intersecting features (or pieces of them, when subdivided,
+        with the vertices added by the cuts in `attrs['cuts']`)
+    """
+    left = np.asarray(gdf_left.geometry.array)
+    right = np.asarray(gdf_right.geometry.array)
+    piece_left = np.arange(len(left))
+    piece_right = np.arange(len(right))
+
+    idx_left, idx_right = candidate_pairs(left, right)
+    if max_vertices:
+        # Only the geometries of the candidate pairs are subdivided, and
+        # the pairs are searched again between the pieces
+        piece_left, piece_right = np.unique(idx_left), np.unique(idx_right)
+        inputs = np.concatenate([left[piece_left], right[piece_right]])
+        left, index, cuts_left = subdivide(left[piece_left], max_vertices,
+                                           grid_size)
+        piece_left = piece_left[index]
+        right, index, cuts_right = subdivide(right[piece_right],
+                                             max_vertices, grid_size)
+        piece_right = piece_right[index]
+        idx_left, idx_right = candidate_pairs(left, right)
+
+    geoms = intersection_pairs(left, right, idx_left, idx_right,
+                               grid_size, prepared)
+
+    valid = ~shapely.is_missing(geoms)
+    idx_left, idx_right, geoms = \
+        piece_left[idx_left[valid]], piece_right[idx_right[valid]], \
+        geoms[valid]
+
+    df_left = gdf_left.drop(columns=gdf_left.geometry.name).iloc[idx_left]
+    df_right = gdf_right.drop(columns=gdf_right.geometry.name).iloc[
+        idx_right]
+    df_right = df_right.drop(columns=[c for c in df_right.columns
+                                      if c in df_left.columns])
+
+    df = df_left.reset_index(drop=True).join(
+        df_right.reset_index(drop=True))
+
+    gdf = gpd.GeoDataFrame(df, geometry=geoms, crs=gdf_left.crs)
+    if max_vertices:
+        gdf.attrs['cuts'] = cut_vertices(
+            geoms, tuple(np.union1d(a, b)
+                         for a, b in zip(cuts_left, cuts_right)), inputs,
+            grid_size)
+
+    return gdf
+
+
+def dissolve(gdf: gpd.GeoDataFrame = None, by: str = 'cod_imovel',
+             grid_size: float = None) -> gpd.GeoDataFrame:
+    """Union the geometries of each group, like `gdf.dissolve(by=by)`
+
+    The groups with a single geometry are returned without the union (they
+    come from the intersection, already snapped to the grid).
+
+    Returns:
+        GeoDataFrame indexed by the column `by`
+    """
+    geoms = np.asarray(gdf.geometry.array)
+    keys, inverse, counts = np.unique(gdf[by].to_numpy(),
+                                      return_inverse=True, return_counts=True)
+
+    result = np.empty(len(keys), dtype=object)
+    single = counts[inverse] == 1
+    result[inverse[single]] = geoms[single]
+
+    multi = np.flatnonzero(~single)
+    order = multi[np.argsort(inverse[multi], kind='stable')]
+    groups, starts = np.unique(inverse[order], return_index=True)
+    for group, pieces in zip(groups, np.split(geoms[order], starts[1:])):
+        result[group] = shapely.union_all(pieces, grid_size=grid_size)
+
+    return gpd.GeoDataFrame({by: keys}, geometry=result,
+                            crs=gdf.crs).set_index(by)
@@ -0,0 +1,110 @@
+"""
+Spatial prefilter of CAR from the MapBiomas Alerta layer
+
+The alerts cover a small fraction of the state. In a first phase only the
+bounds of the alerts are read and marked in a grid over their extent, and the
+occupied cells, merged in rectangles, are a compact summary of the area of
+the alerts. In the second phase CAR is read with these boxes (see
+`loaders.iter_arrow`), so only the features that can intersect an alert are
+converted to shapely: for GeoParquet the row groups and the rows are filtered
+with the bbox covering column before the geometries are read, and for
+Shapefile GDAL reads only the extent of the alerts.
+"""
+
+import numpy as np
+import shapely
+
+from loaders import iter_arrow
+from utils import info
+
+# Number of cells of the grid in X and Y
+GRID_SIZE = 256
+
+
+def alert_bounds(file_path: str = '') -> np.ndarray:
+    """Bounds (xmin, ymin, xmax, ymax) of each feature of the layer
+
+    The geometries are decoded batch by batch and not kept.
+    """
+    bounds = [np.empty((0, 4))]
+    for _, geom_col, batch in iter_arrow(file_path):
+        wkb = batch[geom_col].to_numpy(zero_copy_only=False)
+        bounds.append(shapely.bounds(shapely.from_wkb(wkb)))
+
+    bounds = np.concatenate(bounds)
+
+    return bounds[~np.isnan(bounds).any(axis=1)]
+
+
+def mask_boxes(bounds: np.ndarray = None,
+               grid_size: int = GRID_SIZE) -> np.ndarray:
+    """Rectangles covering the cells of the grid occupied by the bounds
+
+    Args:
+        bounds: Bounds (xmin, ymin, xmax, ymax) of the alerts
+        grid_size: Number of cells of the grid in X and Y
+
+    Returns:
+        Rectangles (xmin, ymin, xmax, ymax), one for each run of occupied
+        cells in a row of the grid
+    """
+    if not len(bounds):
+        return np.empty((0, 4))
+
+    x0, y0 = bounds[:, 0].min(), bounds[:, 1].min()
+    dx = (bounds[:, 2].max() - x0) / grid_size or 1.0
+    dy = (bounds[:, 3].max() - y0) / grid_size or 1.0
+
+    def _cells(lower, upper, origin, size):
+        first = np.clip(np.floor((lower - origin) / size), 0, grid_size - 1)
+        last = np.clip(np.floor((upper - origin) / size), 0, grid_size - 1)
+        # The cells must cover the bounds despite the rounding
+        first = np.where(origin + first * size > lower, first - 1, first)
+        last = np.where(origin + (last + 1) * size < upper, last + 1, last)
+        return (np.clip(first, 0, grid_size - 1).astype(int),
+                np.clip(last, 0, grid_size - 1).astype(int))
+
+    i0, i1 = _cells(bounds[:, 0], bounds[:, 2], x0, dx)
+    j0, j1 = _cells(bounds[:, 1], bounds[:, 3], y0, dy)
+
+    # Cells covered by each alert, marked with a 2D difference array
+    diff = np.zeros((grid_size + 1, grid_size + 1), dtype=np.int64)
+    np.add.at(diff, (j0, i0), 1)
+    np.add.at(diff, (j0, i1 + 1), -1)
+    np.add.at(diff, (j1 + 1, i0), -1)
+    np.add.at(diff, (j1 + 1, i1 + 1), 1)
+    occupied = diff.cumsum(axis=0).cumsum(axis=1)[:grid_size, :grid_size] > 0
+
+    # Runs of occupied cells in each row
+    edges = np.diff(np.pad(occupied, ((0, 0), (1, 1))).astype(np.int8),
+                    axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+
+    xmax = np.where(ends == grid_size, bounds[:, 2].max(), x0 + ends * dx)
+    ymax = np.where(rows + 1 == grid_size, bounds[:, 3].max(),
+                    y0 + (rows + 1) * dy)
+
+    boxes = np.column_stack([x0 + starts * dx, y0 + rows * dy, xmax, ymax])
+    area = ((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])).sum()
+    info(f'Prefilter with {len(boxes)} boxes, covering '
+         f'{area / (dx * dy * grid_size ** 2):.1%} of the extent of the '
+         f'alerts')
+
+    return boxes
+
+
+def intersects_boxes(bounds: np.ndarray = None,
+                     boxes: np.ndarray = None) -> np.ndarray:
+    """Mask of the bounds (xmin, ymin, xmax, ymax) that intersect one of
+    the boxes (see `mask_boxes`)"""
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    keep = np.zeros(len(bounds), dtype=bool)
+    if not len(bounds) or not len(boxes):
+        return keep
+
+    tree = shapely.STRtree(shapely.box(*boxes.T))
+    keep[tree.query(shapely.box(*bounds.T), predicate='intersects')[0]] = True
+
+    return keep
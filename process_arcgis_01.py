@@ -7,7 +7,7 @@ Requires: A valid license for ArcGIS Pro
 import argparse
 from pathlib import Path
 import time
-from utils import info, info_finished
+from utils import info_finished, stage
 
 try:
     import arcpy
@@ -29,53 +29,53 @@ def run(car_file_path: str = '',
     arcpy.management.CreateFileGDB(path_results, 'temp.gdb')
     arcpy.env.workspace = temp_gdb
 
-    info('Filtering CAR only contains "Analise"...')
-    car_selected = 'car_selected'
-    arcpy.analysis.Select(in_features=car_file_path,
-                          out_feature_class=car_selected,
-                          where_clause="\"des_condic\" like '%analise%'")
-
-    info('Intersection layers...')
-    intersect = 'car_x_mp'
-    arcpy.analysis.Intersect(
-        in_features=[[car_selected, ""], [mp_file_path, ""]],
-        out_feature_class=intersect)
-
-    info('Dissolving...')
-    dissolve = 'car_x_mp_dissolve'
-    arcpy.management.Dissolve(in_features=intersect,
-                              out_feature_class=dissolve,
-                              dissolve_field=["cod_imovel"])
-
-    info('Transforming to UTM...')
-    dissolve_utm = 'dissolve_utm'
-    out_crs = arcpy.SpatialReference(31982)
-    arcpy.Project_management(dissolve, dissolve_utm, out_crs)
-
-    info('Calculating area...')
-    arcpy.management.CalculateGeometryAttributes(
-        in_features=dissolve_utm,
-        geometry_property=[["area_ha", "AREA"]], area_unit="HECTARES")
-
-    info('Saving results...')
-    file_results = Path(path_results, 'results_arcpy_01.gpkg').__str__()
-    arcpy.management.CreateSQLiteDatabase(
-        out_database_name=file_results,
-        spatial_type="GEOPACKAGE_1.3")
-
-    cod_imovel_fm = arcpy.FieldMap()
-    area_ha_fm = arcpy.FieldMap()
-    fms = arcpy.FieldMappings()
-
-    cod_imovel_fm.addInputField(dissolve_utm, 'cod_imovel')
-    area_ha_fm.addInputField(dissolve_utm, 'area_ha')
-    fms.addFieldMap(cod_imovel_fm)
-    fms.addFieldMap(area_ha_fm)
-
-    layer_results = Path(file_results, 'results_arcpy_01').__str__()
-    arcpy.conversion.ExportFeatures(in_features=dissolve_utm,
-                                    field_mapping=fms,
-                                    out_features=layer_results)
+    with stage('Filtering CAR only contains "Analise"'):
+        car_selected = 'car_selected'
+        arcpy.analysis.Select(in_features=car_file_path,
+                              out_feature_class=car_selected,
+                              where_clause="\"des_condic\" like '%analise%'")
+
+    with stage('Intersection layers'):
+        intersect = 'car_x_mp'
+        arcpy.analysis.Intersect(
+            in_features=[[car_selected, ""], [mp_file_path, ""]],
+            out_feature_class=intersect)
+
+    with stage('Dissolving'):
+        dissolve = 'car_x_mp_dissolve'
+        arcpy.management.Dissolve(in_features=intersect,
+                                  out_feature_class=dissolve,
+                                  dissolve_field=["cod_imovel"])
+
+    with stage('Transforming to UTM'):
+        dissolve_utm = 'dissolve_utm'
+        out_crs = arcpy.SpatialReference(31982)
+        arcpy.Project_management(dissolve, dissolve_utm, out_crs)
+
+    with stage('Calculating area'):
+        arcpy.management.CalculateGeometryAttributes(
+            in_features=dissolve_utm,
+            geometry_property=[["area_ha", "AREA"]], area_unit="HECTARES")
+
+    with stage('Saving results'):
+        file_results = Path(path_results, 'results_arcpy_01.gpkg').__str__()
+        arcpy.management.CreateSQLiteDatabase(
+            out_database_name=file_results,
+            spatial_type="GEOPACKAGE_1.3")
+
+        cod_imovel_fm = arcpy.FieldMap()
+        area_ha_fm = arcpy.FieldMap()
+        fms = arcpy.FieldMappings()
+
+        cod_imovel_fm.addInputField(dissolve_utm, 'cod_imovel')
+        area_ha_fm.addInputField(dissolve_utm, 'area_ha')
+        fms.addFieldMap(cod_imovel_fm)
+        fms.addFieldMap(area_ha_fm)
+
+        layer_results = Path(file_results, 'results_arcpy_01').__str__()
+        arcpy.conversion.ExportFeatures(in_features=dissolve_utm,
+                                        field_mapping=fms,
+                                        out_features=layer_results)
 
     info_finished(start_time=start)
 
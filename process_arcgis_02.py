@@ -7,7 +7,7 @@ Requires: A valid license for ArcGIS Pro
 import argparse
 from pathlib import Path
 import time
-from utils import info, info_finished
+from utils import info_finished, stage
 
 try:
     import arcpy
@@ -28,60 +28,60 @@ def run(car_file_path: str = '',
     """
     # arcpy.env.parallelProcessingFactor = "50%"
 
-    info('Filtering CAR only contains "Analise"...')
-    car_selected = r'memory\car_selected'
-    arcpy.analysis.Select(in_features=car_file_path,
-                          out_feature_class=car_selected,
-                          where_clause="\"des_condic\" like '%analise%'")
-
-    info('Intersection layers...')
-    intersect = r'memory\car_x_mp'
-    arcpy.analysis.PairwiseIntersect(
-        in_features=[car_selected, mp_file_path],
-        out_feature_class=intersect)
-
-    info('Dissolving...')
-    dissolve = r'memory\car_x_mp_dissolve'
-    arcpy.management.Dissolve(in_features=intersect,
-                              out_feature_class=dissolve,
-                              dissolve_field=["cod_imovel"])
-
-    """
-    Execution the PairwiseDissolve after PairwiseIntersect returns an error: 
-    invalid geometries, so I use the Dissolve instead
-    """
-    # arcpy.analysis.PairwiseDissolve(in_features=intersect,
-    #                                 out_feature_class=dissolve,
-    #                                 dissolve_field=["cod_imovel"])
-
-    info('Transforming to UTM...')
-    dissolve_utm = r'memory\dissolve_utm'
-    out_crs = arcpy.SpatialReference(31982)
-    arcpy.Project_management(dissolve, dissolve_utm, out_crs)
-
-    info('Calculating area...')
-    arcpy.management.CalculateGeometryAttributes(
-        in_features=dissolve_utm,
-        geometry_property=[["area_ha", "AREA"]], area_unit="HECTARES")
-
-    cod_imovel_fm = arcpy.FieldMap()
-    area_ha_fm = arcpy.FieldMap()
-    fms = arcpy.FieldMappings()
-
-    cod_imovel_fm.addInputField(dissolve_utm, 'cod_imovel')
-    area_ha_fm.addInputField(dissolve_utm, 'area_ha')
-    fms.addFieldMap(cod_imovel_fm)
-    fms.addFieldMap(area_ha_fm)
-
-    info('Saving results...')
-    file_results = Path(path_results, 'results_arcpy_02.gpkg').__str__()
-    arcpy.management.CreateSQLiteDatabase(
-        out_database_name=file_results,
-        spatial_type="GEOPACKAGE_1.3")
-
-    layer_results = Path(file_results, 'results_arcpy_02').__str__()
-    arcpy.conversion.ExportFeatures(in_features=dissolve_utm,
-                                    out_features=layer_results)
+    with stage('Filtering CAR only contains "Analise"'):
+        car_selected = r'memory\car_selected'
+        arcpy.analysis.Select(in_features=car_file_path,
+                              out_feature_class=car_selected,
+                              where_clause="\"des_condic\" like '%analise%'")
+
+    with stage('Intersection layers'):
+        intersect = r'memory\car_x_mp'
+        arcpy.analysis.PairwiseIntersect(
+            in_features=[car_selected, mp_file_path],
+            out_feature_class=intersect)
+
+    with stage('Dissolving'):
+        dissolve = r'memory\car_x_mp_dissolve'
+        arcpy.management.Dissolve(in_features=intersect,
+                                  out_feature_class=dissolve,
+                                  dissolve_field=["cod_imovel"])
+
+        """
+        Execution the PairwiseDissolve after PairwiseIntersect returns an error: 
+        invalid geometries, so I use the Dissolve instead
+        """
+        # arcpy.analysis.PairwiseDissolve(in_features=intersect,
+        #                                 out_feature_class=dissolve,
+        #                                 dissolve_field=["cod_imovel"])
+
+    with stage('Transforming to UTM'):
+        dissolve_utm = r'memory\dissolve_utm'
+        out_crs = arcpy.SpatialReference(31982)
+        arcpy.Project_management(dissolve, dissolve_utm, out_crs)
+
+    with stage('Calculating area'):
+        arcpy.management.CalculateGeometryAttributes(
+            in_features=dissolve_utm,
+            geometry_property=[["area_ha", "AREA"]], area_unit="HECTARES")
+
+        cod_imovel_fm = arcpy.FieldMap()
+        area_ha_fm = arcpy.FieldMap()
+        fms = arcpy.FieldMappings()
+
+        cod_imovel_fm.addInputField(dissolve_utm, 'cod_imovel')
+        area_ha_fm.addInputField(dissolve_utm, 'area_ha')
+        fms.addFieldMap(cod_imovel_fm)
+        fms.addFieldMap(area_ha_fm)
+
+    with stage('Saving results'):
+        file_results = Path(path_results, 'results_arcpy_02.gpkg').__str__()
+        arcpy.management.CreateSQLiteDatabase(
+            out_database_name=file_results,
+            spatial_type="GEOPACKAGE_1.3")
+
+        layer_results = Path(file_results, 'results_arcpy_02').__str__()
+        arcpy.conversion.ExportFeatures(in_features=dissolve_utm,
+                                        out_features=layer_results)
 
     info_finished(start_time=start)
 
@@ -4,58 +4,308 @@ Script to process GeoParquet input using Dask-Geopandas
 """
 
 import argparse
-import geopandas as gpd
+import os
+import dask
+import dask.dataframe as dd
+from dask import delayed
 import dask_geopandas as dgpd
+import geopandas as gpd
+import numpy as np
+import pandas as pd
 from pathlib import Path
+import shapely
 import time
-from datetime import datetime, timedelta
-from utils import info
+from balance import balance_pairs, pair_costs
+from cache import cache_inputs
+from loaders import layer_crs, read_layer
+from overlay import candidate_pairs, dissolve, intersection, \
+    intersection_pairs
+from prefilter import alert_bounds, mask_boxes
+from reproject import utm_area
+from utils import info_finished, stage
+from writers import FORMATS, results_path, write_layer
+
+
+# Number of partitions, one for each core
+n_parts = os.cpu_count() or 4
+
+MODES = ['partitioned', 'dissolve', 'balanced']
+
+# "local": the intersection is co-partitioned by a hash of cod_imovel as it
+# is produced and each partition is dissolved alone. "shuffle": Dask dissolve
+DISSOLVE_MODES = ['local', 'shuffle']
+
+
+def _read_part(file_path: str = '', columns: list = None,
+               contains: dict = None, part: tuple = None,
+               crs=None, boxes=None) -> gpd.GeoDataFrame:
+    gdf = read_layer(file_path, columns=columns, contains=contains,
+                     part=part, boxes=boxes)
+    return gdf.set_crs(crs, allow_override=True)
+
+
+def read_partitioned(file_path: str = '', columns: list = None,
+                     contains: dict = None,
+                     npartitions: int = n_parts,
+                     boxes=None) -> dgpd.GeoDataFrame:
+    """Read the layer in partitions, each one read by a Dask task
+
+    With boxes, only the features whose bounding box intersects one of them
+    are read (see `loaders.iter_arrow`).
+    """
+    crs = layer_crs(file_path)
+    if Path(file_path).suffix.lower() == '.parquet':
+        crs = 'EPSG:4674'
+
+    meta = gpd.GeoDataFrame(
+        {c: pd.Series([], dtype=object) for c in columns or []},
+        geometry=gpd.GeoSeries([], crs=crs))
+    parts = [delayed(_read_part)(file_path, columns, contains,
+                                 (i, npartitions), crs, boxes)
+             for i in range(npartitions)]
+
+    return dd.from_delayed(parts, meta=meta)
+
+
+def overlay_partitioned(dgdf_left: dgpd.GeoDataFrame = None,
+                        dgdf_right: dgpd.GeoDataFrame = None,
+                        grid_size: float = None) -> dgpd.GeoDataFrame:
+    """Intersection of the layers computed partition by partition
+
+    Only the pairs of partitions whose spatial partitions (convex hulls)
+    intersect are processed.
+    """
+    tree = shapely.STRtree(dgdf_right.spatial_partitions.values)
+    idx_left, idx_right = tree.query(dgdf_left.spatial_partitions.values,
+                                     predicate='intersects')
+
+    meta = intersection(dgdf_left._meta, dgdf_right._meta)
+    if not len(idx_left):
+        return dgpd.from_geopandas(meta, npartitions=1)
+
+    parts_left = dgdf_left.to_delayed()
+    parts_right = dgdf_right.to_delayed()
+    parts = [delayed(intersection)(parts_left[i], parts_right[j], grid_size)
+             for i, j in zip(idx_left, idx_right)]
+
+    # Dask can convert the object columns of the persisted partitions to
+    # string, so the dtypes of the partitions are not checked against meta
+    return dd.from_delayed(parts, meta=meta, verify_meta=False)
+
+
+def _intersect_pairs(gdf_left: gpd.GeoDataFrame = None,
+                     right: np.ndarray = None, idx_left: np.ndarray = None,
+                     idx_right: np.ndarray = None,
+                     grid_size: float = None) -> gpd.GeoDataFrame:
+    left = np.asarray(gdf_left.geometry.array)
+    geoms = intersection_pairs(left, right, idx_left, idx_right, grid_size)
+    valid = ~shapely.is_missing(geoms)
+
+    return gpd.GeoDataFrame(
+        {'cod_imovel': gdf_left['cod_imovel'].to_numpy()[idx_left[valid]]},
+        geometry=geoms[valid], crs=gdf_left.crs)
+
+
+def overlay_balanced(gdf_left: gpd.GeoDataFrame = None,
+                     gdf_right: gpd.GeoDataFrame = None,
+                     idx_left: np.ndarray = None,
+                     idx_right: np.ndarray = None, parts: list = None,
+                     grid_size: float = None) -> dgpd.GeoDataFrame:
+    """Intersection of the candidate pairs, one Dask task for each
+    partition of the pairs (see `balance.balance_pairs`)"""
+    meta = gpd.GeoDataFrame({'cod_imovel': pd.Series([], dtype=object)},
+                            geometry=gpd.GeoSeries([], crs=gdf_left.crs))
+
+    # The layers are added once to the graph, without hashing them
+    left = delayed(gdf_left[['cod_imovel', gdf_left.geometry.name]],
+                   name='balanced-left', traverse=False)
+    right = delayed(np.asarray(gdf_right.geometry.array),
+                    name='balanced-right', traverse=False)
+    tasks = [delayed(_intersect_pairs, pure=False)(
+                 left, right, idx_left[part], idx_right[part], grid_size)
+             for part in parts]
+
+    return dd.from_delayed(tasks, meta=meta, verify_meta=False)
+
+
+def _split_by_hash(gdf: gpd.GeoDataFrame = None, by: str = 'cod_imovel',
+                   n: int = n_parts) -> tuple:
+    """Split the rows in n parts by the hash of the column"""
+    bucket = pd.util.hash_pandas_object(gdf[by], index=False).to_numpy() % n
+    return tuple(gdf[bucket == i] for i in range(n))
+
+
+def _dissolve_bucket(parts: list = None, by: str = 'cod_imovel',
+                     grid_size: float = None) -> gpd.GeoDataFrame:
+    return dissolve(pd.concat(parts), by=by, grid_size=grid_size)
+
 
+def dissolve_copartitioned(dgdf: dgpd.GeoDataFrame = None,
+                           by: str = 'cod_imovel',
+                           npartitions: int = n_parts,
+                           grid_size: float = None) -> dgpd.GeoDataFrame:
+    """Dissolve without shuffle and without merge across partitions
 
-n_parts = 4  # Number of partitions
+    Each partition is split by the hash of the column as soon as it is
+    computed, so all the rows of a group end up in the same bucket, which is
+    dissolved alone.
+    """
+    meta = dissolve(dgdf._meta, by=by)
+    splits = [delayed(_split_by_hash, nout=npartitions)(part, by,
+                                                        npartitions)
+              for part in dgdf.to_delayed()]
+    buckets = [delayed(_dissolve_bucket)([split[i] for split in splits], by,
+                                         grid_size)
+               for i in range(npartitions)]
 
+    return dd.from_delayed(buckets, meta=meta, verify_meta=False)
 
-def run(car_file_path: str = '', mp: str = '', path_results: str = ''):
+
+def _load(car_file_path: str = '', mp: str = '',
+          prefilter: bool = False) -> tuple:
+    gdf_mp = read_layer(mp)
+    boxes = mask_boxes(gdf_mp.bounds.to_numpy()) if prefilter else None
+    # The filter is applied to the Arrow batches while reading, so only
+    # the geometries of the CAR with 'analise' are decoded
+    gdf_car = read_layer(car_file_path, columns=['cod_imovel'],
+                         contains={'des_condic': 'analise'}, boxes=boxes)
+
+    return gdf_car, gdf_mp
+
+
+def run(car_file_path: str = '', mp: str = '', path_results: str = '',
+        npartitions: int = n_parts, mode: str = 'partitioned',
+        dissolve_mode: str = 'local', cache: bool = False,
+        fmt: str = 'gpkg', crs: str = None, prefilter: bool = False,
+        workers: int = None, grid_size: float = None):
+    """Process the layers
+
+    Args:
+        car_file_path: File path of CAR
+        mp: File path of MapBiomas Alerta
+        path_results: Path to save the results
+        npartitions: Number of partitions
+        mode: "partitioned" reads, shuffles and intersects the layers in
+            spatial partitions. "dissolve" processes the layers with
+            GeoPandas and uses Dask only for the dissolve. "balanced" finds
+            the candidate pairs with GeoPandas and intersects them in
+            partitions of about the same estimated cost (vertices x pairs)
+        dissolve_mode: "local" dissolves co-partitioned groups in parallel.
+            "shuffle" uses the Dask dissolve
+        cache: Read the inputs from the GeoParquet cache (Hilbert sorted),
+            so the partitions are already spatially compact and the spatial
+            shuffle is skipped
+        fmt: Format of the results (one of writers.FORMATS)
+        crs: CRS of the inputs, used to reproject the results. Default:
+            CRS of the layer, or EPSG:4674
+        prefilter: Read the bounds of the alerts first and load only the
+            CAR features near them
+        workers: Number of threads of the Dask scheduler. Default: number
+            of cores
+        grid_size: Grid size to snap the vertices in the intersection and
+            union. The Dask dissolve ("shuffle") has no fixed precision, so
+            its results are snapped after the union. Default: full precision
+    """
     start = time.perf_counter()
 
-    info('Loading layers...')
-    cols_car = ['cod_imovel', 'des_condic', 'geometry']
-    gdf_car = gpd.read_file(car_file_path, columns=cols_car)
+    if workers:
+        dask.config.set(num_workers=workers)
+
+    if cache:
+        car_file_path, mp = cache_inputs(car_file_path, mp)
+
+    if mode == 'partitioned':
+        boxes = None
+        if prefilter:
+            with stage('Summarizing alerts') as st:
+                boxes = mask_boxes(alert_bounds(mp))
+                st.features = len(boxes)
+
+        with stage('Loading layers') as st:
+            dgdf_car = read_partitioned(car_file_path, columns=['cod_imovel'],
+                                        contains={'des_condic': 'analise'},
+                                        npartitions=npartitions,
+                                        boxes=boxes).persist()
+            dgdf_mp = read_partitioned(mp,
+                                       npartitions=npartitions).persist()
+            st.features = len(dgdf_car)
 
-    cols_mp = ['geometry']
-    gdf_mp = gpd.read_file(mp, columns=cols_mp)
+        if cache:
+            with stage('Calculating spatial partitions') as st:
+                dgdf_car.calculate_spatial_partitions()
+                dgdf_mp.calculate_spatial_partitions()
+        else:
+            with stage('Spatial shuffle') as st:
+                dgdf_car = dgdf_car.spatial_shuffle(
+                    by='hilbert', npartitions=npartitions).persist()
+                dgdf_mp = dgdf_mp.spatial_shuffle(
+                    by='hilbert', npartitions=npartitions).persist()
 
-    info('Filtering CAR only contains "Analise"...')
-    # Select CAR only contanis the world 'analise'
-    gdf_car = gdf_car[gdf_car['des_condic'].str.contains('analise')]
+        with stage('Intersection layers') as st:
+            dgdf_intersect = overlay_partitioned(dgdf_car, dgdf_mp,
+                                                 grid_size).persist()
+            del dgdf_car, dgdf_mp
+            st.features = len(dgdf_intersect)
 
-    info('Intersection layers...')
-    gdf_intersect = gpd.overlay(gdf_car, gdf_mp, how='intersection')
-    del gdf_car, gdf_mp
+    elif mode == 'balanced':
+        with stage('Loading layers') as st:
+            gdf_car, gdf_mp = _load(car_file_path, mp, prefilter)
+            st.count(gdf_car.geometry)
 
-    info('Dissolving...')
-    dgdf_intersect = dgpd.from_geopandas(gdf_intersect, npartitions=n_parts)
-    gdf_dissolve = dgdf_intersect.dissolve(by='cod_imovel').compute()
+        with stage('Balancing partitions') as st:
+            left = np.asarray(gdf_car.geometry.array)
+            right = np.asarray(gdf_mp.geometry.array)
+            idx_left, idx_right = candidate_pairs(left, right)
+            parts = balance_pairs(
+                idx_left, pair_costs(left, right, idx_left, idx_right),
+                npartitions)
+            st.features = len(idx_left)
 
-    del dgdf_intersect, gdf_intersect
+        with stage('Intersection layers') as st:
+            dgdf_intersect = overlay_balanced(gdf_car, gdf_mp, idx_left,
+                                              idx_right, parts,
+                                              grid_size).persist()
+            del gdf_car, gdf_mp, left, right
+            st.features = len(dgdf_intersect)
 
-    info('Transforming to UTM and calculating area...')
-    gdf_dissolve = gdf_dissolve.to_crs(epsg=31982).reset_index()
-    gdf_dissolve['area_ha'] = gdf_dissolve.area / 10000
-    gdf_dissolve = gdf_dissolve[['cod_imovel', 'area_ha', 'geometry']]
+    else:
+        with stage('Loading layers') as st:
+            gdf_car, gdf_mp = _load(car_file_path, mp, prefilter)
+            st.count(gdf_car.geometry)
 
-    info('Saving results...')
-    file_results = Path(path_results,
-                        'results_dask-geopandas.gpkg').__str__()
-    gdf_dissolve.to_file(file_results, driver='GPKG',
-                         layer='res_dask-geopandas')
+        with stage('Intersection layers') as st:
+            gdf_intersect = intersection(gdf_car, gdf_mp, grid_size)
+            del gdf_car, gdf_mp
+            st.count(gdf_intersect.geometry)
 
-    finished = time.perf_counter()
-    total_time = timedelta(seconds=finished - start)
-    total_time_format = (datetime.min + total_time).time().strftime(
-        "%H:%M:%S.%f")[:-3]
+        dgdf_intersect = dgpd.from_geopandas(gdf_intersect,
+                                             npartitions=npartitions)
+        del gdf_intersect
 
-    info(f'Finished in {total_time_format}')
+    with stage('Dissolving') as st:
+        if dissolve_mode == 'local':
+            gdf_dissolve = dissolve_copartitioned(
+                dgdf_intersect, npartitions=npartitions,
+                grid_size=grid_size).compute()
+        else:
+            gdf_dissolve = dgdf_intersect.dissolve(by='cod_imovel').compute()
+            if grid_size:
+                gdf_dissolve.geometry = shapely.set_precision(
+                    gdf_dissolve.geometry.values, grid_size)
+        st.count(gdf_dissolve.geometry)
+
+    del dgdf_intersect
+
+    with stage('Transforming to UTM and calculating area') as st:
+        gdf_dissolve = utm_area(gdf_dissolve, src=crs)
+        st.features = len(gdf_dissolve)
+
+    with stage('Saving results'):
+        file_results = results_path(path_results, 'results_dask-geopandas',
+                                    fmt)
+        write_layer(gdf_dissolve, file_results, layer='res_dask-geopandas')
+
+    info_finished(start_time=start)
 
 
 def main():
@@ -74,6 +324,55 @@ def main():
         '-r', type=str, required=True, dest='r',
         help='Path to save the results'
     )
+    parser.add_argument(
+        '-parts', type=int, default=n_parts, dest='parts',
+        help='Number of partitions (default: number of cores)'
+    )
+    parser.add_argument(
+        '-workers', type=int, default=None, dest='workers',
+        help='Number of threads of the Dask scheduler (default: number of '
+             'cores)'
+    )
+    parser.add_argument(
+        '-mode', type=str, default='partitioned', dest='mode',
+        choices=MODES,
+        help='"partitioned" reads, shuffles and intersects the layers in '
+             'spatial partitions; "dissolve" uses Dask only in the dissolve; '
+             '"balanced" intersects the candidate pairs in partitions of '
+             'about the same cost (vertices x pairs)'
+    )
+    parser.add_argument(
+        '-dissolve', type=str, default='local', dest='dissolve',
+        choices=DISSOLVE_MODES,
+        help='"local" dissolves the intersection co-partitioned by '
+             'cod_imovel with no shuffle; "shuffle" uses the Dask dissolve'
+    )
+    parser.add_argument(
+        '-format', type=str, default='gpkg', dest='format',
+        choices=list(FORMATS),
+        help='Format of the results (default: gpkg)'
+    )
+    parser.add_argument(
+        '-crs', type=str, default=None, dest='crs',
+        help='CRS of the inputs, used to reproject the results to UTM '
+             '(default: CRS of the layer, or EPSG:4674)'
+    )
+    parser.add_argument(
+        '-cache', action='store_true', dest='cache',
+        help='Read the inputs from the GeoParquet cache, creating it on the '
+             'first run'
+    )
+    parser.add_argument(
+        '-prefilter', action='store_true', dest='prefilter',
+        help='Read MapBiomas first and load only the CAR features near the '
+             'alerts'
+    )
+    parser.add_argument(
+        '-grid', type=float, default=None, dest='grid',
+        help='Grid size to snap the vertices in the intersection and union, '
+             'in units of the CRS of the inputs (Ex.: 1e-7 degrees, about '
+             '1 cm). Default: full precision'
+    )
 
     args = parser.parse_args()
 
@@ -91,7 +390,10 @@ def main():
         print(f'Path {path_results} not found.')
         return
 
-    run(car_file_path=car, mp=mp, path_results=path_results)
+    run(car_file_path=car, mp=mp, path_results=path_results,
+        npartitions=args.parts, mode=args.mode, dissolve_mode=args.dissolve,
+        cache=args.cache, fmt=args.format, crs=args.crs,
+        prefilter=args.prefilter, workers=args.workers, grid_size=args.grid)
 
 
 if __name__ == '__main__':
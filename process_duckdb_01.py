@@ -1,128 +1,39 @@
 import argparse
-import duckdb as dkb
 from duckdb import DuckDBPyConnection
 from pathlib import Path
-import time
-from datetime import datetime, timedelta
-from utils import info
+from duckdb_etl import DuckDBETL
+from writers import FORMATS
 
 
-class ETL:
+class ETL(DuckDBETL):
+    geom = 'geom'
 
-    @staticmethod
-    def _create_db_memory() -> DuckDBPyConnection:
-        con = dkb.connect()
-        con.install_extension("spatial")
-        con.load_extension("spatial")
-
-        return con
-
-    @staticmethod
-    def _create_tables(con: DuckDBPyConnection = None,
+    def _create_tables(self, con: DuckDBPyConnection = None,
                        file_path: str = '',
                        table_name: str = '',
-                       cols: list = None) -> None:
-        cols_str = ', '.join(cols) if cols else '*'
-        sql = """
-        CREATE TEMPORARY TABLE IF NOT EXISTS {0} AS 
-        SELECT 
-            {1} 
-        FROM ST_Read('{2}')
-        """.format(table_name, cols_str, file_path)
-        con.execute(sql.format(table_name))
-
-    def run(self, car_file_path: str = '', mp: str = '',
-            path_results: str = ''):
-        start = time.perf_counter()
-
-        con = self._create_db_memory()
-
-        car_table_name = 'CAR'
-        cols_car = ['cod_imovel', 'des_condic', 'geom']
-        map_biomas_table_name = 'MP'
-        cols_mp = ['geom']
-
-        info('Loading layers...')
-        self._create_tables(con=con, file_path=car_file_path,
-                            table_name=car_table_name,
-                            cols=cols_car)
-        self._create_tables(con=con, file_path=mp,
-                            table_name=map_biomas_table_name,
-                            cols=cols_mp)
-
-        info('Filtering CAR only contains "Analise"...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE CAR AS 
-        SELECT 
-            c.cod_imovel, c.geom FROM {0} c 
-        WHERE 
-            c.des_condic LIKE '%analise%';
-        """.format(car_table_name)
-        con.execute(sql)
-
-        info('Intersection layers...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE CAR AS 
-        SELECT
-            c.cod_imovel,
-            ST_Intersection(c.geom, m.geom) AS geom
-        FROM
-            {0} c
-        JOIN {1} m ON ST_Intersects(c.geom, m.geom);
-        """.format(car_table_name, map_biomas_table_name)
-        con.execute(sql)
-
-        info('Dissolving...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE CAR AS 
-        SELECT
-            c.cod_imovel,
-            ST_Union_Agg(c.geom) AS geom
-        FROM
-            CAR c
-        GROUP BY
-            c.cod_imovel;
-        """
-        con.execute(sql)
+                       cols: list = None, bbox: tuple = None) -> None:
+        # Cached inputs are GeoParquet
+        if Path(file_path).suffix.lower() == '.parquet':
+            self._create_tables_parquet(con, file_path, table_name, cols,
+                                        bbox)
+            return
 
-        info('Transforming to UTM...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE CAR AS 
-        SELECT 
-            * EXCLUDE geom,
-            ST_Transform(geom, 'EPSG:4326', 'EPSG:31982', true) AS geom,
-        FROM
-            CAR;
-        """
-        con.execute(sql)
-
-        info('Calculating area...')
+        cols_str = ', '.join(cols) if cols else '*'
+        # The spatial filter is applied by GDAL
+        spatial_filter = ''
+        if bbox is not None:
+            spatial_filter = """,
+            spatial_filter_box := ST_MakeBox2D(ST_Point({0}, {1}),
+                                               ST_Point({2}, {3}))
+            """.format(*bbox)
         sql = """
-        CREATE OR REPLACE TEMPORARY TABLE RESULTS AS
+        CREATE OR REPLACE {3} TABLE {0} AS
         SELECT
-            cod_imovel,
-            ST_Area(geom) / 10000 AS area_ha,
-            geom
-        FROM
-            CAR;
-        """
-        con.execute(sql)
-
-        info('Saving results...')
-        file_results = Path(path_results, 'results_duckdb.gpkg').__str__()
-        sql = """
-        COPY RESULTS TO '{0}'
-        WITH (FORMAT GDAL, DRIVER 'GPKG', LAYER_NAME 'resultados_duckdb', SRS 'EPSG:31982')
-        """.format(file_results)
-        con.execute(sql)
-
-        finished = time.perf_counter()
-        total_time = timedelta(seconds=finished - start)
-        total_time_format = (datetime.min + total_time).time().strftime(
-            "%H:%M:%S.%f")[:-3]
-
-        con.close()
-        info(f'Finished in {total_time_format}')
+            {1}
+        FROM ST_Read('{2}'{4})
+        """.format(table_name, cols_str, file_path, self.temporary,
+                   spatial_filter)
+        con.execute(sql.format(table_name))
 
 
 def main():
@@ -141,6 +52,68 @@ def main():
         '-r', type=str, required=True, dest='r',
         help='Path to save the results'
     )
+    parser.add_argument(
+        '-format', type=str, default='gpkg', dest='format',
+        choices=list(FORMATS),
+        help='Format of the results (default: gpkg)'
+    )
+    parser.add_argument(
+        '-crs', type=str, default='EPSG:4674', dest='crs',
+        help='CRS of the inputs, used to reproject the results to UTM '
+             '(default: EPSG:4674)'
+    )
+    parser.add_argument(
+        '-threads', type=int, default=None, dest='threads',
+        help='Number of threads of DuckDB (default: number of cores)'
+    )
+    parser.add_argument(
+        '-memory_limit', type=str, default=None, dest='memory_limit',
+        help='Memory limit of DuckDB, Ex.: 2GB (default: 60%% of the RAM)'
+    )
+    parser.add_argument(
+        '-temp_dir', type=str, default=None, dest='temp_dir',
+        help='Folder to spill the data that does not fit in memory '
+             '(default: a new folder in the results path, removed at the '
+             'end)'
+    )
+    parser.add_argument(
+        '-db', type=str, default=None, dest='db',
+        help='File path of an on-disk database (default: in memory)'
+    )
+    parser.add_argument(
+        '-cache', action='store_true', dest='cache',
+        help='Read the inputs from the GeoParquet cache, creating it on the '
+             'first run'
+    )
+    parser.add_argument(
+        '-prefilter', action='store_true', dest='prefilter',
+        help='Load only the CAR features near the alerts (boxes of '
+             'prefilter.py)'
+    )
+    parser.add_argument(
+        '-grid', type=float, default=None, dest='grid',
+        help='Grid size to snap the vertices in the intersection and union, '
+             'in units of the CRS of the inputs (Ex.: 1e-7 degrees, about '
+             '1 cm). Default: full precision'
+    )
+    parser.add_argument(
+        '-subdivide', type=int, default=None, dest='subdivide',
+        help='Subdivide the geometries with more vertices than this before '
+             'the intersection (Ex.: 256). Default: no subdivision'
+    )
+    parser.add_argument(
+        '-prepared', action='store_true', dest='prepared',
+        help='Skip the intersection of the pairs where one geometry covers '
+             'the other'
+    )
+    parser.add_argument(
+        '-debug', action='store_true', dest='debug',
+        help='Save each step in a temporary table, to measure the stages'
+    )
+    parser.add_argument(
+        '-explain', action='store_true', dest='explain',
+        help='Print the plans (EXPLAIN ANALYZE) of the statements'
+    )
 
     args = parser.parse_args()
 
@@ -158,7 +131,12 @@ def main():
         print(f'Path {path_results} not found.')
         return
 
-    etl = ETL()
+    etl = ETL(fmt=args.format, explain=args.explain, debug=args.debug,
+              threads=args.threads, memory_limit=args.memory_limit,
+              temp_directory=args.temp_dir, database=args.db,
+              cache=args.cache, source_crs=args.crs,
+              prefilter=args.prefilter, grid_size=args.grid,
+              max_vertices=args.subdivide, prepared=args.prepared)
     etl.run(car_file_path=car, mp=mp, path_results=path_results)
 
 
@@ -1,142 +1,32 @@
 import argparse
-import duckdb as dkb
 from duckdb import DuckDBPyConnection
 from pathlib import Path
-import time
-from utils import info, info_finished
+from duckdb_etl import DuckDBETL
+from writers import COMPRESSIONS, FORMATS, ROW_GROUP_SIZE
 
 
-class ETL:
+class ETL(DuckDBETL):
+    geom = 'geometry'
+    results_name = 'results_duckdb_02'
+    layer_name = 'resultados_duckdb_02'
 
-    @staticmethod
-    def _create_db_memory() -> DuckDBPyConnection:
-        con = dkb.connect()
-        con.install_extension("spatial")
-        con.load_extension("spatial")
-
-        return con
-
-    @staticmethod
-    def _create_tables(con: DuckDBPyConnection = None,
+    def _create_tables(self, con: DuckDBPyConnection = None,
                        file_path: str = '',
                        table_name: str = '',
-                       cols: list = None) -> None:
+                       cols: list = None, bbox: tuple = None) -> None:
         """Create tables
 
+        The WKB is decoded to GEOMETRY in the scan, reading only the
+        columns in cols.
+
         Args:
             con: DuckDBPyConnection
             file_path: File path with extension
             table_name: Table name
             cols: List of columns
+            bbox: Load only the features whose bounding box intersects it
         """
-        cols_str = ', '.join(cols) if cols else '*'
-        sql = """
-        CREATE TEMPORARY TABLE IF NOT EXISTS {0} AS 
-        SELECT 
-            {1} 
-        FROM read_parquet('{2}')
-        """.format(table_name, cols_str, file_path)
-        con.execute(sql.format(table_name))
-
-        # We need convert the geometry blob column to GEOMETRY type,
-        # because Duckdb doesn't support Geoparquet yet
-        sql = """
-        ALTER TABLE {0} ALTER geometry TYPE GEOMETRY USING ST_GeomFromWKB(
-        geometry);
-        """.format(table_name)
-        con.execute(sql)
-
-    def run(self, car_file_path: str = '', mp: str = '',
-            path_results: str = ''):
-        start = time.perf_counter()
-
-        con = self._create_db_memory()
-
-        car_table_name = 'CAR'
-        cols_car = ['cod_imovel', 'des_condic', 'geometry']
-        map_biomas_table_name = 'MP'
-        cols_mp = ['geometry']
-
-        info('Loading layers...')
-        self._create_tables(con=con, file_path=car_file_path,
-                            table_name=car_table_name,
-                            cols=cols_car)
-        self._create_tables(con=con, file_path=mp,
-                            table_name=map_biomas_table_name,
-                            cols=cols_mp)
-
-        info('Filtering CAR only contains "Analise"...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE CAR AS 
-        SELECT 
-            c.cod_imovel, c.geometry FROM {0} c 
-        WHERE 
-            c.des_condic LIKE '%analise%';
-        """.format(car_table_name)
-        con.execute(sql)
-
-        info('Intersection layers...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE CAR AS 
-        SELECT
-            c.cod_imovel,
-            ST_Intersection(c.geometry, m.geometry) AS geometry
-        FROM
-            {0} c
-        JOIN {1} m ON ST_Intersects(c.geometry, m.geometry);
-        """.format(car_table_name, map_biomas_table_name)
-        con.execute(sql)
-
-        info('Dissolving...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE CAR AS 
-        SELECT
-            c.cod_imovel,
-            ST_Union_Agg(c.geometry) AS geometry
-        FROM
-            CAR c
-        GROUP BY
-            c.cod_imovel;
-        """
-        con.execute(sql)
-
-        info('Transforming to UTM...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE CAR AS 
-        SELECT 
-            * EXCLUDE geometry,
-            ST_Transform(geometry, 'EPSG:4326', 'EPSG:31982', true) AS geometry,
-        FROM
-            CAR;
-        """
-        con.execute(sql)
-
-        info('Calculating area...')
-        sql = """
-        CREATE OR REPLACE TEMPORARY TABLE RESULTS AS
-        SELECT
-            cod_imovel,
-            ST_Area(geometry) / 10000 AS area_ha,
-            geometry
-        FROM
-            CAR;
-        """
-        con.execute(sql)
-
-        info('Saving results...')
-        file_results = Path(path_results, 'results_duckdb_02.parquet').__str__()
-        # sql = """
-        # COPY RESULTS TO '{0}'
-        # WITH (FORMAT GDAL, DRIVER 'GPKG', LAYER_NAME 'resultados_duckdb_02',
-        # SRS 'EPSG:31982')
-        # """.format(file_results)
-
-        sql = """
-        COPY RESULTS TO '{0}' (FORMAT PARQUET)
-        """.format(file_results)
-        con.execute(sql)
-
-        info_finished(start_time=start)
+        self._create_tables_parquet(con, file_path, table_name, cols, bbox)
 
 
 def main():
@@ -155,6 +45,79 @@ def main():
         '-r', type=str, required=True, dest='r',
         help='Path to save the results'
     )
+    parser.add_argument(
+        '-crs', type=str, default='EPSG:4674', dest='crs',
+        help='CRS of the inputs, used to reproject the results to UTM '
+             '(default: EPSG:4674)'
+    )
+    parser.add_argument(
+        '-threads', type=int, default=None, dest='threads',
+        help='Number of threads of DuckDB (default: number of cores)'
+    )
+    parser.add_argument(
+        '-memory_limit', type=str, default=None, dest='memory_limit',
+        help='Memory limit of DuckDB, Ex.: 2GB (default: 60%% of the RAM)'
+    )
+    parser.add_argument(
+        '-temp_dir', type=str, default=None, dest='temp_dir',
+        help='Folder to spill the data that does not fit in memory '
+             '(default: a new folder in the results path, removed at the '
+             'end)'
+    )
+    parser.add_argument(
+        '-db', type=str, default=None, dest='db',
+        help='File path of an on-disk database (default: in memory)'
+    )
+    parser.add_argument(
+        '-format', type=str, default='parquet', dest='format',
+        choices=list(FORMATS),
+        help='Format of the results (default: parquet)'
+    )
+    parser.add_argument(
+        '-compression', type=str, default='zstd', dest='compression',
+        choices=COMPRESSIONS,
+        help='Compression of the GeoParquet output (default: zstd)'
+    )
+    parser.add_argument(
+        '-row_group_size', type=int, default=ROW_GROUP_SIZE,
+        dest='row_group_size',
+        help=f'Number of rows of each row group of the output '
+             f'(default: {ROW_GROUP_SIZE})'
+    )
+    parser.add_argument(
+        '-cache', action='store_true', dest='cache',
+        help='Read the inputs from the GeoParquet cache, creating it on the '
+             'first run'
+    )
+    parser.add_argument(
+        '-prefilter', action='store_true', dest='prefilter',
+        help='Load only the CAR features near the alerts (boxes of '
+             'prefilter.py)'
+    )
+    parser.add_argument(
+        '-grid', type=float, default=None, dest='grid',
+        help='Grid size to snap the vertices in the intersection and union, '
+             'in units of the CRS of the inputs (Ex.: 1e-7 degrees, about '
+             '1 cm). Default: full precision'
+    )
+    parser.add_argument(
+        '-subdivide', type=int, default=None, dest='subdivide',
+        help='Subdivide the geometries with more vertices than this before '
+             'the intersection (Ex.: 256). Default: no subdivision'
+    )
+    parser.add_argument(
+        '-prepared', action='store_true', dest='prepared',
+        help='Skip the intersection of the pairs where one geometry covers '
+             'the other'
+    )
+    parser.add_argument(
+        '-debug', action='store_true', dest='debug',
+        help='Save each step in a temporary table, to measure the stages'
+    )
+    parser.add_argument(
+        '-explain', action='store_true', dest='explain',
+        help='Print the plans (EXPLAIN ANALYZE) of the statements'
+    )
 
     args = parser.parse_args()
 
@@ -172,7 +135,13 @@ def main():
         print(f'Path {path_results} not found.')
         return
 
-    etl = ETL()
+    etl = ETL(fmt=args.format, compression=args.compression,
+              row_group_size=args.row_group_size, explain=args.explain,
+              debug=args.debug, threads=args.threads,
+              memory_limit=args.memory_limit, temp_directory=args.temp_dir,
+              database=args.db, cache=args.cache, source_crs=args.crs,
+              prefilter=args.prefilter, grid_size=args.grid,
+              max_vertices=args.subdivide, prepared=args.prepared)
     etl.run(car_file_path=car, mp=mp, path_results=path_results)
 
 
@@ -1,61 +1,72 @@
 import argparse
-import geopandas as gpd
 from pathlib import Path
 import time
-from utils import info, info_finished
+from cache import cache_inputs
+from loaders import read_layer
+from overlay import dissolve, intersection, merge_cuts
+from prefilter import mask_boxes
+from reproject import utm_area
+from utils import info_finished, stage
+from writers import FORMATS, results_path, write_layer
 
 
 def run(car_file_path: str = '', mp_file_path: str = '',
-        path_results: str = ''):
+        path_results: str = '', cache: bool = False, fmt: str = 'gpkg',
+        crs: str = None, prefilter: bool = False, grid_size: float = None,
+        max_vertices: int = None, prepared: bool = False):
     start = time.perf_counter()
 
-    info('Loading layers...')
-    cols_car = ['cod_imovel', 'des_condic', 'geometry']
-    cols_mp = ['geometry']
-
-    check_extension = Path(car_file_path).suffix.lower()
-    if check_extension == '.shp':
-        gdf_car = gpd.read_file(car_file_path, columns=cols_car)
-        gdf_mp = gpd.read_file(mp_file_path, columns=cols_mp)
-
-    elif check_extension == '.parquet':
-        gdf_car = gpd.read_parquet(car_file_path, columns=cols_car)
-        gdf_mp = gpd.read_parquet(mp_file_path, columns=cols_mp)
-
-        gdf_car.set_crs(epsg=4674, inplace=True, allow_override=True)
-        gdf_mp.set_crs(epsg=4674, inplace=True, allow_override=True)
-
-    # I hoped this worked more fast if I used the where clause to read only
-    # the rows of the interest, but not
-    # where_clause = "des_condic like '%analise%'"
-    # gdf_car = gpd.read_file(car_file_path, columns=cols_car, where=where_clause)
-
-    info('Filtering CAR only contains "Analise"...')
-    # Select CAR only contanis the world 'analise'
-    gdf_car = gdf_car[gdf_car['des_condic'].str.contains('analise')]
-
-    info('Intersection layers...')
-    # gdf_intersect = gpd.sjoin(gdf_mp, gdf_car, how='inner',
-    #                           predicate='intersects')
-
-    # TODO: The methods below has the same time for execution
-    gdf_intersect = gpd.overlay(gdf_car, gdf_mp, how='intersection')
-    # gdf_intersect = gdf_car.overlay(gdf_mp, how='intersection')
-
-    info('Dissolving...')
-    gdf_dissolve = gdf_intersect.dissolve(by='cod_imovel')
+    if cache:
+        car_file_path, mp_file_path = cache_inputs(car_file_path,
+                                                   mp_file_path)
+
+    with stage('Loading layers') as st:
+        gdf_mp = read_layer(mp_file_path)
+        # With the prefilter, only the CAR features near the alerts are read
+        boxes = mask_boxes(gdf_mp.bounds.to_numpy()) if prefilter else None
+        # The filter is applied to the Arrow batches while reading, so only
+        # the geometries of the CAR with 'analise' are decoded
+        gdf_car = read_layer(car_file_path, columns=['cod_imovel'],
+                             contains={'des_condic': 'analise'}, boxes=boxes)
+
+        if Path(car_file_path).suffix.lower() == '.parquet':
+            gdf_car.set_crs(epsg=4674, inplace=True, allow_override=True)
+            gdf_mp.set_crs(epsg=4674, inplace=True, allow_override=True)
+        st.count(gdf_car.geometry)
+
+    with stage('Intersection layers') as st:
+        # gpd.overlay and gdf_car.overlay have the same time for execution,
+        # both intersect the whole layers. This computes the intersection
+        # only for the candidate pairs of a STRtree query
+        # With max_vertices, the pieces of each property are reassembled
+        # by the dissolve
+        gdf_intersect = intersection(gdf_car, gdf_mp, grid_size,
+                                     max_vertices, prepared)
+        st.count(gdf_intersect.geometry)
+
+    with stage('Dissolving') as st:
+        if grid_size or max_vertices:
+            # The dissolve of GeoPandas has no fixed precision, and it is
+            # slower with the many pieces of the subdivision
+            gdf_dissolve = dissolve(gdf_intersect, by='cod_imovel',
+                                    grid_size=grid_size)
+        else:
+            gdf_dissolve = gdf_intersect.dissolve(by='cod_imovel')
+        if max_vertices:
+            gdf_dissolve.geometry = merge_cuts(
+                gdf_dissolve.geometry.values, gdf_intersect.attrs['cuts'],
+                grid_size=grid_size)
+        st.count(gdf_dissolve.geometry)
 
     del gdf_car, gdf_mp, gdf_intersect
 
-    info('Transforming to UTM and calculating area...')
-    gdf_dissolve = gdf_dissolve.to_crs(epsg=31982).reset_index()
-    gdf_dissolve['area_ha'] = gdf_dissolve.area / 10000
-    gdf_dissolve = gdf_dissolve[['cod_imovel', 'area_ha', 'geometry']]
+    with stage('Transforming to UTM and calculating area') as st:
+        gdf_dissolve = utm_area(gdf_dissolve, src=crs)
+        st.features = len(gdf_dissolve)
 
-    info('Saving results...')
-    file_results = Path(path_results, 'results_geopandas.gpkg').__str__()
-    gdf_dissolve.to_file(file_results, driver='GPKG',
-                         layer='res_geopandas')
+    with stage('Saving results'):
+        file_results = results_path(path_results, 'results_geopandas', fmt)
+        write_layer(gdf_dissolve, file_results, layer='res_geopandas')
 
     info_finished(start_time=start)
 
@@ -76,6 +87,42 @@ def main():
         '-r', type=str, required=True, dest='r',
         help='Path to save the results'
     )
+    parser.add_argument(
+        '-format', type=str, default='gpkg', dest='format',
+        choices=list(FORMATS),
+        help='Format of the results (default: gpkg)'
+    )
+    parser.add_argument(
+        '-crs', type=str, default=None, dest='crs',
+        help='CRS of the inputs, used to reproject the results to UTM '
+             '(default: CRS of the layer, or EPSG:4674)'
+    )
+    parser.add_argument(
+        '-cache', action='store_true', dest='cache',
+        help='Read the inputs from the GeoParquet cache, creating it on the '
+             'first run'
+    )
+    parser.add_argument(
+        '-prefilter', action='store_true', dest='prefilter',
+        help='Read MapBiomas first and load only the CAR features near the '
+             'alerts'
+    )
+    parser.add_argument(
+        '-grid', type=float, default=None, dest='grid',
+        help='Grid size to snap the vertices in the intersection and union, '
+             'in units of the CRS of the inputs (Ex.: 1e-7 degrees, about '
+             '1 cm). Default: full precision'
+    )
+    parser.add_argument(
+        '-subdivide', type=int, default=None, dest='subdivide',
+        help='Subdivide the geometries with more vertices than this before '
+             'the intersection (Ex.: 256). Default: no subdivision'
+    )
+    parser.add_argument(
+        '-prepared', action='store_true', dest='prepared',
+        help='Test the candidate pairs with prepared geometries and skip '
+             'the intersection of the properties covered by an alert'
+    )
 
     args = parser.parse_args()
 
@@ -93,7 +140,10 @@ def main():
         print(f'Path {path_results} not found.')
         return
 
-    run(car_file_path=car, mp_file_path=mp, path_results=path_results)
+    run(car_file_path=car, mp_file_path=mp, path_results=path_results,
+        cache=args.cache, fmt=args.format, crs=args.crs,
+        prefilter=args.prefilter, grid_size=args.grid,
+        max_vertices=args.subdivide, prepared=args.prepared)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,279 @@
+"""
+Script to process only the new or changed alerts of MapBiomas Alerta
+
+The state of the previous run is kept in a folder: a manifest with the ID and
+hash of the processed alerts, the intersection pieces of each pair (CAR,
+alert) and the results. In the next runs only the new or changed alerts are
+intersected with CAR, and only the properties (cod_imovel) touched by the new,
+changed or removed alerts are dissolved again.
+
+The CAR layer is identified by the path, size and modification time of its
+files (see `cache.cache_key`), including the .dbf of a Shapefile, and any
+change in it, even only of the attributes (Ex.: des_condic), rebuilds the
+whole state.
+"""
+
+import argparse
+import json
+from pathlib import Path
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from cache import cache_key
+from loaders import read_layer
+from overlay import dissolve, intersection
+from prefilter import mask_boxes
+from reproject import utm_area
+from utils import info, info_finished, stage
+from writers import FORMATS, results_path, write_layer
+
+STATE_FILE = 'state.json'
+MANIFEST_FILE = 'manifest.parquet'
+PIECES_FILE = 'pieces.parquet'
+RESULTS_FILE = 'results.parquet'
+
+
+def alert_hashes(gdf: gpd.GeoDataFrame = None) -> np.ndarray:
+    """Hash of the geometry (WKB) of each alert"""
+    return pd.util.hash_array(gdf.geometry.to_wkb().to_numpy())
+
+
+def load_state(path_state: str = '', car_key: str = '') -> tuple:
+    """Manifest, pieces and results of the previous run
+
+    Returns:
+        Tuple (manifest, pieces, results), all None when there is no state
+        or the CAR layer changed
+    """
+    file_state = Path(path_state, STATE_FILE)
+    if not file_state.exists():
+        return None, None, None
+
+    state = json.loads(file_state.read_text())
+    if state.get('car') != car_key:
+        info('CAR changed, rebuilding the state')
+        return None, None, None
+
+    manifest = pd.read_parquet(Path(path_state, MANIFEST_FILE))
+    pieces = gpd.read_parquet(Path(path_state, PIECES_FILE))
+    results = gpd.read_parquet(Path(path_state, RESULTS_FILE))
+
+    return manifest, pieces, results
+
+
+def save_state(path_state: str = '', car_key: str = '',
+               manifest: pd.DataFrame = None,
+               pieces: gpd.GeoDataFrame = None,
+               results: gpd.GeoDataFrame = None) -> None:
+    """Save the state of this run
+
+    The state file is written last, so an interrupted run is detected by
+    the next one as an invalid state.
+    """
+    Path(path_state).mkdir(parents=True, exist_ok=True)
+    Path(path_state, STATE_FILE).unlink(missing_ok=True)
+
+    manifest.to_parquet(Path(path_state, MANIFEST_FILE), index=False)
+    pieces.to_parquet(Path(path_state, PIECES_FILE), index=False)
+    results.to_parquet(Path(path_state, RESULTS_FILE), index=False)
+
+    Path(path_state, STATE_FILE).write_text(json.dumps({'car': car_key}))
+
+
+def diff_alerts(manifest: pd.DataFrame = None, ids: np.ndarray = None,
+                hashes: np.ndarray = None, id_col: str = 'cod_alerta'
+                ) -> tuple:
+    """Alerts new or changed since the manifest, and alerts removed
+
+    The alerts are matched by the pair (ID, hash), so duplicated IDs are
+    supported: the pieces are stored by ID, so when one alert of an ID
+    changes, all the alerts of the ID are processed again.
+
+    Returns:
+        Tuple with the mask of the current alerts to process and the IDs of
+        the alerts whose pieces must be removed (changed or removed)
+    """
+    if manifest is None:
+        return np.ones(len(ids), dtype=bool), np.array([])
+
+    # The hashes are compared as uint64, without a cast to float
+    current = pd.MultiIndex.from_arrays(
+        [ids, np.asarray(hashes, dtype=np.uint64)])
+    previous = pd.MultiIndex.from_arrays(
+        [manifest[id_col].to_numpy(),
+         manifest['hash'].to_numpy(dtype=np.uint64)])
+
+    dropped = pd.unique(
+        previous[~previous.isin(current)].get_level_values(0).to_numpy())
+    todo = ~current.isin(previous) | np.isin(ids, dropped)
+
+    return todo, dropped
+
+
+def run(car_file_path: str = '', mp_file_path: str = '',
+        path_results: str = '', path_state: str = '',
+        id_col: str = 'cod_alerta', full: bool = False,
+        fmt: str = 'gpkg', crs: str = None):
+    """Process the layers
+
+    Args:
+        car_file_path: File path of CAR
+        mp_file_path: File path of MapBiomas Alerta
+        path_results: Path to save the results
+        path_state: Folder of the state of the runs. Default: folder
+            incremental_state in the results path
+        id_col: Column with the ID of the alerts
+        full: Ignore the previous state and process all the alerts
+        fmt: Format of the results (one of writers.FORMATS)
+        crs: CRS of the inputs, used to reproject the results. Default:
+            CRS of the layer, or EPSG:4674
+    """
+    start = time.perf_counter()
+
+    path_state = path_state or Path(path_results,
+                                    'incremental_state').__str__()
+    car_key = cache_key(car_file_path, ['cod_imovel', 'des_condic'])
+
+    with stage('Loading state') as st:
+        manifest, pieces, results = (None, None, None) if full else \
+            load_state(path_state, car_key)
+        if results is not None:
+            st.features = len(results)
+
+    with stage('Finding new and changed alerts') as st:
+        gdf_mp = read_layer(mp_file_path, columns=[id_col])
+        if Path(mp_file_path).suffix.lower() == '.parquet':
+            gdf_mp.set_crs(epsg=4674, inplace=True, allow_override=True)
+        ids = gdf_mp[id_col].to_numpy()
+        hashes = alert_hashes(gdf_mp)
+
+        todo, dropped = diff_alerts(manifest, ids, hashes, id_col)
+        gdf_mp = gdf_mp[todo]
+        info(f'{len(gdf_mp)} new or changed alerts, {len(dropped)} changed '
+             f'or removed')
+        st.count(gdf_mp.geometry)
+
+    touched = np.array([], dtype=object)
+    if pieces is not None and len(dropped):
+        is_dropped = pieces[id_col].isin(dropped).to_numpy()
+        touched = pieces.loc[is_dropped, 'cod_imovel'].to_numpy()
+        pieces = pieces[~is_dropped]
+
+    with stage('Intersection layers') as st:
+        if len(gdf_mp):
+            # Only the CAR features near the alerts to process are read
+            boxes = mask_boxes(gdf_mp.bounds.to_numpy())
+            gdf_car = read_layer(car_file_path, columns=['cod_imovel'],
+                                 contains={'des_condic': 'analise'},
+                                 boxes=boxes)
+            if Path(car_file_path).suffix.lower() == '.parquet':
+                gdf_car.set_crs(epsg=4674, inplace=True,
+                                allow_override=True)
+            new_pieces = intersection(gdf_car, gdf_mp)[
+                ['cod_imovel', id_col, 'geometry']]
+            del gdf_car
+        else:
+            new_pieces = gpd.GeoDataFrame(
+                {'cod_imovel': [], id_col: []},
+                geometry=gpd.GeoSeries([], crs=gdf_mp.crs))
+        st.count(new_pieces.geometry)
+
+    touched = np.unique(np.concatenate(
+        [touched, new_pieces['cod_imovel'].to_numpy()]).astype(str))
+    pieces = new_pieces if pieces is None else \
+        pd.concat([pieces, new_pieces], ignore_index=True)
+
+    with stage('Dissolving touched properties') as st:
+        info(f'{len(touched)} properties touched')
+        gdf_touched = pieces[pieces['cod_imovel'].isin(touched)]
+        gdf_dissolve = dissolve(gdf_touched, by='cod_imovel')
+        st.count(gdf_dissolve.geometry)
+
+    with stage('Transforming to UTM and calculating area') as st:
+        gdf_dissolve = utm_area(gdf_dissolve, src=crs)
+
+        # The properties touched are replaced, including the ones whose
+        # alerts were all removed
+        if results is not None:
+            results = results[~results['cod_imovel'].isin(touched)]
+            gdf_dissolve = pd.concat([results, gdf_dissolve],
+                                     ignore_index=True)
+        st.features = len(gdf_dissolve)
+
+    with stage('Saving results'):
+        manifest = pd.DataFrame({id_col: ids, 'hash': hashes})
+        save_state(path_state, car_key, manifest, pieces, gdf_dissolve)
+
+        file_results = results_path(path_results, 'results_incremental',
+                                    fmt)
+        write_layer(gdf_dissolve, file_results, layer='res_incremental')
+
+    info_finished(start_time=start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-car', type=str, required=True, dest='car',
+        help='File path (Shapefile with extension .shp) from CAR'
+    )
+    parser.add_argument(
+        '-mp', type=str, required=True, dest='mp',
+        help='File path (Shapefile with extension .shp) from MapBiomas Alerta'
+    )
+
+    parser.add_argument(
+        '-r', type=str, required=True, dest='r',
+        help='Path to save the results'
+    )
+    parser.add_argument(
+        '-state', type=str, default='', dest='state',
+        help='Folder of the state of the runs (default: incremental_state '
+             'in the results path)'
+    )
+    parser.add_argument(
+        '-id', type=str, default='cod_alerta', dest='id',
+        help='Column with the ID of the alerts (default: cod_alerta)'
+    )
+    parser.add_argument(
+        '-format', type=str, default='gpkg', dest='format',
+        choices=list(FORMATS),
+        help='Format of the results (default: gpkg)'
+    )
+    parser.add_argument(
+        '-crs', type=str, default=None, dest='crs',
+        help='CRS of the inputs, used to reproject the results to UTM '
+             '(default: CRS of the layer, or EPSG:4674)'
+    )
+    parser.add_argument(
+        '-full', action='store_true', dest='full',
+        help='Ignore the previous state and process all the alerts'
+    )
+
+    args = parser.parse_args()
+
+    car: str = args.car
+    mp: str = args.mp
+    path_results: str = args.r
+
+    if not Path(car).exists():
+        print(f'File {car} not found.')
+        return
+    if not Path(mp).exists():
+        print(f'File {mp} not found.')
+        return
+    if not Path(path_results).exists():
+        print(f'Path {path_results} not found.')
+        return
+
+    run(car_file_path=car, mp_file_path=mp, path_results=path_results,
+        path_state=args.state, id_col=args.id, full=args.full,
+        fmt=args.format, crs=args.crs)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,7 @@ import time
 
 from qgis._core import QgsCoordinateReferenceSystem
 from qgis.core import (QgsApplication, QgsProcessing)
-from utils import info, info_finished
+from utils import info, info_finished, stage
 
 qgs = QgsApplication([], False)
 qgs.initQgis()
@@ -29,86 +29,86 @@ def run(car_file_path: str = '', mp_file_path: str = '',
     try:
         start = time.perf_counter()
 
-        info('Filtering CAR only contains "Analise"...')
-        alg_params = {
-            'EXPRESSION': '"des_condic" like \'%analise%\'',
-            'INPUT': car_file_path,
-            'OUTPUT': 'memory:'
-        }
-        filtered = processing.run('native:extractbyexpression',
-                                  alg_params,
-                                  is_child_algorithm=False)['OUTPUT']
-        info('Intersection layers...')
-        alg_params = {
-            'GRID_SIZE': None,
-            'INPUT': mp_file_path,
-            'INPUT_FIELDS': [''],
-            'OVERLAY': filtered,
-            'OVERLAY_FIELDS': [''],
-            'OVERLAY_FIELDS_PREFIX': '',
-            'OUTPUT': 'memory:'
-        }
-        intersection = processing.run('native:intersection', alg_params,
+        with stage('Filtering CAR only contains "Analise"'):
+            alg_params = {
+                'EXPRESSION': '"des_condic" like \'%analise%\'',
+                'INPUT': car_file_path,
+                'OUTPUT': 'memory:'
+            }
+            filtered = processing.run('native:extractbyexpression',
+                                      alg_params,
+                                      is_child_algorithm=False)['OUTPUT']
+        with stage('Intersection layers'):
+            alg_params = {
+                'GRID_SIZE': None,
+                'INPUT': mp_file_path,
+                'INPUT_FIELDS': [''],
+                'OVERLAY': filtered,
+                'OVERLAY_FIELDS': [''],
+                'OVERLAY_FIELDS_PREFIX': '',
+                'OUTPUT': 'memory:'
+            }
+            intersection = processing.run('native:intersection', alg_params,
+                                          is_child_algorithm=False)['OUTPUT']
+
+        with stage('Dissolving'):
+            alg_params = {
+                'FIELD': ['cod_imovel'],
+                'INPUT': intersection,
+                'SEPARATE_DISJOINT': False,
+                'OUTPUT': 'memory:'
+            }
+            dissolve = processing.run('native:dissolve', alg_params,
+                                      is_child_algorithm=False)['OUTPUT']
+
+        with stage('Retain fields'):
+            alg_params = {
+                'FIELDS': ['cod_imovel'],
+                'INPUT': dissolve,
+                'OUTPUT': 'memory:'
+            }
+            retained = processing.run('native:retainfields', alg_params,
                                       is_child_algorithm=False)['OUTPUT']
 
-        info('Dissolving...')
-        alg_params = {
-            'FIELD': ['cod_imovel'],
-            'INPUT': intersection,
-            'SEPARATE_DISJOINT': False,
-            'OUTPUT': 'memory:'
-        }
-        dissolve = processing.run('native:dissolve', alg_params,
-                                  is_child_algorithm=False)['OUTPUT']
-
-        info('Retain fields...')
-        alg_params = {
-            'FIELDS': ['cod_imovel'],
-            'INPUT': dissolve,
-            'OUTPUT': 'memory:'
-        }
-        retained = processing.run('native:retainfields', alg_params,
-                                  is_child_algorithm=False)['OUTPUT']
-
-        info('Transforming to UTM and calculating area...')
-        alg_params = {
-            'CONVERT_CURVED_GEOMETRIES': False,
-            'INPUT': retained,
-            'OPERATION': '',
-            'TARGET_CRS': QgsCoordinateReferenceSystem('EPSG:31982'),
-            'OUTPUT': 'memory:Reprojected'
-        }
-        reprojected = processing.run('native:reprojectlayer',
-                                     alg_params,
-                                     is_child_algorithm=False)['OUTPUT']
-
-        alg_params = {
-            'FIELD_LENGTH': 10,
-            'FIELD_NAME': 'area_ha',
-            'FIELD_PRECISION': 3,
-            'FIELD_TYPE': 0,  # Decimal (double)
-            'FORMULA': '$area/10000',
-            'INPUT': reprojected,
-            'OUTPUT': 'memory:'
-        }
-        calculated = processing.run(
-            'native:fieldcalculator',
-            alg_params,
-            is_child_algorithm=False)['OUTPUT']
-
-        info('Saving results...')
-        file_results_path = Path(path_results, 'results_pyqgis.gpkg').__str__()
-
-        alg_params = {
-            'ACTION_ON_EXISTING_FILE': 0,
-            'DATASOURCE_OPTIONS': '',
-            'INPUT': calculated,
-            'LAYER_NAME': 'results_pyqgis',
-            'LAYER_OPTIONS': '',
-            'OUTPUT': file_results_path,
-        }
-        processing.run('native:savefeatures', alg_params,
-                       is_child_algorithm=True)
+        with stage('Transforming to UTM and calculating area'):
+            alg_params = {
+                'CONVERT_CURVED_GEOMETRIES': False,
+                'INPUT': retained,
+                'OPERATION': '',
+                'TARGET_CRS': QgsCoordinateReferenceSystem('EPSG:31982'),
+                'OUTPUT': 'memory:Reprojected'
+            }
+            reprojected = processing.run('native:reprojectlayer',
+                                         alg_params,
+                                         is_child_algorithm=False)['OUTPUT']
+
+            alg_params = {
+                'FIELD_LENGTH': 10,
+                'FIELD_NAME': 'area_ha',
+                'FIELD_PRECISION': 3,
+                'FIELD_TYPE': 0,  # Decimal (double)
+                'FORMULA': '$area/10000',
+                'INPUT': reprojected,
+                'OUTPUT': 'memory:'
+            }
+            calculated = processing.run(
+                'native:fieldcalculator',
+                alg_params,
+                is_child_algorithm=False)['OUTPUT']
+
+        with stage('Saving results'):
+            file_results_path = Path(path_results, 'results_pyqgis.gpkg').__str__()
+
+            alg_params = {
+                'ACTION_ON_EXISTING_FILE': 0,
+                'DATASOURCE_OPTIONS': '',
+                'INPUT': calculated,
+                'LAYER_NAME': 'results_pyqgis',
+                'LAYER_OPTIONS': '',
+                'OUTPUT': file_results_path,
+            }
+            processing.run('native:savefeatures', alg_params,
+                           is_child_algorithm=True)
 
         qgs.exitQgis()
         info_finished(start_time=start)
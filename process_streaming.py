@@ -0,0 +1,270 @@
+"""
+Script to process CAR in batches with bounded memory using GeoPandas
+
+Only the alerts are kept in memory, with a STRtree index. CAR is read in
+batches of a fixed number of features, and each batch is intersected,
+dissolved and appended to the output layer before the next one is read, so
+the peak memory depends on the batch size and not on the size of the state.
+
+A property (cod_imovel) with features in more than one batch is found in a
+first pass over the cod_imovel column. Its partial dissolves are saved in a
+temporary folder and merged at the end.
+"""
+
+import argparse
+import os
+from pathlib import Path
+import tempfile
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import shapely
+
+from loaders import BATCH_SIZE, count_features, iter_arrow, read_layer, \
+    to_geodataframe
+from overlay import candidate_pairs, dissolve, intersection_pairs
+from prefilter import mask_boxes
+from reproject import SOURCE_CRS, utm_area
+from utils import info, info_finished, peak_rss, stage
+from writers import FORMATS, LayerWriter, results_path
+
+# Memory used by each feature of a batch (geometries, candidate pairs,
+# intersections and dissolve) as a multiple of the size of its WKB
+MEMORY_FACTOR = 20
+
+MIN_BATCH_SIZE = 1000
+
+
+def bytes_per_feature(file_path: str = '') -> float:
+    """Mean size of the geometry (WKB) of a feature of the layer"""
+    if Path(file_path).suffix.lower() == '.parquet':
+        metadata = pq.ParquetFile(file_path).metadata
+        size = sum(metadata.row_group(i).total_byte_size
+                   for i in range(metadata.num_row_groups))
+    else:
+        size = Path(file_path).stat().st_size
+
+    return size / max(count_features(file_path), 1)
+
+
+def batch_size_for_memory(file_path: str = '', max_mem: float = 0) -> int:
+    """Batch size that keeps the peak memory of the process under max_mem
+
+    Args:
+        file_path: File path of CAR
+        max_mem: Memory limit in MB. The memory already used by the process
+            (alerts and their index) is not available for the batches
+
+    Returns:
+        Number of features of each batch
+    """
+    available = (max_mem - (peak_rss() or 0)) * 1024 ** 2
+    batch_size = int(available /
+                     (bytes_per_feature(file_path) * MEMORY_FACTOR))
+    if batch_size < MIN_BATCH_SIZE:
+        info(f'The memory limit of {max_mem} MB is too low, using batches '
+             f'of {MIN_BATCH_SIZE} features')
+
+    return max(batch_size, MIN_BATCH_SIZE)
+
+
+def split_properties(car_file_path: str = '',
+                     batch_size: int = BATCH_SIZE,
+                     boxes: np.ndarray = None) -> np.ndarray:
+    """cod_imovel with features in more than one batch
+
+    Reads only the attributes, with the same batches (and boxes) of the
+    processing. The geometries are read only when the boxes filter needs
+    their bounds.
+    """
+    codes, batches = [], []
+    for i, (_, _, batch) in enumerate(iter_arrow(
+            car_file_path, columns=['cod_imovel'],
+            contains={'des_condic': 'analise'}, batch_size=batch_size,
+            boxes=boxes, read_geometry=False)):
+        codes.append(batch['cod_imovel'].to_numpy(zero_copy_only=False))
+        batches.append(np.full(batch.num_rows, i))
+
+    if not codes:
+        return np.array([], dtype=object)
+
+    df = pd.DataFrame({'cod_imovel': np.concatenate(codes),
+                       'batch': np.concatenate(batches)})
+    n_batches = df.groupby('cod_imovel')['batch'].nunique()
+
+    return n_batches.index[n_batches > 1].to_numpy()
+
+
+def run(car_file_path: str = '', mp_file_path: str = '',
+        path_results: str = '', batch_size: int = None,
+        max_mem: float = None, fmt: str = 'gpkg', crs: str = None,
+        prefilter: bool = False, grid_size: float = None):
+    """Process the layers
+
+    Args:
+        car_file_path: File path of CAR
+        mp_file_path: File path of MapBiomas Alerta
+        path_results: Path to save the results
+        batch_size: Number of CAR features of each batch. Default: from
+            max_mem, or BATCH_SIZE
+        max_mem: Memory limit of the process in MB, used to choose the
+            batch size
+        fmt: Format of the results (one of writers.FORMATS)
+        crs: CRS of the inputs, used to reproject the results. Default:
+            CRS of the layer, or EPSG:4674
+        prefilter: Read only the CAR features near the alerts
+        grid_size: Grid size to snap the vertices in the intersection and
+            union. Default: full precision
+    """
+    start = time.perf_counter()
+
+    file_results = results_path(path_results, 'results_streaming', fmt)
+    Path(file_results).unlink(missing_ok=True)
+
+    with stage('Loading MapBiomas and index') as st:
+        gdf_mp = read_layer(mp_file_path)
+        right = np.asarray(gdf_mp.geometry.array)
+        tree = shapely.STRtree(right)
+        boxes = mask_boxes(shapely.bounds(right)) if prefilter else None
+        st.count(right)
+
+    if not batch_size:
+        batch_size = batch_size_for_memory(car_file_path, max_mem) \
+            if max_mem else BATCH_SIZE
+    info(f'Batches of {batch_size} features')
+
+    with stage('Finding properties split across batches') as st:
+        split = split_properties(car_file_path, batch_size, boxes)
+        st.features = len(split)
+
+    writer = LayerWriter(file_results, layer='res_streaming',
+                         crs='EPSG:31982')
+    with writer, tempfile.TemporaryDirectory(dir=path_results) \
+            as path_pending:
+        with stage('Processing batches') as st:
+            for i, (car_crs, geom_col, batch) in enumerate(iter_arrow(
+                    car_file_path, columns=['cod_imovel'],
+                    contains={'des_condic': 'analise'},
+                    batch_size=batch_size, boxes=boxes)):
+                if not batch.num_rows:
+                    continue
+                # The CRS of the layer, unless given, and EPSG:4674 when
+                # the file has none
+                gdf_car = to_geodataframe(batch, geom_col,
+                                          crs or car_crs or SOURCE_CRS)
+
+                left = np.asarray(gdf_car.geometry.array)
+                idx_left, idx_right = candidate_pairs(left, right, tree)
+                geoms = intersection_pairs(left, right, idx_left, idx_right,
+                                           grid_size)
+                valid = ~shapely.is_missing(geoms)
+
+                gdf_intersect = gpd.GeoDataFrame(
+                    {'cod_imovel':
+                        gdf_car['cod_imovel'].to_numpy()[idx_left[valid]]},
+                    geometry=geoms[valid], crs=gdf_car.crs)
+                gdf_dissolve = dissolve(gdf_intersect, by='cod_imovel',
+                                        grid_size=grid_size)
+
+                is_split = gdf_dissolve.index.isin(split)
+                if is_split.any():
+                    gdf_dissolve[is_split].reset_index().to_parquet(
+                        Path(path_pending, f'{i}.parquet'))
+
+                writer.write(utm_area(gdf_dissolve[~is_split], src=crs))
+
+                del gdf_car, gdf_intersect, gdf_dissolve
+            st.features = writer.rows
+
+        with stage('Merging properties split across batches') as st:
+            parts = sorted(os.listdir(path_pending))
+            if parts:
+                gdf_pending = pd.concat(
+                    [gpd.read_parquet(Path(path_pending, f)) for f in parts],
+                    ignore_index=True)
+                gdf_merged = utm_area(dissolve(gdf_pending, by='cod_imovel',
+                                               grid_size=grid_size),
+                                      src=crs)
+                writer.write(gdf_merged)
+                st.features = len(gdf_merged)
+
+        with stage('Saving results'):
+            writer.close()
+
+    info(f'{writer.rows} properties saved in {file_results}')
+    info_finished(start_time=start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-car', type=str, required=True, dest='car',
+        help='File path (Shapefile with extension .shp) from CAR'
+    )
+    parser.add_argument(
+        '-mp', type=str, required=True, dest='mp',
+        help='File path (Shapefile with extension .shp) from MapBiomas Alerta'
+    )
+
+    parser.add_argument(
+        '-r', type=str, required=True, dest='r',
+        help='Path to save the results'
+    )
+    parser.add_argument(
+        '-format', type=str, default='gpkg', dest='format',
+        choices=list(FORMATS),
+        help='Format of the results (default: gpkg)'
+    )
+    parser.add_argument(
+        '-crs', type=str, default=None, dest='crs',
+        help='CRS of the inputs, used to reproject the results to UTM '
+             '(default: CRS of the layer, or EPSG:4674)'
+    )
+    parser.add_argument(
+        '-batch_size', type=int, default=None, dest='batch_size',
+        help=f'Number of CAR features of each batch (default: from -max_mem '
+             f'or {BATCH_SIZE})'
+    )
+    parser.add_argument(
+        '-max_mem', type=float, default=None, dest='max_mem',
+        help='Memory limit in MB, used to choose the batch size'
+    )
+    parser.add_argument(
+        '-prefilter', action='store_true', dest='prefilter',
+        help='Read only the CAR features near the alerts'
+    )
+    parser.add_argument(
+        '-grid', type=float, default=None, dest='grid',
+        help='Grid size to snap the vertices in the intersection and union, '
+             'in units of the CRS of the inputs (Ex.: 1e-7 degrees, about '
+             '1 cm). Default: full precision'
+    )
+
+    args = parser.parse_args()
+
+    car: str = args.car
+    mp: str = args.mp
+    path_results: str = args.r
+
+    if not Path(car).exists():
+        print(f'File {car} not found.')
+        return
+    if not Path(mp).exists():
+        print(f'File {mp} not found.')
+        return
+    if not Path(path_results).exists():
+        print(f'Path {path_results} not found.')
+        return
+
+    run(car_file_path=car, mp_file_path=mp, path_results=path_results,
+        batch_size=args.batch_size, max_mem=args.max_mem,
+        fmt=args.format, crs=args.crs,
+        prefilter=args.prefilter, grid_size=args.grid)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""
+Script to process the layers in tiles using a pool of processes
+
+The study area is divided into a grid of tiles and each tile is processed
+(filter, intersection and dissolve) by a worker that reads only the features
+of that tile, so the memory of each worker is bounded by the tile size. The
+properties that straddle the tile borders are dissolved again after merging
+the results of the tiles. With -balance, the tiles with most of the vertices
+of the alerts are split and the tiles are processed from the most to the
+least costly (see balance.py), so no tile is left running alone at the end.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+from pathlib import Path
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from balance import balance_tiles, feature_costs
+from cache import cache_inputs
+from loaders import layer_bounds, read_layer
+from overlay import candidate_pairs, dissolve, intersection_pairs
+from prefilter import alert_bounds, mask_boxes
+from reproject import utm_area
+from utils import info, info_finished, stage
+from writers import FORMATS, results_path, write_layer
+
+# Number of workers, one for each core
+n_workers = os.cpu_count() or 4
+
+
+def make_tiles(bounds: tuple = None, nx: int = 4, ny: int = 4) -> list:
+    """Grid of tiles (xmin, ymin, xmax, ymax) covering the bounds"""
+    xs = np.linspace(bounds[0], bounds[2], nx + 1)
+    ys = np.linspace(bounds[1], bounds[3], ny + 1)
+
+    return [(xs[i], ys[j], xs[i + 1], ys[j + 1])
+            for j in range(ny) for i in range(nx)]
+
+
+def _in_tile(points: np.ndarray = None, tile: tuple = None,
+             bounds: tuple = None) -> np.ndarray:
+    """Points inside the tile
+
+    The tiles are half-open intervals, except at the border of the study
+    area, so each point belongs to exactly one tile.
+    """
+    x, y = shapely.get_x(points), shapely.get_y(points)
+    in_x = (x >= tile[0]) & ((x < tile[2]) | (tile[2] >= bounds[2]))
+    in_y = (y >= tile[1]) & ((y < tile[3]) | (tile[3] >= bounds[3]))
+
+    return in_x & in_y
+
+
+def _tile_boxes(boxes: np.ndarray = None, tile: tuple = None) -> np.ndarray:
+    """Boxes that intersect the tile"""
+    return boxes[(boxes[:, 0] <= tile[2]) & (boxes[:, 2] >= tile[0]) &
+                 (boxes[:, 1] <= tile[3]) & (boxes[:, 3] >= tile[1])]
+
+
+def process_tile(car_file_path: str = '', mp_file_path: str = '',
+                 tile: tuple = None, bounds: tuple = None,
+                 boxes: np.ndarray = None,
+                 grid_size: float = None) -> gpd.GeoDataFrame:
+    """Intersect and dissolve the features of one tile
+
+    A pair (CAR, alert) can be read by many tiles. Its intersection is kept
+    only by the tile that contains a point of it, so each piece is returned
+    by exactly one tile.
+
+    Returns:
+        GeoDataFrame indexed by cod_imovel
+    """
+    gdf_car = read_layer(car_file_path, columns=['cod_imovel'],
+                         contains={'des_condic': 'analise'}, bbox=tile,
+                         boxes=boxes)
+    gdf_mp = read_layer(mp_file_path, bbox=tile)
+    if Path(car_file_path).suffix.lower() == '.parquet':
+        gdf_car.set_crs(epsg=4674, inplace=True, allow_override=True)
+
+    left = np.asarray(gdf_car.geometry.array)
+    right = np.asarray(gdf_mp.geometry.array)
+    idx_left, idx_right = candidate_pairs(left, right)
+
+    geoms = intersection_pairs(left, right, idx_left, idx_right,
+                               grid_size)
+    valid = ~shapely.is_missing(geoms)
+    valid[valid] = _in_tile(shapely.point_on_surface(geoms[valid]), tile,
+                            bounds)
+
+    gdf_intersect = gpd.GeoDataFrame(
+        {'cod_imovel': gdf_car['cod_imovel'].to_numpy()[idx_left[valid]]},
+        geometry=geoms[valid], crs=gdf_car.crs)
+
+    return dissolve(gdf_intersect, by='cod_imovel', grid_size=grid_size)
+
+
+def run(car_file_path: str = '', mp_file_path: str = '',
+        path_results: str = '', tiles: tuple = None,
+        workers: int = n_workers, cache: bool = False,
+        fmt: str = 'gpkg', crs: str = None, prefilter: bool = False,
+        grid_size: float = None, balance: bool = False):
+    """Process the layers
+
+    Args:
+        car_file_path: File path of CAR
+        mp_file_path: File path of MapBiomas Alerta
+        path_results: Path to save the results
+        tiles: Number of tiles (nx, ny). Default: about 4 tiles per worker
+        workers: Number of processes
+        cache: Read the inputs from the GeoParquet cache
+        fmt: Format of the results (one of writers.FORMATS)
+        crs: CRS of the inputs, used to reproject the results. Default:
+            CRS of the layer, or EPSG:4674
+        prefilter: Read the bounds of the alerts first, skip the tiles
+            without alerts and load only the CAR features near them
+        grid_size: Grid size to snap the vertices in the intersection and
+            union. Default: full precision
+        balance: Split the tiles with most of the vertices of the alerts
+            and process the tiles from the most to the least costly
+    """
+    start = time.perf_counter()
+
+    if cache:
+        car_file_path, mp_file_path = cache_inputs(car_file_path,
+                                                   mp_file_path)
+
+    bounds = layer_bounds(car_file_path)
+    if not tiles:
+        n = math.ceil(math.sqrt(4 * workers))
+        tiles = (n, n)
+    grid = make_tiles(bounds, *tiles)
+
+    alerts = None
+    if balance:
+        with stage('Estimating the cost of the tiles') as st:
+            # The CAR features are spread over the state, so the cost of a
+            # tile is estimated only from the vertices of its alerts
+            alerts, centers, vertices = feature_costs(mp_file_path)
+            grid = balance_tiles(grid, centers, vertices, workers)
+            st.features = len(grid)
+
+    grid_boxes = [None] * len(grid)
+    if prefilter:
+        with stage('Summarizing alerts') as st:
+            boxes = mask_boxes(alerts if alerts is not None
+                               else alert_bounds(mp_file_path))
+            grid_boxes = [_tile_boxes(boxes, tile) for tile in grid]
+            st.features = len(boxes)
+        # The tiles without alerts are skipped
+        if any(len(b) for b in grid_boxes):
+            grid, grid_boxes = zip(*[(t, b) for t, b in zip(grid, grid_boxes)
+                                     if len(b)])
+
+    with stage('Processing tiles') as st:
+        info(f'{len(grid)} tiles, {workers} workers')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                process_tile, [car_file_path] * len(grid),
+                [mp_file_path] * len(grid), grid, [bounds] * len(grid),
+                grid_boxes, [grid_size] * len(grid)))
+        gdf_tiles = pd.concat(results)
+        st.count(gdf_tiles.geometry)
+
+    with stage('Dissolving properties across tiles') as st:
+        gdf_dissolve = dissolve(gdf_tiles.reset_index(), by='cod_imovel',
+                                grid_size=grid_size)
+        st.count(gdf_dissolve.geometry)
+
+    del results, gdf_tiles
+
+    with stage('Transforming to UTM and calculating area') as st:
+        gdf_dissolve = utm_area(gdf_dissolve, src=crs)
+        st.features = len(gdf_dissolve)
+
+    with stage('Saving results'):
+        file_results = results_path(path_results, 'results_tiled', fmt)
+        write_layer(gdf_dissolve, file_results, layer='res_tiled')
+
+    info_finished(start_time=start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-car', type=str, required=True, dest='car',
+        help='File path (Shapefile with extension .shp) from CAR'
+    )
+    parser.add_argument(
+        '-mp', type=str, required=True, dest='mp',
+        help='File path (Shapefile with extension .shp) from MapBiomas Alerta'
+    )
+
+    parser.add_argument(
+        '-r', type=str, required=True, dest='r',
+        help='Path to save the results'
+    )
+    parser.add_argument(
+        '-tiles', type=int, nargs=2, default=None, dest='tiles',
+        help='Number of tiles in X and Y (default: about 4 tiles per worker)'
+    )
+    parser.add_argument(
+        '-workers', type=int, default=n_workers, dest='workers',
+        help='Number of processes (default: number of cores)'
+    )
+    parser.add_argument(
+        '-format', type=str, default='gpkg', dest='format',
+        choices=list(FORMATS),
+        help='Format of the results (default: gpkg)'
+    )
+    parser.add_argument(
+        '-crs', type=str, default=None, dest='crs',
+        help='CRS of the inputs, used to reproject the results to UTM '
+             '(default: CRS of the layer, or EPSG:4674)'
+    )
+    parser.add_argument(
+        '-cache', action='store_true', dest='cache',
+        help='Read the inputs from the GeoParquet cache, creating it on the '
+             'first run'
+    )
+    parser.add_argument(
+        '-prefilter', action='store_true', dest='prefilter',
+        help='Read the bounds of the alerts first and load only the CAR '
+             'features near them, skipping the tiles without alerts'
+    )
+    parser.add_argument(
+        '-balance', action='store_true', dest='balance',
+        help='Split the tiles with most of the vertices of the alerts and '
+             'process the most costly tiles first'
+    )
+    parser.add_argument(
+        '-grid', type=float, default=None, dest='grid',
+        help='Grid size to snap the vertices in the intersection and union, '
+             'in units of the CRS of the inputs (Ex.: 1e-7 degrees, about '
+             '1 cm). Default: full precision'
+    )
+
+    args = parser.parse_args()
+
+    car: str = args.car
+    mp: str = args.mp
+    path_results: str = args.r
+
+    if not Path(car).exists():
+        print(f'File {car} not found.')
+        return
+    if not Path(mp).exists():
+        print(f'File {mp} not found.')
+        return
+    if not Path(path_results).exists():
+        print(f'Path {path_results} not found.')
+        return
+
+    run(car_file_path=car, mp_file_path=mp, path_results=path_results,
+        tiles=args.tiles, workers=args.workers, cache=args.cache,
+        fmt=args.format, crs=args.crs,
+        prefilter=args.prefilter, grid_size=args.grid, balance=args.balance)
+
+
+if __name__ == '__main__':
+    main()
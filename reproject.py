@@ -0,0 +1,110 @@
+"""
+Reprojection of the geometries to UTM
+
+The coordinates of all the geometries are transformed at once, in chunks
+across threads (PROJ releases the GIL), reusing a cached Transformer of each
+thread instead of building a new one in each run of the stage.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import os
+import threading
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+
+# CRS of the inputs (SIRGAS 2000) and of the results (SIRGAS 2000 / UTM 22S)
+SOURCE_CRS = 'EPSG:4674'
+TARGET_CRS = 'EPSG:31982'
+
+# Minimum number of coordinates of each chunk transformed by a thread
+CHUNK_SIZE = 65536
+
+
+@lru_cache(maxsize=None)
+def _transformer(src: str = '', dst: str = '',
+                 thread: int = 0) -> Transformer:
+    # The Transformer is not shared across threads
+    return Transformer.from_crs(src, dst, always_xy=True)
+
+
+def transformer(src=None, dst=None) -> Transformer:
+    """Cached Transformer (x, y order) of the current thread"""
+    return _transformer(CRS.from_user_input(src).to_string(),
+                        CRS.from_user_input(dst).to_string(),
+                        threading.get_ident())
+
+
+def transform_coords(coords: np.ndarray = None, src=SOURCE_CRS,
+                     dst=TARGET_CRS, threads: int = None,
+                     chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """Transform an array of coordinates (N, 2) in chunks across threads
+
+    Args:
+        coords: Coordinates x, y
+        src: Source CRS
+        dst: Target CRS
+        threads: Number of threads. Default: number of cores
+        chunk_size: Minimum number of coordinates of each chunk
+
+    Returns:
+        Transformed coordinates (N, 2)
+    """
+    threads = threads or os.cpu_count() or 1
+    n_chunks = max(1, min(threads, len(coords) // chunk_size))
+
+    def _transform(chunk: np.ndarray) -> np.ndarray:
+        x, y = transformer(src, dst).transform(chunk[:, 0], chunk[:, 1])
+        return np.column_stack([x, y])
+
+    if n_chunks == 1:
+        return _transform(coords)
+
+    with ThreadPoolExecutor(max_workers=n_chunks) as executor:
+        chunks = list(executor.map(_transform,
+                                   np.array_split(coords, n_chunks)))
+
+    return np.concatenate(chunks)
+
+
+def reproject(gdf: gpd.GeoDataFrame = None, dst=TARGET_CRS, src=None,
+              threads: int = None) -> gpd.GeoDataFrame:
+    """Reproject the geometries of the GeoDataFrame
+
+    Args:
+        gdf: GeoDataFrame
+        dst: Target CRS
+        src: Source CRS. Default: CRS of the GeoDataFrame, or SOURCE_CRS
+        threads: Number of threads. Default: number of cores
+
+    Returns:
+        GeoDataFrame in the target CRS
+    """
+    src = src or gdf.crs or SOURCE_CRS
+    geoms = shapely.transform(
+        np.asarray(gdf.geometry.array),
+        lambda coords: transform_coords(coords, src, dst, threads))
+
+    return gdf.set_geometry(gpd.GeoSeries(geoms, index=gdf.index, crs=dst),
+                            crs=dst)
+
+
+def utm_area(gdf: gpd.GeoDataFrame = None, src=None,
+             threads: int = None) -> gpd.GeoDataFrame:
+    """Dissolved properties in UTM with the area in hectares
+
+    Args:
+        gdf: GeoDataFrame indexed by cod_imovel
+        src: Source CRS. Default: CRS of the GeoDataFrame, or SOURCE_CRS
+        threads: Number of threads of the reprojection
+
+    Returns:
+        GeoDataFrame with the columns cod_imovel, area_ha and geometry
+    """
+    gdf = reproject(gdf, TARGET_CRS, src, threads).reset_index()
+    gdf['area_ha'] = gdf.area / 10000
+
+    return gdf[['cod_imovel', 'area_ha', 'geometry']]
@@ -0,0 +1,337 @@
+"""
+Script to measure how the engines scale with the threads and the data size
+
+Each engine runs with each number of threads (DuckDB threads, Dask
+partitions and workers, processes of the tiled engine) on the synthetic
+datasets of each scale factor (see generate_data.py), using the benchmark
+runner. The results are:
+
+- Strong scaling: speedup T(p0) / T(p) and efficiency speedup * p0 / p for
+  each scale factor, where p0 is the smallest number of threads.
+- Weak scaling: efficiency T(p0, s0) / T(p, s) when the scale factor s grows
+  with the threads (s / s0 = p / p0).
+
+Both are computed for the whole run and for each stage, with the CPU
+utilization (CPU time / wall time) of the stage: a stage whose utilization
+does not grow with the threads is limited by I/O or by a serial step, not by
+the cores.
+"""
+
+import argparse
+import csv
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import benchmark
+import generate_data
+from utils import info
+
+# Engine -> arguments that set its number of threads/workers
+THREAD_ARGS = {
+    'dask-geopandas': ['-parts', '-workers'],
+    'duckdb_01': ['-threads'],
+    'duckdb_02': ['-threads'],
+    'tiled': ['-workers'],
+}
+
+INPUT_FORMATS = ['shp', 'parquet']
+
+# Name of the stage of the whole run in the tables
+TOTAL = 'total'
+
+
+def default_threads() -> list:
+    """Powers of 2 up to the number of cores"""
+    cores = os.cpu_count() or 1
+    threads = [1]
+    while threads[-1] * 2 <= cores:
+        threads.append(threads[-1] * 2)
+    if threads[-1] != cores:
+        threads.append(cores)
+
+    return threads
+
+
+def thread_variants(engines: list = None, threads: list = None) -> dict:
+    """Variants of the benchmark runner, engine -> [(label, arguments)]"""
+    return {engine: [(f'threads={n}',
+                      [a for arg in THREAD_ARGS[engine]
+                       for a in (arg, str(n))])
+                     for n in threads]
+            for engine in engines}
+
+
+def dataset(path_data: str = '', scale: float = 1,
+            input_fmt: str = 'shp') -> tuple:
+    """File paths of CAR and MapBiomas Alerta of the scale factor,
+    generating them if they do not exist"""
+    car, mp = (Path(path_data, f'{name}_x{scale:g}.{input_fmt}').__str__()
+               for name in ('car', 'mp'))
+    if not (Path(car).exists() and Path(mp).exists()):
+        generate_data.run(path_results=path_data, scales=[scale],
+                          formats=[input_fmt])
+
+    return car, mp
+
+
+def _times(results: dict = None, scale: float = 1) -> list:
+    """Median wall and CPU times of the runs and of the stages of the
+    benchmark results of a scale factor"""
+    rows = []
+    for s in results['summary']:
+        if not s['n']:
+            continue
+        rows.append({'engine': s['engine'], 'cache_mode': s['cache_mode'],
+                     'scale': scale,
+                     'threads': int(s['variant'].split('=')[1]),
+                     'stage': TOTAL, 'wall_median': s['median'],
+                     'cpu_median': None, 'valid': s['valid']})
+
+    valid = {(r['engine'], r['cache_mode'], r['threads']): r['valid']
+             for r in rows}
+    for s in results['stage_summary']:
+        threads = int(s['variant'].split('=')[1])
+        rows.append({'engine': s['engine'], 'cache_mode': s['cache_mode'],
+                     'scale': scale, 'threads': threads,
+                     'stage': s['stage'], 'wall_median': s['wall_median'],
+                     'cpu_median': s['cpu_median'],
+                     'valid': valid.get((s['engine'], s['cache_mode'],
+                                         threads), False)})
+
+    return rows
+
+
+def _cpu_util(row: dict = None) -> float | None:
+    if row['cpu_median'] is None or not row['wall_median']:
+        return None
+    return row['cpu_median'] / row['wall_median']
+
+
+def strong_scaling(times: list = None) -> list:
+    """Speedup and efficiency of each number of threads, relative to the
+    smallest one, for each engine, scale factor and stage"""
+    groups = {}
+    for row in times:
+        key = (row['engine'], row['cache_mode'], row['scale'], row['stage'])
+        groups.setdefault(key, []).append(row)
+
+    table = []
+    for rows in groups.values():
+        rows = sorted(rows, key=lambda r: r['threads'])
+        base = rows[0]
+        for row in rows:
+            speedup = base['wall_median'] / row['wall_median'] \
+                if row['wall_median'] else None
+            table.append({
+                **{k: row[k] for k in ('engine', 'cache_mode', 'scale',
+                                       'stage', 'threads', 'wall_median')},
+                'speedup': speedup,
+                'efficiency': speedup * base['threads'] / row['threads']
+                if speedup is not None else None,
+                'cpu_util': _cpu_util(row),
+                'valid': row['valid'],
+            })
+
+    return table
+
+
+def weak_scaling(times: list = None) -> list:
+    """Efficiency T(p0, s0) / T(p, s) of the pairs (threads, scale factor)
+    with s / s0 = p / p0, for each engine and stage"""
+    groups = {}
+    for row in times:
+        key = (row['engine'], row['cache_mode'], row['stage'])
+        groups.setdefault(key, {})[(row['threads'], row['scale'])] = row
+
+    table = []
+    for cells in groups.values():
+        p0 = min(p for p, _ in cells)
+        s0 = min(s for _, s in cells)
+        base = cells.get((p0, s0))
+        if base is None:
+            continue
+        for (p, s), row in sorted(cells.items()):
+            if abs(s / s0 - p / p0) > 1e-9:
+                continue
+            table.append({
+                **{k: row[k] for k in ('engine', 'cache_mode', 'stage',
+                                       'threads', 'scale', 'wall_median')},
+                'efficiency': base['wall_median'] / row['wall_median']
+                if row['wall_median'] else None,
+                'cpu_util': _cpu_util(row),
+                'valid': row['valid'],
+            })
+
+    return table
+
+
+def _log_strong(table: list = None) -> None:
+    for row in table:
+        if row['stage'] != TOTAL:
+            continue
+        info(f'{row["engine"]} ({row["cache_mode"]}) scale '
+             f'{row["scale"]:g}x, {row["threads"]} threads: '
+             f'{row["wall_median"]:.3f} s, speedup {row["speedup"]:.2f}, '
+             f'efficiency {row["efficiency"]:.0%}'
+             f'{"" if row["valid"] else " - INVALID, results differ"}')
+
+
+def _write_csv(file_path: Path = None, rows: list = None) -> None:
+    if not rows:
+        return
+
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run(engines: list = None, path_data: str = '', path_results: str = '',
+        threads: list = None, scales: list = None, input_fmt: str = 'shp',
+        repetitions: int = 3, warmups: int = 1, cache_modes: list = None,
+        path_output: str = '', verify: bool = True) -> dict:
+    """Run the scaling matrix and save the tables
+
+    Args:
+        engines: Engines (keys of THREAD_ARGS)
+        path_data: Folder of the synthetic datasets
+        path_results: Path of the results of the engines
+        threads: Numbers of threads. Default: powers of 2 up to the number
+            of cores
+        scales: Scale factors of the datasets
+        input_fmt: Format of the datasets (shp or parquet)
+        repetitions: Number of measured runs of each engine
+        warmups: Number of warmup runs of each engine
+        cache_modes: File cache modes (see benchmark.CACHE_MODES)
+        path_output: Path to save the benchmark results and the tables
+        verify: Compare the results of each number of threads
+
+    Returns:
+        Dict with the times and the strong and weak scaling tables
+    """
+    threads = sorted(threads or default_threads())
+    scales = sorted(scales or [1])
+    cores = os.cpu_count() or 1
+    if threads[-1] > cores:
+        info(f'More threads ({threads[-1]}) than cores ({cores})')
+
+    times = []
+    for scale in scales:
+        car, mp = dataset(path_data, scale, input_fmt)
+        path_scale = Path(path_output, f'scale_{scale:g}')
+        path_scale.mkdir(parents=True, exist_ok=True)
+
+        info(f'Scale {scale:g}x, threads {threads}')
+        results = benchmark.run(
+            engines=engines, car_file_path=car, mp_file_path=mp,
+            path_results=path_results, repetitions=repetitions,
+            warmups=warmups, cache_modes=cache_modes,
+            path_output=path_scale.__str__(),
+            variants=thread_variants(engines, threads), verify=verify)
+        times += _times(results, scale)
+
+    strong = strong_scaling(times)
+    weak = weak_scaling(times)
+    _log_strong(strong)
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'cpu_count': cores,
+        'threads': threads,
+        'scales': scales,
+        'times': times,
+        'strong': strong,
+        'weak': weak,
+    }
+
+    name = f'scaling_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+    file_json = Path(path_output, f'{name}.json')
+    with open(file_json, 'w') as f:
+        json.dump(results, f, indent=2)
+    _write_csv(Path(path_output, f'{name}_strong.csv'), strong)
+    _write_csv(Path(path_output, f'{name}_weak.csv'), weak)
+    info(f'Scaling results saved to {file_json}')
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-r', type=str, required=True, dest='r',
+        help='Path to save the results'
+    )
+    parser.add_argument(
+        '-e', type=str, nargs='+', dest='engines',
+        choices=list(THREAD_ARGS), default=['duckdb_01', 'dask-geopandas'],
+        help='Engines to run'
+    )
+    parser.add_argument(
+        '-threads', type=int, nargs='+', default=None, dest='threads',
+        help='Numbers of threads/workers (default: powers of 2 up to the '
+             'number of cores)'
+    )
+    parser.add_argument(
+        '-scales', type=float, nargs='+', default=[1], dest='scales',
+        help='Scale factors of the synthetic datasets (Ex.: 1 2 4)'
+    )
+    parser.add_argument(
+        '-data', type=str, default=None, dest='data',
+        help='Folder of the synthetic datasets, generated if they do not '
+             'exist (default: scaling_data in the results path)'
+    )
+    parser.add_argument(
+        '-input', type=str, default='shp', dest='input',
+        choices=INPUT_FORMATS,
+        help='Format of the datasets (duckdb_02 needs parquet)'
+    )
+    parser.add_argument(
+        '-n', type=int, default=3, dest='n',
+        help='Number of measured runs of each engine'
+    )
+    parser.add_argument(
+        '-w', type=int, default=1, dest='w',
+        help='Number of warmup runs (not measured) of each engine'
+    )
+    parser.add_argument(
+        '-cache', type=str, nargs='+', default=['warm'], dest='cache',
+        choices=benchmark.CACHE_MODES,
+        help='File cache mode: "cold" evicts the inputs from the OS cache '
+             'before each run'
+    )
+    parser.add_argument(
+        '-o', type=str, default=None, dest='o',
+        help='Path to save the benchmark results (default: same as -r)'
+    )
+    parser.add_argument(
+        '-no_verify', action='store_true', dest='no_verify',
+        help='Do not compare the results of the engines'
+    )
+
+    args = parser.parse_args()
+
+    path_results: str = args.r
+    path_output: str = args.o or path_results
+    path_data: str = args.data or Path(path_results,
+                                       'scaling_data').__str__()
+
+    if not Path(path_results).exists():
+        print(f'Path {path_results} not found.')
+        return
+    if not Path(path_output).exists():
+        print(f'Path {path_output} not found.')
+        return
+    Path(path_data).mkdir(parents=True, exist_ok=True)
+
+    run(engines=args.engines, path_data=path_data,
+        path_results=path_results, threads=args.threads, scales=args.scales,
+        input_fmt=args.input, repetitions=args.n, warmups=args.w,
+        cache_modes=args.cache, path_output=path_output,
+        verify=not args.no_verify)
+
+
+if __name__ == '__main__':
+    main()
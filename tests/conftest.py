@@ -0,0 +1,11 @@
+"""
+Configuration of the tests
+
+The scripts are modules in the root of the repository, so it is added to
+the path.
+"""
+
+from pathlib import Path
+import sys
+
+sys.path.insert(0, Path(__file__).resolve().parents[1].__str__())
@@ -0,0 +1,98 @@
+"""
+Tests of the cost model and the partitioning of the work
+"""
+
+import numpy as np
+import pytest
+import shapely
+
+from balance import balance_pairs, balance_tiles, imbalance, lpt, \
+    pair_costs
+
+
+def _pairs(seed: int = 0) -> tuple:
+    """Candidate pairs with a few features much costlier than the others"""
+    rng = np.random.default_rng(seed)
+    idx_left = rng.integers(0, 50, 400)
+    costs = rng.uniform(1, 10, 400)
+    costs[idx_left == 7] *= 100
+    return idx_left, costs
+
+
+@pytest.mark.parametrize('n', [1, 3, 8])
+def test_pairs_assigned_once(n):
+    idx_left, costs = _pairs()
+    parts = balance_pairs(idx_left, costs, n)
+
+    assert len(parts) == n
+    pairs = np.concatenate(parts)
+    assert np.array_equal(np.sort(pairs), np.arange(len(idx_left)))
+
+
+def test_features_kept_together():
+    idx_left, costs = _pairs()
+    parts = balance_pairs(idx_left, costs, 4)
+
+    limit = costs.sum() / 4
+    for feature in np.unique(idx_left):
+        in_parts = [i for i, part in enumerate(parts)
+                    if (idx_left[part] == feature).any()]
+        # Only the features costlier than a partition are split
+        if costs[idx_left == feature].sum() <= limit:
+            assert len(in_parts) == 1
+
+
+def test_outlier_split():
+    idx_left = np.zeros(8, dtype=int)
+    costs = np.ones(8)
+    parts = balance_pairs(idx_left, costs, 4)
+
+    assert [len(p) for p in parts] == [2, 2, 2, 2]
+
+
+def test_empty():
+    parts = balance_pairs(np.empty(0, dtype=int), np.empty(0), 3)
+
+    assert len(parts) == 3
+    assert all(len(p) == 0 for p in parts)
+
+
+def test_zero_cost():
+    idx_left = np.array([0, 0, 1, 2, 2, 3])
+    parts = balance_pairs(idx_left, np.zeros(6), 2)
+
+    assert np.array_equal(np.sort(np.concatenate(parts)), np.arange(6))
+    # The features are not split and each partition has some
+    assert not len(np.intersect1d(idx_left[parts[0]], idx_left[parts[1]]))
+    assert all(len(p) for p in parts)
+
+
+def test_tiles_empty():
+    assert balance_tiles([], np.empty((0, 2)), np.empty(0), 4) == []
+
+
+def test_tiles_split():
+    centers = np.array([[0.25, 0.25], [0.75, 0.75], [1.5, 0.5]])
+    tiles = [(0, 0, 1, 1), (1, 0, 2, 1)]
+    result = balance_tiles(tiles, centers, np.array([2., 2., 1.]), 1)
+
+    # The costly tile is split in 4, and its costly quarters come first
+    assert len(result) == 5
+    assert set(result[:2]) == {(0, 0, 0.5, 0.5), (0.5, 0.5, 1, 1)}
+    # Without costs no tile is split
+    assert len(balance_tiles(tiles, centers, np.zeros(3), 1)) == 2
+
+
+def test_lpt():
+    costs = np.array([7., 5., 4., 3., 3., 2.])
+    assignment = lpt(costs, 2)
+
+    assert imbalance(costs, assignment, 2) == 1.0
+
+
+def test_pair_costs():
+    left = shapely.box(np.arange(3.), 0, np.arange(3.) + 1, 1)
+    right = np.array([shapely.Point(0, 0).buffer(1, 4)])
+
+    costs = pair_costs(left, right, np.array([0, 2]), np.array([0, 0]))
+    assert costs.tolist() == [5 + 17, 5 + 17]
@@ -0,0 +1,74 @@
+"""
+Tests of the cache of the inputs
+"""
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import shapely
+
+from cache import cache_key, cached_layer, cached_path
+
+
+def _write_car(file_path: str = '', status: str = 'em analise') -> None:
+    """Shapefile with 5 squares"""
+    x = np.arange(5, dtype=float)
+    gpd.GeoDataFrame(
+        {'cod_imovel': [f'P{i}' for i in range(5)],
+         'des_condic': [status] * 5},
+        geometry=shapely.box(x, 0, x + 1, 1),
+        crs='EPSG:4674').to_file(file_path)
+
+
+def _touch(file_path: str = '', seconds: int = 10) -> None:
+    """Move the modification time forward, like a later edit"""
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns,
+                            stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+def test_key_stable(tmp_path):
+    file_path = tmp_path.joinpath('car.shp').__str__()
+    _write_car(file_path)
+
+    assert cache_key(file_path, ['a']) == cache_key(file_path, ['a'])
+    assert cache_key(file_path, ['a']) != cache_key(file_path, ['b'])
+
+
+def test_key_sidecars(tmp_path):
+    file_path = tmp_path.joinpath('car.shp').__str__()
+    _write_car(file_path)
+
+    keys = {cache_key(file_path, ['a'])}
+    for ext in ('.dbf', '.shx', '.prj', '.cpg'):
+        _touch(tmp_path.joinpath(f'car{ext}').__str__())
+        keys.add(cache_key(file_path, ['a']))
+    assert len(keys) == 5
+
+
+def test_attribute_change_rebuilds(tmp_path):
+    file_path = tmp_path.joinpath('car.shp').__str__()
+    _write_car(file_path)
+    columns = ['cod_imovel', 'des_condic']
+    cache_dir = tmp_path.joinpath('cache').__str__()
+
+    first = cached_layer(file_path, columns, cache_dir)
+    assert cached_layer(file_path, columns, cache_dir) == first
+
+    # Only the .dbf changes: same geometries, other status
+    shp = tmp_path.joinpath('car.shp')
+    data, stat = shp.read_bytes(), shp.stat()
+    _write_car(file_path, 'cancelado')
+    shp.write_bytes(data)
+    os.utime(shp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    _touch(tmp_path.joinpath('car.dbf').__str__())
+
+    second = cached_layer(file_path, columns, cache_dir)
+    assert second != first
+    assert second == cached_path(file_path, columns, cache_dir)
+    gdf = gpd.read_parquet(second)
+    assert (gdf['des_condic'] == 'cancelado').all()
+    assert gdf.crs.to_epsg() == 4674
+    assert 'bbox' in pq.read_schema(second).names
@@ -0,0 +1,76 @@
+"""
+Tests of the Dask-GeoPandas pipeline
+"""
+
+import importlib
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+import process_geopandas
+from verify import compare, read_results
+
+process_dask = importlib.import_module('process_dask-geopandas')
+
+
+@pytest.fixture(scope='module')
+def layers(tmp_path_factory) -> tuple:
+    """CAR with 40 squares, whose properties have up to 3 features far from
+    each other, alerts over part of them and the results of GeoPandas"""
+    path = tmp_path_factory.mktemp('dask')
+    i = np.arange(40)
+    x, y = (i % 8) * 0.01, (i // 8) * 0.01
+    car = path.joinpath('car.shp').__str__()
+    gpd.GeoDataFrame(
+        {'cod_imovel': [f'P{k:02d}' for k in i % 15],
+         'des_condic': np.where(i % 7 == 3, 'cancelado', 'em analise')},
+        geometry=shapely.box(x, y, x + 0.01, y + 0.01),
+        crs='EPSG:4674').to_file(car)
+    mp = path.joinpath('mp.shp').__str__()
+    gpd.GeoDataFrame(
+        {'cod_alerta': [1, 2, 3]},
+        geometry=[shapely.box(0.005, 0.005, 0.035, 0.025),
+                  shapely.box(0.052, 0.032, 0.075, 0.045),
+                  shapely.box(0.001, 0.041, 0.079, 0.042)],
+        crs='EPSG:4674').to_file(mp)
+
+    process_geopandas.run(car, mp, path.__str__(), fmt='parquet')
+    expected = read_results(path.joinpath('results_geopandas.parquet')
+                            .__str__())
+    return car, mp, expected
+
+
+@pytest.mark.parametrize('mode, dissolve_mode, prefilter', [
+    ('partitioned', 'local', False),
+    ('partitioned', 'local', True),
+    ('balanced', 'local', False),
+    ('dissolve', 'shuffle', False),
+])
+def test_matches_geopandas(layers, tmp_path, mode, dissolve_mode,
+                           prefilter):
+    car, mp, expected = layers
+
+    process_dask.run(car, mp, tmp_path.__str__(), npartitions=3, mode=mode,
+                     dissolve_mode=dissolve_mode, fmt='parquet',
+                     prefilter=prefilter)
+    actual = read_results(tmp_path.joinpath(
+        'results_dask-geopandas.parquet').__str__())
+
+    assert len(expected) > 5
+    assert compare(expected, actual)['ok']
+
+
+def test_read_partitioned_covers_rows(layers):
+    car, _, _ = layers
+
+    dgdf = process_dask.read_partitioned(
+        car, columns=['cod_imovel'], contains={'des_condic': 'analise'},
+        npartitions=4)
+
+    gdf = gpd.read_file(car)
+    expected = gdf.loc[gdf['des_condic'].str.contains('analise'),
+                       'cod_imovel'].tolist()
+    assert dgdf.npartitions == 4
+    assert dgdf.compute()['cod_imovel'].tolist() == expected
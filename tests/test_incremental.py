@@ -0,0 +1,126 @@
+"""
+Tests of the incremental processing of the alerts
+"""
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import process_incremental
+from process_incremental import diff_alerts
+from verify import compare, read_results
+
+
+def _write_layers(path, status: str = 'em analise') -> tuple:
+    """CAR with 5 squares and an alert over the first 3 (EPSG:4674)"""
+    x = -52 + np.arange(5) * 0.01
+    car = path.joinpath('car.shp').__str__()
+    gpd.GeoDataFrame(
+        {'cod_imovel': [f'P{i}' for i in range(5)],
+         'des_condic': [status] * 5},
+        geometry=shapely.box(x, -23, x + 0.01, -22.99),
+        crs='EPSG:4674').to_file(car)
+    mp = path.joinpath('mp.shp').__str__()
+    gpd.GeoDataFrame(
+        {'cod_alerta': [1]},
+        geometry=[shapely.box(-52, -23, -51.975, -22.995)],
+        crs='EPSG:4674').to_file(mp)
+    return car, mp
+
+
+def _run(car: str = '', mp: str = '', path=None) -> gpd.GeoDataFrame:
+    process_incremental.run(car, mp, path.__str__(), fmt='parquet')
+    return read_results(path.joinpath('results_incremental.parquet')
+                        .__str__())
+
+
+def test_car_attribute_change_rebuilds(tmp_path):
+    car, mp = _write_layers(tmp_path)
+    assert sorted(_run(car, mp, tmp_path)['cod_imovel']) == \
+        ['P0', 'P1', 'P2']
+
+    # Only the .dbf changes, with a later modification time
+    shp = tmp_path.joinpath('car.shp')
+    data, stat = shp.read_bytes(), shp.stat()
+    mtime = tmp_path.joinpath('car.dbf').stat().st_mtime_ns
+    _write_layers(tmp_path, 'cancelado')
+    shp.write_bytes(data)
+    os.utime(shp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    dbf = tmp_path.joinpath('car.dbf')
+    if dbf.stat().st_mtime_ns <= mtime:
+        os.utime(dbf, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+    assert len(_run(car, mp, tmp_path)) == 0
+
+
+def _manifest(ids: list = None, hashes: list = None) -> pd.DataFrame:
+    return pd.DataFrame({'cod_alerta': ids,
+                         'hash': np.array(hashes, dtype=np.uint64)})
+
+
+def test_diff_alerts():
+    manifest = _manifest([1, 2, 3], [10, 20, 30])
+    todo, dropped = diff_alerts(manifest, np.array([1, 2, 4]),
+                                np.array([10, 21, 40], dtype=np.uint64))
+
+    # 2 changed, 3 removed, 4 new
+    assert todo.tolist() == [False, True, True]
+    assert sorted(dropped) == [2, 3]
+
+
+def test_diff_alerts_first_run():
+    todo, dropped = diff_alerts(None, np.array([1, 2]),
+                                np.array([10, 20], dtype=np.uint64))
+
+    assert todo.all()
+    assert len(dropped) == 0
+
+
+def test_diff_alerts_uint64():
+    # Hashes that are equal as float64
+    manifest = _manifest([1, 2], [2 ** 63 + 1, 2 ** 63 + 3])
+    todo, dropped = diff_alerts(
+        manifest, np.array([1, 2, 3]),
+        np.array([2 ** 63 + 2, 2 ** 63 + 3, 5], dtype=np.uint64))
+
+    assert todo.tolist() == [True, False, True]
+    assert dropped.tolist() == [1]
+
+
+def test_diff_alerts_duplicated_ids():
+    manifest = _manifest([1, 1, 2], [10, 11, 20])
+    todo, dropped = diff_alerts(manifest, np.array([1, 1, 2]),
+                                np.array([10, 11, 20], dtype=np.uint64))
+    assert not todo.any()
+    assert len(dropped) == 0
+
+    # One alert of the ID 1 changes, the pieces of both are rebuilt
+    todo, dropped = diff_alerts(manifest, np.array([1, 1, 2, 2]),
+                                np.array([10, 12, 20, 20], dtype=np.uint64))
+    assert todo.tolist() == [True, True, False, False]
+    assert dropped.tolist() == [1]
+
+
+def test_new_alert_matches_full_run(tmp_path):
+    car, mp = _write_layers(tmp_path)
+    _run(car, mp, tmp_path)
+
+    # A new alert over the last 2 properties and the first one moved
+    gpd.GeoDataFrame(
+        {'cod_alerta': [1, 2]},
+        geometry=[shapely.box(-52, -23, -51.985, -22.995),
+                  shapely.box(-51.975, -23, -51.95, -22.995)],
+        crs='EPSG:4674').to_file(mp)
+    incremental = _run(car, mp, tmp_path).sort_values('cod_imovel')
+
+    process_incremental.run(car, mp, tmp_path.__str__(), fmt='parquet',
+                            full=True)
+    full = read_results(tmp_path.joinpath('results_incremental.parquet')
+                        .__str__()).sort_values('cod_imovel')
+
+    assert compare(full, incremental)['ok']
+    assert incremental['cod_imovel'].tolist() == \
+        ['P0', 'P1', 'P2', 'P3', 'P4']
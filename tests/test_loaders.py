@@ -0,0 +1,112 @@
+"""
+Tests of the reading of the layers in Arrow batches
+"""
+
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+import shapely
+
+from loaders import _row_groups, iter_arrow, read_layer
+
+N = 500
+
+
+@pytest.fixture(scope='module')
+def layers(tmp_path_factory) -> dict:
+    """The same features in a Shapefile and in a GeoParquet file with small
+    row groups, sorted by x so the row groups are compact"""
+    path = tmp_path_factory.mktemp('layers')
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(-54, -52, N))
+    y = rng.uniform(-24, -23, N)
+    size = rng.uniform(0.001, 0.02, N)
+    gdf = gpd.GeoDataFrame(
+        {'cod_imovel': [f'P{i:03d}' for i in range(N)],
+         'des_condic': np.where(np.arange(N) % 3, 'em analise',
+                                'cancelado')},
+        geometry=shapely.box(x, y, x + size, y + size), crs='EPSG:4674')
+
+    files = {'shp': path.joinpath('car.shp').__str__(),
+             'parquet': path.joinpath('car.parquet').__str__(),
+             'parquet_nb': path.joinpath('car_nb.parquet').__str__()}
+    gdf.to_file(files['shp'])
+    gdf.to_parquet(files['parquet'], write_covering_bbox=True,
+                   row_group_size=64)
+    gdf.to_parquet(files['parquet_nb'], row_group_size=64)
+    files['gdf'] = gdf
+    return files
+
+
+def _codes(file_path: str = '', **kwargs) -> list:
+    return [c for _, _, batch in iter_arrow(file_path,
+                                            columns=['cod_imovel'],
+                                            **kwargs)
+            for c in batch['cod_imovel'].to_pylist()]
+
+
+@pytest.mark.parametrize('fmt', ['shp', 'parquet'])
+@pytest.mark.parametrize('count', [1, 3, 7])
+def test_parts_cover_rows(layers, fmt, count):
+    expected = layers['gdf']['cod_imovel'].tolist()
+
+    codes = [c for i in range(count)
+             for c in _codes(layers[fmt], part=(i, count), batch_size=50)]
+
+    # Each row is read once, by one partition, in the order of the file
+    assert codes == expected
+
+
+@pytest.mark.parametrize('fmt', ['shp', 'parquet'])
+def test_parts_with_filter(layers, fmt):
+    gdf = layers['gdf']
+    expected = gdf.loc[gdf['des_condic'].str.contains('analise'),
+                       'cod_imovel'].tolist()
+
+    codes = [c for i in range(4)
+             for c in _codes(layers[fmt], part=(i, 4), batch_size=50,
+                             contains={'des_condic': 'analise'})]
+
+    assert codes == expected
+
+
+@pytest.mark.parametrize('fmt', ['shp', 'parquet', 'parquet_nb'])
+def test_bbox_and_boxes(layers, fmt):
+    gdf = layers['gdf']
+    bounds = gdf.bounds.to_numpy()
+    bbox = (-53.5, -23.8, -52.5, -23.2)
+    boxes = np.array([[-54, -24, -53.6, -23.5], [-53, -23.4, -52.8, -23]])
+
+    def _expected(rects: np.ndarray = None) -> list:
+        hits = shapely.STRtree(shapely.box(*bounds.T)).query(
+            shapely.box(*rects.T), predicate='intersects')[1]
+        return sorted(gdf['cod_imovel'].to_numpy()[np.unique(hits)])
+
+    assert sorted(_codes(layers[fmt], bbox=bbox)) == \
+        _expected(np.array([bbox]))
+    assert sorted(_codes(layers[fmt], boxes=boxes)) == _expected(boxes)
+    # Only the attributes, the geometries are read for the filter only
+    batches = list(iter_arrow(layers[fmt], columns=['cod_imovel'],
+                              boxes=boxes, read_geometry=False))
+    assert all(batch.column_names == ['cod_imovel']
+               for _, _, batch in batches)
+    assert sorted(c for _, _, batch in batches
+                  for c in batch['cod_imovel'].to_pylist()) == \
+        _expected(boxes)
+
+
+def test_row_groups_pruned(layers):
+    parquet = pq.ParquetFile(layers['parquet'])
+    bbox = (-54, -24, -53.5, -23)
+
+    row_groups = _row_groups(parquet, 'bbox', bbox)
+
+    # The row groups are sorted by x, so only the first ones intersect
+    assert 0 < len(row_groups) < parquet.num_row_groups
+    assert row_groups == list(range(len(row_groups)))
+    # No feature of the skipped row groups intersects the bbox
+    gdf = read_layer(layers['parquet'], columns=['cod_imovel'], bbox=bbox)
+    rows = parquet.metadata.row_group(0).num_rows * len(row_groups)
+    assert gdf['cod_imovel'].isin(
+        layers['gdf']['cod_imovel'][:rows]).all()
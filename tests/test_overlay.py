@@ -0,0 +1,180 @@
+"""
+Tests of the overlay functions
+"""
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from overlay import candidate_pairs, dissolve, intersection, \
+    intersection_pairs, keep_polygons, merge_cuts, subdivide
+
+
+def _star(n: int = 120, center: tuple = (0, 0)) -> shapely.Polygon:
+    """Star with n vertices and radius 40 and 80"""
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    radius = np.where(np.arange(n) % 2, 80, 40)
+    return shapely.Polygon(np.column_stack(
+        [center[0] + radius * np.cos(angles),
+         center[1] + radius * np.sin(angles)]))
+
+
+def _layers() -> tuple:
+    """CAR with a circle and a square with collinear vertices, and alerts
+    with a rectangle and a star"""
+    left = gpd.GeoDataFrame(
+        {'cod_imovel': ['A', 'B']},
+        geometry=[shapely.Point(3.3, 1.7).buffer(100, 64),
+                  shapely.box(150, -50, 250, 50).segmentize(2)],
+        crs='EPSG:31982')
+    right = gpd.GeoDataFrame(
+        {'id': [1, 2]},
+        geometry=[shapely.box(-47.3, -120.1, 300.7, 10.9), _star()],
+        crs='EPSG:31982')
+    return left, right
+
+
+def _vertices(geom) -> set:
+    return set(map(tuple, shapely.get_coordinates(geom)))
+
+
+def _max_distance(left: set = None, right: set = None) -> float:
+    """Largest distance of a vertex of one set to the other set"""
+    left, right = np.array(sorted(left)), np.array(sorted(right))
+    distance = np.hypot(*(left[:, None] - right[None]).transpose(2, 0, 1))
+    return max(distance.min(axis=0).max(), distance.min(axis=1).max())
+
+
+@pytest.mark.parametrize('max_vertices', [8, 32, 128])
+def test_subdivide(max_vertices):
+    left, _ = _layers()
+    geoms = np.asarray(left.geometry.array)
+    pieces, index, _ = subdivide(geoms, max_vertices)
+
+    assert (shapely.get_num_coordinates(pieces) <= max_vertices).all()
+    assert shapely.is_valid(pieces).all()
+    assert np.all(np.diff(index) >= 0)
+    for i, geom in enumerate(geoms):
+        part = pieces[index == i]
+        assert np.isclose(shapely.area(part).sum(), geom.area)
+        # The vertices of the input, including the collinear ones on the
+        # sides of the bounding box, are kept
+        assert _vertices(geom) <= _vertices(shapely.multipolygons(part))
+
+
+@pytest.mark.parametrize('max_vertices', [8, 16, 64])
+def test_subdivide_dissolve(max_vertices):
+    left, right = _layers()
+    expected = np.asarray(dissolve(intersection(left, right)).geometry.array)
+
+    gdf = intersection(left, right, max_vertices=max_vertices)
+    merged = merge_cuts(np.asarray(dissolve(gdf).geometry.array),
+                        gdf.attrs['cuts'])
+
+    assert np.allclose(shapely.area(merged), shapely.area(expected),
+                       rtol=1e-12)
+    assert (shapely.area(shapely.symmetric_difference(merged, expected)) <
+            1e-9).all()
+    inputs = _vertices(left.geometry) | _vertices(right.geometry)
+    for geom, geom_expected in zip(merged, expected):
+        vertices, vertices_expected = _vertices(geom), _vertices(geom_expected)
+        assert len(vertices) == len(vertices_expected)
+        # The vertices of the inputs are the same, the crossings of the
+        # edges are computed on the pieces and can differ in the last bits
+        assert vertices & inputs == vertices_expected & inputs
+        assert _max_distance(vertices, vertices_expected) < 1e-9
+
+
+def test_merge_cuts_keeps_input_vertices():
+    # Collinear vertex of the input on the line of the cut
+    geom = shapely.box(0, 0, 10, 10).segmentize(5)
+    cuts = np.array([[5., 0.], [5., 10.]])
+
+    assert _vertices(merge_cuts(np.array([geom]))[0]) == _vertices(geom)
+    assert _vertices(merge_cuts(np.array([geom]), cuts)[0]) == \
+        _vertices(geom) - {(5., 0.), (5., 10.)}
+    # Vertices that are not on the line of their neighbours are kept
+    corner = np.array([[0., 0.]])
+    assert _vertices(merge_cuts(np.array([geom]), corner)[0]) == \
+        _vertices(geom)
+
+
+def test_keep_polygons_nested():
+    polygon = shapely.box(0, 0, 1, 1)
+    multi = shapely.MultiPolygon([shapely.box(2, 0, 3, 1),
+                                  shapely.box(4, 0, 5, 1)])
+    collection = shapely.GeometryCollection([
+        shapely.Point(9, 9), polygon,
+        shapely.GeometryCollection([multi, shapely.LineString([(0, 0),
+                                                                (1, 1)])])])
+    geoms = np.array([collection, shapely.LineString([(0, 0), (1, 1)]),
+                      polygon, None], dtype=object)
+
+    result = keep_polygons(geoms)
+    assert shapely.equals(result[0],
+                          shapely.MultiPolygon([polygon, *multi.geoms]))
+    assert result[1] is None
+    assert result[2] == polygon
+    assert result[3] is None
+
+
+@pytest.mark.parametrize('grid_size', [None, 0.01])
+def test_prepared_pairs(grid_size):
+    rng = np.random.default_rng(0)
+    # Properties inside, across and outside the alerts, and alerts inside
+    # a property
+    centers = rng.uniform(-100, 100, (60, 2))
+    left = np.concatenate([
+        shapely.buffer(shapely.points(centers), rng.uniform(2, 30, 60),
+                       quad_segs=8),
+        [shapely.box(-20, -20, 20, 20)]])
+    right = np.array([_star(), shapely.box(-150, 50, 150, 60),
+                      shapely.box(-5, -5, 5, 5),
+                      shapely.box(200, 200, 210, 210)])
+    idx_left, idx_right = candidate_pairs(left, right)
+
+    expected = intersection_pairs(left, right, idx_left, idx_right,
+                                  grid_size)
+    result = intersection_pairs(left, right, idx_left, idx_right,
+                                grid_size, prepared=True)
+
+    missing = shapely.is_missing(expected)
+    missing[~missing] = shapely.is_empty(expected[~missing])
+    assert np.array_equal(shapely.is_missing(result), missing)
+    assert shapely.equals(result[~missing], expected[~missing]).all()
+    # The geometries passed in are not left prepared
+    assert not shapely.is_prepared(left).any()
+    assert not shapely.is_prepared(right).any()
+
+
+@pytest.mark.parametrize('max_vertices', [8, 16, 64])
+def test_subdivide_grid(max_vertices):
+    grid_size = 0.01
+    left, right = _layers()
+    expected = np.asarray(dissolve(intersection(left, right, grid_size),
+                                   grid_size=grid_size).geometry.array)
+
+    gdf = intersection(left, right, grid_size, max_vertices)
+    cuts = gdf.attrs['cuts']
+    merged = merge_cuts(np.asarray(dissolve(gdf, grid_size=grid_size)
+                                   .geometry.array), cuts,
+                        grid_size=grid_size)
+
+    assert shapely.is_valid(merged).all()
+    # The vertices and the cuts are on the grid
+    for coords in (shapely.get_coordinates(merged), cuts):
+        assert np.allclose(coords / grid_size, np.round(coords / grid_size),
+                           rtol=0, atol=1e-6)
+    # The vertices of the cuts are removed, except where the snap rounding
+    # collapsed a piece smaller than a cell (Ex.: the tip of the star)
+    vertices = shapely.get_num_coordinates(merged)
+    vertices_expected = shapely.get_num_coordinates(expected)
+    assert (np.abs(vertices - vertices_expected) <=
+            0.02 * vertices_expected).all()
+    left_cuts = _vertices(merged) & set(map(tuple, cuts)) - \
+        _vertices(expected)
+    assert len(left_cuts) <= 0.02 * vertices.sum()
+    # The edges move less than a quarter of a cell
+    assert (shapely.area(shapely.symmetric_difference(merged, expected)) <=
+            shapely.length(expected) * grid_size / 4).all()
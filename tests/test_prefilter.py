@@ -0,0 +1,64 @@
+"""
+Tests of the spatial prefilter
+"""
+
+import numpy as np
+import shapely
+
+from prefilter import intersects_boxes, mask_boxes
+
+
+def _random_bounds(n: int = 200, seed: int = 0) -> np.ndarray:
+    """Small rectangles scattered over an irregular extent"""
+    rng = np.random.default_rng(seed)
+    xmin = rng.uniform(-54.3, -51.7, n)
+    ymin = rng.uniform(-24.1, -22.9, n)
+    width, height = rng.uniform(0, 0.05, (2, n))
+    return np.column_stack([xmin, ymin, xmin + width, ymin + height])
+
+
+def test_boxes_cover_bounds():
+    bounds = _random_bounds()
+    boxes = mask_boxes(bounds, grid_size=64)
+
+    covered = shapely.covers(shapely.union_all(shapely.box(*boxes.T)),
+                             shapely.box(*bounds.T))
+    assert covered.all()
+    # The boxes do not overlap and cover less than the extent
+    area = ((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])).sum()
+    extent = (bounds[:, 2].max() - bounds[:, 0].min()) * \
+        (bounds[:, 3].max() - bounds[:, 1].min())
+    assert np.isclose(area, shapely.union_all(shapely.box(*boxes.T)).area)
+    assert area < extent
+
+
+def test_boxes_cover_points_and_edges():
+    # Degenerate bounds (points) and bounds on the edges of the grid cells
+    bounds = np.array([[0, 0, 0, 0], [1, 1, 1, 1], [0.25, 0.5, 0.25, 0.5],
+                       [0.5, 0, 0.75, 0.25]], dtype=float)
+    boxes = mask_boxes(bounds, grid_size=4)
+
+    assert shapely.covers(shapely.union_all(shapely.box(*boxes.T)),
+                          shapely.box(*bounds.T)).all()
+
+
+def test_single_point():
+    boxes = mask_boxes(np.array([[3.0, 4.0, 3.0, 4.0]]), grid_size=8)
+
+    assert shapely.covers(shapely.box(*boxes.T), shapely.Point(3, 4)).any()
+
+
+def test_empty():
+    assert mask_boxes(np.empty((0, 4))).shape == (0, 4)
+
+
+def test_intersects_boxes():
+    boxes = np.array([[0, 0, 1, 1], [2, 0, 3, 1]], dtype=float)
+    # Inside, touching an edge, between the boxes and outside the extent
+    bounds = np.array([[0.2, 0.2, 0.4, 0.4], [1, 0.5, 1.5, 0.6],
+                       [1.2, 0.2, 1.8, 0.4], [4, 4, 5, 5]], dtype=float)
+
+    assert intersects_boxes(bounds, boxes).tolist() == \
+        [True, True, False, False]
+    assert not intersects_boxes(bounds, np.empty((0, 4))).any()
+    assert intersects_boxes(np.empty((0, 4)), boxes).shape == (0,)
@@ -0,0 +1,46 @@
+"""
+Tests of the reprojection to UTM
+"""
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+from pyproj import Transformer
+
+from reproject import SOURCE_CRS, TARGET_CRS, reproject, transform_coords
+
+
+def _coords(n: int = 1000, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(-54, -48, n),
+                            rng.uniform(-26, -22, n)])
+
+
+@pytest.mark.parametrize('threads, chunk_size', [(1, 100), (4, 100),
+                                                 (4, 300), (8, 10 ** 6)])
+def test_chunks_match_single_transform(threads, chunk_size):
+    coords = _coords()
+    x, y = Transformer.from_crs(SOURCE_CRS, TARGET_CRS, always_xy=True) \
+        .transform(coords[:, 0], coords[:, 1])
+
+    result = transform_coords(coords, threads=threads, chunk_size=chunk_size)
+
+    # The chunks are concatenated in the order of the coordinates
+    assert np.array_equal(result, np.column_stack([x, y]))
+
+
+def test_empty():
+    assert transform_coords(np.empty((0, 2))).shape == (0, 2)
+
+
+def test_reproject_geometries():
+    gdf = gpd.GeoDataFrame(geometry=shapely.points(_coords(10)),
+                           crs=SOURCE_CRS)
+
+    result = reproject(gdf, threads=4)
+
+    assert result.crs == TARGET_CRS
+    assert np.allclose(shapely.get_coordinates(result.geometry.array),
+                       shapely.get_coordinates(
+                           gdf.to_crs(TARGET_CRS).geometry.array))
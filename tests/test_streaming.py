@@ -0,0 +1,103 @@
+"""
+Tests of the processing of CAR in batches
+"""
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from loaders import iter_arrow
+import process_streaming
+from verify import compare, read_results
+
+
+def _write_layers(path, crs: str = 'EPSG:4674', size: float = 0.01,
+                  fmt: str = 'shp') -> tuple:
+    """CAR with 5 squares and an alert over the first 3"""
+    x = np.arange(5) * size
+    car = path.joinpath(f'car.{fmt}').__str__()
+    gdf_car = gpd.GeoDataFrame(
+        {'cod_imovel': [f'P{i}' for i in range(5)],
+         'des_condic': ['em analise'] * 5},
+        geometry=shapely.box(x, 0, x + size, size), crs=crs)
+    mp = path.joinpath(f'mp.{fmt}').__str__()
+    gdf_mp = gpd.GeoDataFrame(
+        {'cod_alerta': [1]},
+        geometry=[shapely.box(0, 0, 2.5 * size, size / 2)], crs=crs)
+    if fmt == 'parquet':
+        gdf_car.to_parquet(car)
+        gdf_mp.to_parquet(mp)
+    else:
+        gdf_car.to_file(car)
+        gdf_mp.to_file(mp)
+    return car, mp
+
+
+def _run(car: str = '', mp: str = '', path=None,
+         **kwargs) -> gpd.GeoDataFrame:
+    process_streaming.run(car, mp, path.__str__(), fmt='parquet', **kwargs)
+    return read_results(path.joinpath('results_streaming.parquet')
+                        .__str__()).sort_values('cod_imovel')
+
+
+def test_crs_of_parquet(tmp_path):
+    # Squares of 1 km in UTM, the CRS of the layer and not EPSG:4674
+    car, mp = _write_layers(tmp_path, crs='EPSG:31982', size=1000,
+                            fmt='parquet')
+    gdf = _run(car, mp, tmp_path)
+
+    assert gdf['cod_imovel'].tolist() == ['P0', 'P1', 'P2']
+    assert np.allclose(gdf['area_ha'], [50, 50, 25])
+
+
+def _write_split_layers(path) -> tuple:
+    """CAR with 40 squares, whose properties have up to 3 features far from
+    each other, and alerts over part of them"""
+    i = np.arange(40)
+    x, y = (i % 8) * 0.01, (i // 8) * 0.01
+    car = path.joinpath('car_split.shp').__str__()
+    gpd.GeoDataFrame(
+        {'cod_imovel': [f'P{k:02d}' for k in i % 15],
+         'des_condic': np.where(i % 7 == 3, 'cancelado', 'em analise')},
+        geometry=shapely.box(x, y, x + 0.01, y + 0.01),
+        crs='EPSG:4674').to_file(car)
+    mp = path.joinpath('mp_split.shp').__str__()
+    gpd.GeoDataFrame(
+        {'cod_alerta': [1, 2]},
+        geometry=[shapely.box(0.005, 0.005, 0.035, 0.025),
+                  shapely.box(0.052, 0.032, 0.075, 0.045)],
+        crs='EPSG:4674').to_file(mp)
+    return car, mp
+
+
+def test_split_properties(tmp_path):
+    car, mp = _write_split_layers(tmp_path)
+    boxes = np.array([[0, 0, 0.04, 0.03]])
+
+    for batch_boxes in (None, boxes):
+        # Batches of the processing, with the geometries
+        codes = [batch['cod_imovel'].to_pylist()
+                 for _, _, batch in iter_arrow(
+                     car, columns=['cod_imovel'],
+                     contains={'des_condic': 'analise'}, batch_size=6,
+                     boxes=batch_boxes)]
+        in_batches = {}
+        for i, batch in enumerate(codes):
+            for code in batch:
+                in_batches.setdefault(code, set()).add(i)
+        expected = sorted(c for c, b in in_batches.items() if len(b) > 1)
+
+        split = process_streaming.split_properties(car, 6, batch_boxes)
+        assert expected and sorted(split) == expected
+
+
+@pytest.mark.parametrize('prefilter', [False, True])
+def test_batches_match_single_batch(tmp_path, prefilter):
+    car, mp = _write_split_layers(tmp_path)
+
+    expected = _run(car, mp, tmp_path, batch_size=1000, prefilter=prefilter)
+    actual = _run(car, mp, tmp_path, batch_size=6, prefilter=prefilter)
+
+    assert len(expected) > 5
+    assert compare(expected, actual)['ok']
@@ -0,0 +1,97 @@
+"""
+Tests of the comparison of the results
+"""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from verify import compare
+
+
+def _results(n: int = 5) -> gpd.GeoDataFrame:
+    """Squares of 100 x 100 m, each one a property"""
+    x = np.arange(n) * 200.
+    return gpd.GeoDataFrame(
+        {'cod_imovel': [f'P{i}' for i in range(n)], 'area_ha': np.ones(n)},
+        geometry=shapely.box(x, 0, x + 100, 100), crs='EPSG:31982')
+
+
+def test_equivalent():
+    expected = _results()
+    # Same geometries, in another order and with other vertices
+    actual = expected.iloc[::-1].copy()
+    actual['geometry'] = shapely.segmentize(
+        np.asarray(actual.geometry.array), 10)
+
+    report = compare(expected, actual)
+    assert report['ok']
+    assert report['common'] == 5
+    assert report['geom_max_symdiff'] < 1e-6
+    assert report['vertices_actual'] > report['vertices_expected']
+
+
+def test_area_delta():
+    expected = _results()
+    actual = expected.copy()
+    actual.loc[2, 'area_ha'] += 0.01
+
+    report = compare(expected, actual)
+    assert not report['ok']
+    assert report['area_failed'] == 1
+    assert report['area_failed_sample'] == ['P2']
+    assert np.isclose(report['area_max_delta'], 0.01)
+    assert report['geom_failed'] == 0
+
+
+def test_geometry_delta():
+    expected = _results()
+    actual = expected.copy()
+    # 10 m² more, the area_ha is not changed
+    actual.loc[3, 'geometry'] = shapely.box(600, 0, 700, 100.1)
+
+    report = compare(expected, actual)
+    assert not report['ok']
+    assert report['geom_failed'] == 1
+    assert report['geom_failed_sample'] == ['P3']
+    assert np.isclose(report['geom_max_symdiff'], 10)
+    assert report['area_failed'] == 0
+
+
+def test_missing_and_duplicated():
+    expected = _results()
+    actual = gpd.GeoDataFrame(
+        pd.concat([expected.iloc[1:], expected.iloc[[1]]]),
+        crs=expected.crs)
+
+    report = compare(expected, actual)
+    assert not report['ok']
+    assert report['only_expected'] == 1
+    assert report['only_expected_sample'] == ['P0']
+    assert report['duplicated_actual'] == 1
+
+
+def test_crs():
+    expected = _results()
+    actual = expected.to_crs('EPSG:4674')
+
+    report = compare(expected, actual)
+    assert report['ok']
+
+
+def test_length_tol():
+    expected = _results()
+    actual = expected.copy()
+    # Edges moved by 0.005 m: 2 m² more, over a perimeter of 400 m
+    actual.loc[1, 'geometry'] = shapely.box(199.995, -0.005, 300.005,
+                                            100.005)
+    actual.loc[1, 'area_ha'] += 2e-4
+
+    assert not compare(expected, actual, geom_atol=0.1)['ok']
+    report = compare(expected, actual, geom_atol=0.1, length_tol=0.005)
+    assert report['ok']
+    # A larger shift is still detected
+    actual.loc[1, 'geometry'] = shapely.box(199.9, 0, 300, 100)
+    assert compare(expected, actual, geom_atol=0.1,
+                   length_tol=0.005)['geom_failed'] == 1
@@ -0,0 +1,81 @@
+"""
+Tests of the layer writers
+"""
+
+import json
+
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+import shapely
+
+from writers import LayerWriter, results_path
+
+
+def _polygons(n: int = 10, start: int = 0) -> gpd.GeoDataFrame:
+    """Squares of 1 x 1 along the X axis"""
+    x = np.arange(start, start + n, dtype=float)
+    return gpd.GeoDataFrame(
+        {'cod_imovel': [f'P{i}' for i in range(start, start + n)],
+         'area_ha': x / 10},
+        geometry=shapely.box(x, 0, x + 1, 1), crs='EPSG:31982')
+
+
+def _read(file_path: str = '', fmt: str = '') -> gpd.GeoDataFrame:
+    # GDAL may be built without the Parquet driver
+    if fmt == 'parquet':
+        return gpd.read_parquet(file_path)
+    return gpd.read_file(file_path)
+
+
+@pytest.mark.parametrize('fmt', ['gpkg', 'fgb', 'parquet'])
+def test_round_trip(tmp_path, fmt):
+    file_path = results_path(tmp_path.__str__(), 'results', fmt)
+    with LayerWriter(file_path, layer='res', crs='EPSG:31982',
+                     row_group_size=7) as writer:
+        for start in range(0, 30, 10):
+            writer.write(_polygons(10, start))
+    assert writer.rows == 30
+
+    # The spatial index of FlatGeobuf sorts the features
+    gdf = _read(file_path, fmt).sort_values('cod_imovel')
+    expected = _polygons(30).sort_values('cod_imovel')
+    assert gdf['cod_imovel'].tolist() == expected['cod_imovel'].tolist()
+    assert np.allclose(gdf['area_ha'], expected['area_ha'])
+    assert gdf.crs.to_epsg() == 31982
+    assert (gdf.geometry.geom_type == 'MultiPolygon').all()
+    assert shapely.equals(np.asarray(gdf.geometry.array),
+                          np.asarray(expected.geometry.array)).all()
+
+
+def test_geoparquet_metadata(tmp_path):
+    file_path = results_path(tmp_path.__str__(), 'results', 'parquet')
+    with LayerWriter(file_path, crs='EPSG:31982',
+                     row_group_size=7) as writer:
+        writer.write(_polygons(10))
+        writer.write(_polygons(10, 10))
+
+    parquet = pq.ParquetFile(file_path)
+    # The batches are buffered until a full row group
+    sizes = [parquet.metadata.row_group(i).num_rows
+             for i in range(parquet.num_row_groups)]
+    assert sizes == [7, 7, 6]
+
+    geo = json.loads(parquet.schema_arrow.metadata[b'geo'])
+    column = geo['columns'][geo['primary_column']]
+    assert column['encoding'] == 'WKB'
+    assert column['geometry_types'] == ['MultiPolygon']
+    assert column['bbox'] == [0.0, 0.0, 20.0, 1.0]
+    assert column['covering']['bbox']['xmin'] == ['bbox', 'xmin']
+    assert 'bbox' in parquet.schema_arrow.names
+
+
+@pytest.mark.parametrize('fmt', ['gpkg', 'fgb', 'parquet'])
+def test_empty_layer(tmp_path, fmt):
+    file_path = results_path(tmp_path.__str__(), 'results', fmt)
+    with LayerWriter(file_path, layer='res', crs='EPSG:31982') as writer:
+        writer.write(_polygons(0))
+
+    assert writer.rows == 0
+    assert len(_read(file_path, fmt)) == 0
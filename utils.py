@@ -1,6 +1,23 @@
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from functools import wraps
+import json
+import os
+from pathlib import Path
+import sys
 import time
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Environment variable with the file path (JSON lines) to save the stages
+STAGES_FILE_ENV = 'BENCH_STAGES_FILE'
+
+# Records of the stages executed in this process
+stages = []
+
 
 def info(msg: str = '') -> None:
     """Envia uma uma mensagem no terminal com o data e hora atual
@@ -9,12 +26,185 @@ def info(msg: str = '') -> None:
     print(msg, flush=True)
 
 
+def format_time(seconds: float = 0) -> str:
+    """Format seconds as HH:MM:SS.fff"""
+    total_time = timedelta(seconds=seconds)
+    return (datetime.min + total_time).time().strftime("%H:%M:%S.%f")[:-3]
+
+
 def info_finished(start_time: float = 0) -> None:
     """Envia uma uma mensagem no terminal com o data e hora atual
     """
     finished = time.perf_counter()
-    total_time = timedelta(seconds=finished - start_time)
-    total_time_format = (datetime.min + total_time).time().strftime(
-        "%H:%M:%S.%f")[:-3]
+    total_time_format = format_time(finished - start_time)
 
+    info_stages()
     info(f'Finished in {total_time_format}')
+
+
+def info_stages() -> None:
+    """Print the time and memory of the stages executed in this process"""
+    for record in stages:
+        rss = record['peak_rss_mb']
+        msg = (f'  {record["stage"]}: {format_time(record["wall_s"])} '
+               f'(cpu {record["cpu_s"]:.3f} s')
+        if rss is not None:
+            msg += f', peak RSS {rss:.1f} MB'
+        if record['features'] is not None:
+            msg += f', {record["features"]} features'
+        if record['vertices'] is not None:
+            msg += f', {record["vertices"]} vertices'
+        print(msg + ')', flush=True)
+
+
+def input_files(file_path: str = '') -> list:
+    """Return the file and its sidecar files (.dbf, .shx, .prj...)"""
+    path = Path(file_path)
+    if path.suffix.lower() != '.shp':
+        return [path]
+
+    return sorted(p for p in path.parent.glob(f'{path.stem}.*')
+                  if p.is_file())
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak RSS of the process (Linux only)
+
+    Returns:
+        True if the peak was reset, so it refers only to the next stage
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> float | None:
+    """Peak resident set size of the process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux returns KB and macOS returns bytes
+        return maxrss / 1024 ** 2 if sys.platform == 'darwin' \
+            else maxrss / 1024
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    except (ImportError, AttributeError):
+        return None
+
+
+def total_memory() -> int | None:
+    """Physical memory of the machine in bytes"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+
+    try:
+        import psutil
+        return psutil.virtual_memory().total
+    except ImportError:
+        return None
+
+
+def count_vertices(geoms) -> int:
+    """Total number of vertices of an array/GeoSeries of geometries"""
+    import shapely
+
+    return int(shapely.get_num_coordinates(
+        getattr(geoms, 'values', geoms)).sum())
+
+
+class Stage:
+    """Measurements of a stage, filled by the context manager `stage`
+
+    The features and vertices can be set inside the block, and other values
+    of the stage can be added to details.
+    """
+
+    def __init__(self, name: str = ''):
+        self.name = name
+        self.features = None
+        self.vertices = None
+        self.details = {}
+
+    def count(self, geoms=None) -> None:
+        """Set the number of features and vertices from the geometries"""
+        self.features = len(geoms)
+        self.vertices = count_vertices(geoms)
+
+
+def cpu_time() -> float:
+    """CPU time (user + system) of the process and of its finished child
+    processes, in seconds"""
+    times = os.times()
+    return times.user + times.system + times.children_user + \
+        times.children_system
+
+
+def _emit(record: dict = None) -> None:
+    stages.append(record)
+
+    file_path = os.environ.get(STAGES_FILE_ENV)
+    if file_path:
+        with open(file_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+@contextmanager
+def stage(name: str = ''):
+    """Instrument a stage of the processing
+
+    Records the wall time, CPU time (including the child processes finished
+    in the block) and peak RSS of the block. The record is
+    saved in `stages` and, if the environment variable BENCH_STAGES_FILE is
+    set, appended to that file as a JSON line.
+
+    Example:
+        with stage('Intersection layers') as st:
+            gdf = gpd.overlay(gdf_car, gdf_mp, how='intersection')
+            st.count(gdf.geometry)
+    """
+    info(f'{name}...')
+
+    st = Stage(name)
+    rss_scope = 'stage' if _reset_peak_rss() else 'process'
+    started = time.time()
+    start_wall = time.perf_counter()
+    start_cpu = cpu_time()
+    try:
+        yield st
+    finally:
+        _emit({
+            'stage': name,
+            'started': started,
+            'wall_s': time.perf_counter() - start_wall,
+            'cpu_s': cpu_time() - start_cpu,
+            'peak_rss_mb': peak_rss(),
+            'peak_rss_scope': rss_scope,
+            'features': st.features,
+            'vertices': st.vertices,
+            **st.details,
+        })
+
+
+def instrument(name: str = ''):
+    """Decorator version of `stage`"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,256 @@
+"""
+Script to check that the results of two engines are equivalent
+
+The results (results_*.gpkg/.fgb/.parquet) are compared by cod_imovel: the
+properties present in only one of them, the difference of area_ha of each
+property and the area of the symmetric difference of the geometries. All the
+comparisons are vectorized, so a whole state is checked in seconds.
+"""
+
+import argparse
+from pathlib import Path
+import sys
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.errors import GEOSException
+
+from loaders import read_layer
+from utils import info, stage
+
+# Tolerance of area_ha: absolute (ha) and relative to the area
+AREA_ATOL = 1e-4
+AREA_RTOL = 1e-6
+
+# Tolerance of the area of the symmetric difference: absolute (units of the
+# CRS, m² in UTM) and relative to the area of the geometry
+GEOM_ATOL = 1.0
+GEOM_RTOL = 1e-6
+
+# Number of cod_imovel listed in the report for each failed check
+SAMPLE_SIZE = 10
+
+
+def read_results(file_path: str = '') -> gpd.GeoDataFrame:
+    """Results of an engine with the columns cod_imovel, area_ha and
+    geometry"""
+    gdf = read_layer(file_path, columns=['cod_imovel', 'area_ha'])
+    gdf['cod_imovel'] = gdf['cod_imovel'].astype(str)
+    gdf['area_ha'] = gdf['area_ha'].astype(float)
+
+    return gdf
+
+
+def _symmetric_difference_area(left: np.ndarray = None,
+                               right: np.ndarray = None) -> np.ndarray:
+    """Area of the symmetric difference of each pair of geometries
+
+    The invalid geometries (Ex.: self-intersections after an overlay) are
+    fixed with make_valid when GEOS can not compute the difference.
+    """
+    try:
+        return shapely.area(shapely.symmetric_difference(left, right))
+    except GEOSException:
+        return shapely.area(shapely.symmetric_difference(
+            shapely.make_valid(left), shapely.make_valid(right)))
+
+
+def _sample(values: np.ndarray = None) -> list:
+    return [str(v) for v in values[:SAMPLE_SIZE]]
+
+
+def compare(expected: gpd.GeoDataFrame = None, actual: gpd.GeoDataFrame = None,
+            area_atol: float = AREA_ATOL, area_rtol: float = AREA_RTOL,
+            geom_atol: float = GEOM_ATOL, geom_rtol: float = GEOM_RTOL,
+            length_tol: float = 0) -> dict:
+    """Compare two results by cod_imovel
+
+    Args:
+        expected: Results of the reference engine
+        actual: Results of the engine to check
+        area_atol: Absolute tolerance of area_ha
+        area_rtol: Relative tolerance of area_ha
+        geom_atol: Absolute tolerance of the area of the symmetric
+            difference of the geometries
+        geom_rtol: Tolerance of the area of the symmetric difference
+            relative to the area of the geometry
+        length_tol: Distance the edges may move (units of the CRS, Ex.:
+            half a cell of a precision grid). The perimeter times this
+            distance is added to the tolerances of area_ha and of the
+            symmetric difference
+
+    Returns:
+        Report of the comparison, with ok False if any check failed
+    """
+    if actual.crs is not None and expected.crs is not None and \
+            actual.crs != expected.crs:
+        actual = actual.to_crs(expected.crs)
+
+    report = {'expected': len(expected), 'actual': len(actual)}
+
+    # Each property must have a single feature
+    dup_expected = expected['cod_imovel'].duplicated().to_numpy()
+    dup_actual = actual['cod_imovel'].duplicated().to_numpy()
+    report['duplicated_expected'] = int(dup_expected.sum())
+    report['duplicated_actual'] = int(dup_actual.sum())
+    expected, actual = expected[~dup_expected], actual[~dup_actual]
+
+    cod_expected = expected['cod_imovel'].to_numpy()
+    cod_actual = actual['cod_imovel'].to_numpy()
+    only_expected = np.setdiff1d(cod_expected, cod_actual)
+    only_actual = np.setdiff1d(cod_actual, cod_expected)
+    report['only_expected'] = len(only_expected)
+    report['only_actual'] = len(only_actual)
+    report['only_expected_sample'] = _sample(only_expected)
+    report['only_actual_sample'] = _sample(only_actual)
+
+    common, idx_expected, idx_actual = np.intersect1d(
+        cod_expected, cod_actual, assume_unique=True, return_indices=True)
+    report['common'] = len(common)
+
+    geom_expected = np.asarray(expected.geometry.array)[idx_expected]
+    geom_actual = np.asarray(actual.geometry.array)[idx_actual]
+    # Area (m² in UTM) swept by the edges moved by length_tol
+    moved = shapely.length(geom_expected) * length_tol
+
+    area_expected = expected['area_ha'].to_numpy()[idx_expected]
+    area_actual = actual['area_ha'].to_numpy()[idx_actual]
+    area_delta = np.abs(area_expected - area_actual)
+    area_failed = ~(area_delta <= area_atol + area_rtol *
+                    np.abs(area_expected) + moved / 1e4)
+    report['area_max_delta'] = float(area_delta.max()) if len(common) else 0.
+    # Error of the total area, relative to the expected total
+    report['area_rel_error'] = float(area_delta.sum() /
+                                     np.abs(area_expected).sum()) \
+        if np.abs(area_expected).sum() else 0.
+    report['area_failed'] = int(area_failed.sum())
+    report['area_failed_sample'] = _sample(common[area_failed])
+
+    symdiff = _symmetric_difference_area(geom_expected, geom_actual)
+    geom_failed = ~(symdiff <= geom_atol + geom_rtol *
+                    shapely.area(geom_expected) + moved)
+    report['geom_max_symdiff'] = float(np.nanmax(symdiff)) \
+        if len(common) else 0.
+    report['geom_failed'] = int(geom_failed.sum())
+    report['geom_failed_sample'] = _sample(common[geom_failed])
+
+    report['vertices_expected'] = int(
+        shapely.get_num_coordinates(geom_expected).sum())
+    report['vertices_actual'] = int(
+        shapely.get_num_coordinates(geom_actual).sum())
+
+    # Reported only, the area of an invalid geometry can still be right
+    report['invalid_expected'] = int((~shapely.is_valid(geom_expected)).sum())
+    report['invalid_actual'] = int((~shapely.is_valid(geom_actual)).sum())
+
+    report['ok'] = not (report['duplicated_expected'] or
+                        report['duplicated_actual'] or
+                        report['only_expected'] or report['only_actual'] or
+                        report['area_failed'] or report['geom_failed'])
+
+    return report
+
+
+def log_report(report: dict = None) -> None:
+    """Print the report of the comparison"""
+    info(f'{report["common"]} properties in common, '
+         f'{report["only_expected"]} only in the expected results, '
+         f'{report["only_actual"]} only in the actual results')
+    if report['duplicated_expected'] or report['duplicated_actual']:
+        info(f'Duplicated cod_imovel: {report["duplicated_expected"]} '
+             f'expected, {report["duplicated_actual"]} actual')
+    if report['invalid_expected'] or report['invalid_actual']:
+        info(f'Invalid geometries: {report["invalid_expected"]} expected, '
+             f'{report["invalid_actual"]} actual')
+    info(f'area_ha: max delta {report["area_max_delta"]:.3g} ha, '
+         f'relative error {report["area_rel_error"]:.3g}, '
+         f'{report["area_failed"]} out of tolerance')
+    info(f'Geometry: max symmetric difference '
+         f'{report["geom_max_symdiff"]:.3g}, {report["geom_failed"]} out of '
+         f'tolerance')
+    for key in ('only_expected', 'only_actual', 'area_failed',
+                'geom_failed'):
+        if report[f'{key}_sample']:
+            info(f'{key}: {", ".join(report[f"{key}_sample"])}')
+    info('Results are equivalent' if report['ok'] else
+         'Results are NOT equivalent')
+
+
+def run(expected_file_path: str = '', actual_file_path: str = '',
+        area_atol: float = AREA_ATOL, area_rtol: float = AREA_RTOL,
+        geom_atol: float = GEOM_ATOL, geom_rtol: float = GEOM_RTOL,
+        length_tol: float = 0) -> dict:
+    """Compare the results files
+
+    Returns:
+        Report of the comparison (see `compare`)
+    """
+    with stage('Loading results') as st:
+        expected = read_results(expected_file_path)
+        actual = read_results(actual_file_path)
+        st.features = len(expected) + len(actual)
+
+    with stage('Comparing results') as st:
+        report = compare(expected, actual, area_atol, area_rtol, geom_atol,
+                         geom_rtol, length_tol)
+        st.features = report['common']
+
+    log_report(report)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-expected', type=str, required=True, dest='expected',
+        help='File path of the reference results (Ex.: results_geopandas.gpkg)'
+    )
+    parser.add_argument(
+        '-actual', type=str, required=True, dest='actual',
+        help='File path of the results to check'
+    )
+    parser.add_argument(
+        '-area_atol', type=float, default=AREA_ATOL, dest='area_atol',
+        help=f'Absolute tolerance of area_ha (default: {AREA_ATOL} ha)'
+    )
+    parser.add_argument(
+        '-area_rtol', type=float, default=AREA_RTOL, dest='area_rtol',
+        help=f'Relative tolerance of area_ha (default: {AREA_RTOL})'
+    )
+    parser.add_argument(
+        '-geom_atol', type=float, default=GEOM_ATOL, dest='geom_atol',
+        help=f'Absolute tolerance of the area of the symmetric difference '
+             f'(default: {GEOM_ATOL} m²)'
+    )
+    parser.add_argument(
+        '-geom_rtol', type=float, default=GEOM_RTOL, dest='geom_rtol',
+        help=f'Tolerance of the area of the symmetric difference relative to '
+             f'the area (default: {GEOM_RTOL})'
+    )
+
+    parser.add_argument(
+        '-length_tol', type=float, default=0, dest='length_tol',
+        help='Distance the edges may move, added to the tolerances as the '
+             'perimeter times it (Ex.: half a cell of the -grid in m, '
+             'default: 0)'
+    )
+
+    args = parser.parse_args()
+
+    if not Path(args.expected).exists():
+        print(f'File {args.expected} not found.')
+        return
+    if not Path(args.actual).exists():
+        print(f'File {args.actual} not found.')
+        return
+
+    report = run(args.expected, args.actual, args.area_atol, args.area_rtol,
+                 args.geom_atol, args.geom_rtol, args.length_tol)
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
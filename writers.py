@@ -0,0 +1,388 @@
+"""
+Functions to save the results
+
+The layers are written from Arrow tables with the geometries in WKB, so the
+engines can stream the results to the file without building a GeoDataFrame,
+and the features are inserted in bulk instead of one by one:
+
+- GeoPackage: each write is a single transaction of GDAL, and the R-tree
+  index is created once at the end (or not at all).
+- FlatGeobuf: the batches are streamed to a single write of GDAL, running
+  in a background thread, through a bounded queue (the driver rewrites the
+  file on each append), with the packed Hilbert R-tree index.
+- GeoParquet: the batches are buffered into row groups of row_group_size
+  rows, with CRS, bbox and a bbox covering column in the metadata.
+"""
+
+import json
+from pathlib import Path
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+from pyproj import CRS
+
+# Output format -> (extension, GDAL driver)
+FORMATS = {
+    'gpkg': ('.gpkg', 'GPKG'),
+    'fgb': ('.fgb', 'FlatGeobuf'),
+    'parquet': ('.parquet', None),
+}
+
+GEOPARQUET_VERSION = '1.1.0'
+
+COMPRESSIONS = ['zstd', 'snappy', 'gzip', 'none']
+
+# Number of rows of each row group of the GeoParquet files
+ROW_GROUP_SIZE = 65536
+
+# Minimum number of rows of each transaction of the GeoPackage
+TRANSACTION_ROWS = 100000
+
+# Number of batches waiting in the queue of the FlatGeobuf stream
+STREAM_BATCHES = 4
+
+BBOX_FIELDS = ('xmin', 'ymin', 'xmax', 'ymax')
+
+
+def results_path(path_results: str = '', name: str = '',
+                 fmt: str = 'gpkg') -> str:
+    """File path of the results with the extension of the format"""
+    return Path(path_results, name + FORMATS[fmt][0]).__str__()
+
+
+def to_arrow(gdf=None, multi: bool = True) -> pa.Table:
+    """Arrow table of the GeoDataFrame with the geometry column in WKB
+
+    Args:
+        gdf: GeoDataFrame
+        multi: Convert the polygons to multipolygons, so all the features
+            have the same geometry type
+    """
+    geoms = np.asarray(gdf.geometry.array)
+    if multi:
+        is_polygon = shapely.get_type_id(geoms) == \
+            shapely.GeometryType.POLYGON
+        if is_polygon.any():
+            geoms = geoms.copy()
+            geoms[is_polygon] = shapely.multipolygons(
+                geoms[is_polygon], indices=np.arange(is_polygon.sum()))
+
+    df = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Empty object columns have no type
+    table = table.cast(pa.schema([
+        f.with_type(pa.string()) if pa.types.is_null(f.type) else f
+        for f in table.schema]))
+
+    return table.append_column('geometry', pa.array(shapely.to_wkb(geoms),
+                                                    pa.binary()))
+
+
+def _bbox_array(batch: pa.RecordBatch = None,
+                geom_col: str = 'geometry') -> pa.StructArray:
+    """Bounding box of the WKB geometries of the batch"""
+    wkb = batch[geom_col].to_numpy(zero_copy_only=False)
+    bounds = shapely.bounds(shapely.from_wkb(wkb))
+
+    return pa.StructArray.from_arrays(
+        [pa.array(bounds[:, i]) for i in range(4)], names=list(BBOX_FIELDS))
+
+
+def geo_metadata(geom_col: str = 'geometry', crs=None, bbox: list = None,
+                 geometry_types: list = None,
+                 bbox_col: str = 'bbox') -> dict:
+    """GeoParquet metadata of a file with one WKB geometry column"""
+    column = {'encoding': 'WKB', 'geometry_types': geometry_types or []}
+    if crs is not None:
+        column['crs'] = CRS.from_user_input(crs).to_json_dict()
+    if bbox is not None:
+        column['bbox'] = bbox
+    if bbox_col:
+        column['covering'] = {'bbox': {k: [bbox_col, k]
+                                       for k in BBOX_FIELDS}}
+
+    return {'version': GEOPARQUET_VERSION, 'primary_column': geom_col,
+            'columns': {geom_col: column}}
+
+
+class LayerWriter:
+    """Writer of a layer in batches
+
+    Example:
+        with LayerWriter(file_path, layer='res', crs='EPSG:31982') as writer:
+            for gdf in batches:
+                writer.write(gdf)
+    """
+
+    def __init__(self, file_path: str = '', layer: str = '', crs=None,
+                 fmt: str = None, geometry_type: str = 'MultiPolygon',
+                 spatial_index: bool = True, compression: str = 'zstd',
+                 row_group_size: int = ROW_GROUP_SIZE,
+                 bbox_col: str = 'bbox'):
+        """
+        Args:
+            file_path: File path of the layer
+            layer: Name of the layer (GeoPackage)
+            crs: CRS of the geometries (anything accepted by pyproj)
+            fmt: One of FORMATS. Default: from the extension of file_path
+            geometry_type: Geometry type of the layer. The GeoDataFrames
+                are converted to multi when it is MultiPolygon, the Arrow
+                data must already have this type
+            spatial_index: Create the spatial index (GeoPackage and
+                FlatGeobuf)
+            compression: One of COMPRESSIONS (GeoParquet)
+            row_group_size: Number of rows of each row group (GeoParquet)
+            bbox_col: Name of the bbox covering column (GeoParquet). It is
+                taken from the data when present (struct xmin, ymin, xmax,
+                ymax), otherwise computed from the geometries. None to not
+                write it
+        """
+        self.file_path = file_path
+        self.layer = layer
+        self.crs = crs
+        self.fmt = fmt or next(f for f, (ext, _) in FORMATS.items()
+                               if Path(file_path).suffix.lower() == ext)
+        self.geometry_type = geometry_type
+        self.spatial_index = spatial_index
+        self.compression = None if compression == 'none' else compression
+        self.row_group_size = row_group_size
+        self.bbox_col = bbox_col
+        self.rows = 0
+
+        self._schema = None
+        self._pending = []
+        self._pending_rows = 0
+        self._started = False
+        self._parquet = None
+        self._queue = None
+        self._thread = None
+        self._error = None
+        self._bounds = [np.inf, np.inf, -np.inf, -np.inf]
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data=None) -> None:
+        """Write a GeoDataFrame, an Arrow table or batch (WKB column
+        geometry) or all the batches of a RecordBatchReader"""
+        if isinstance(data, pa.RecordBatchReader):
+            self._schema = data.schema
+            for batch in data:
+                self.write(batch)
+            return
+        if not isinstance(data, (pa.Table, pa.RecordBatch)):
+            data = to_arrow(data, multi=self.geometry_type == 'MultiPolygon')
+
+        self._schema = data.schema
+        self.rows += data.num_rows
+        if self.fmt == 'parquet':
+            for batch in pa.table(data).to_batches():
+                self._write_parquet(batch)
+            return
+        if self.fmt == 'fgb':
+            for batch in pa.table(data).to_batches():
+                self._stream(batch)
+            return
+
+        self._pending.append(data)
+        self._pending_rows += data.num_rows
+        if self._pending_rows >= TRANSACTION_ROWS:
+            self._flush()
+
+    def _write_options(self) -> dict:
+        """Arguments of pyogrio.write_arrow"""
+        crs = CRS.from_user_input(self.crs).to_wkt() \
+            if self.crs is not None else None
+        return {'layer': self.layer or None, 'driver': FORMATS[self.fmt][1],
+                'geometry_name': 'geometry',
+                'geometry_type': self.geometry_type, 'crs': crs}
+
+    def _stream(self, batch: pa.RecordBatch = None) -> None:
+        """Put the batch in the queue of the FlatGeobuf stream, started by
+        the first batch"""
+        if self._thread is None:
+            self._queue = queue.Queue(maxsize=STREAM_BATCHES)
+            schema = batch.schema
+
+            def batches():
+                while (item := self._queue.get()) is not None:
+                    yield item
+
+            reader = pa.RecordBatchReader.from_batches(schema, batches())
+            self._thread = threading.Thread(target=self._write_stream,
+                                            args=(reader,), daemon=True)
+            self._thread.start()
+
+        # The put waits while the queue is full, unless the write failed
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _write_stream(self, reader: pa.RecordBatchReader = None) -> None:
+        try:
+            pyogrio.write_arrow(
+                reader, self.file_path,
+                layer_options={'SPATIAL_INDEX':
+                               'YES' if self.spatial_index else 'NO'},
+                **self._write_options())
+        except Exception as e:
+            self._error = e
+            # Unblock the producer and drop the batches not written
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _close_stream(self) -> None:
+        """End the FlatGeobuf stream and wait for the write"""
+        if self._thread is None:
+            if self._schema is None:
+                return
+            # No rows, the file has only the layer
+            self._stream(pa.RecordBatch.from_pylist([], schema=self._schema))
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _flush(self) -> None:
+        """Write the pending tables to the GDAL layer in a single call"""
+        tables = [pa.table(t) for t in self._pending]
+        table = pa.concat_tables(tables) if tables else \
+            self._schema.empty_table()
+
+        layer_options = None
+        if not self._started:
+            layer_options = {'SPATIAL_INDEX':
+                             'YES' if self.spatial_index else 'NO'}
+        pyogrio.write_arrow(table, self.file_path, append=self._started,
+                            layer_options=layer_options,
+                            **self._write_options())
+
+        self._started = True
+        self._pending, self._pending_rows = [], 0
+
+    def _write_parquet(self, batch: pa.RecordBatch = None) -> None:
+        if self.bbox_col and self.bbox_col not in batch.schema.names:
+            batch = batch.append_column(self.bbox_col, _bbox_array(batch))
+        if self.bbox_col and batch.num_rows:
+            xmin, ymin, xmax, ymax = (
+                batch[self.bbox_col].field(f).to_numpy(zero_copy_only=False)
+                for f in BBOX_FIELDS)
+            self._bounds = [min(self._bounds[0], np.nanmin(xmin)),
+                            min(self._bounds[1], np.nanmin(ymin)),
+                            max(self._bounds[2], np.nanmax(xmax)),
+                            max(self._bounds[3], np.nanmax(ymax))]
+
+        if self._parquet is None:
+            self._open_parquet(batch.schema)
+        # Small batches are buffered, so the row groups have row_group_size
+        # rows and their statistics stay selective
+        self._pending.append(batch)
+        self._pending_rows += batch.num_rows
+        if self._pending_rows >= self.row_group_size:
+            self._flush_parquet()
+
+    def _flush_parquet(self, final: bool = False) -> None:
+        """Write the full row groups of the pending batches (and the rest,
+        when final)"""
+        table = pa.Table.from_batches(self._pending)
+        full = table.num_rows if final else \
+            table.num_rows // self.row_group_size * self.row_group_size
+        if full:
+            self._parquet.write_table(table.slice(0, full),
+                                      row_group_size=self.row_group_size)
+        rest = table.slice(full)
+        self._pending = rest.to_batches() if rest.num_rows else []
+        self._pending_rows = rest.num_rows
+
+    def _open_parquet(self, schema: pa.Schema = None) -> None:
+        if self.bbox_col and self.bbox_col not in schema.names:
+            schema = schema.append(pa.field(self.bbox_col, pa.struct(
+                [(f, pa.float64()) for f in BBOX_FIELDS])))
+        # Without the Arrow schema in the file, the readers take the schema
+        # metadata from the key-value metadata, where "geo" is added at the
+        # end
+        self._parquet = pq.ParquetWriter(self.file_path, schema,
+                                         compression=self.compression,
+                                         store_schema=False)
+
+    def close(self) -> int:
+        """Write the pending data and the metadata
+
+        Returns:
+            Number of rows written
+        """
+        if self._closed:
+            return self.rows
+        self._closed = True
+
+        if self.fmt == 'fgb':
+            self._close_stream()
+            return self.rows
+        if self.fmt != 'parquet':
+            if self._pending or (not self._started and self._schema):
+                self._flush()
+            return self.rows
+
+        if self._parquet is None:
+            if self._schema is None:
+                return self.rows
+            # No rows, the file has only the schema
+            self._open_parquet(self._schema)
+        if self._pending:
+            self._flush_parquet(final=True)
+
+        bbox = [float(v) for v in self._bounds] \
+            if self.rows and self.bbox_col else None
+        geometry_types = [self.geometry_type] \
+            if self.geometry_type and self.geometry_type != 'Unknown' \
+            else None
+        metadata = geo_metadata('geometry', crs=self.crs, bbox=bbox,
+                                geometry_types=geometry_types,
+                                bbox_col=self.bbox_col)
+        self._parquet.add_key_value_metadata({'geo': json.dumps(metadata)})
+        self._parquet.close()
+        self._parquet = None
+
+        return self.rows
+
+
+def write_layer(data=None, file_path: str = '', layer: str = '', crs=None,
+                **kwargs) -> int:
+    """Write a GeoDataFrame or Arrow data to the file
+
+    See `LayerWriter` for the arguments. The CRS of a GeoDataFrame is used
+    by default.
+
+    Returns:
+        Number of rows written
+    """
+    if crs is None:
+        crs = getattr(data, 'crs', None)
+
+    with LayerWriter(file_path, layer=layer, crs=crs, **kwargs) as writer:
+        writer.write(data)
+
+    return writer.rows